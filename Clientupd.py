@@ -1,29 +1,165 @@
-from udp import ReliableUDP
+import json
+import os
+import tempfile
 
-client = ReliableUDP()
+from udp import ReliableUDP, TIMEOUT
+from new_code.httpparser import ResponseParser
+
+# The server's first RTO is TIMEOUT and doubles on each loss, so wait out a
+# few of them before deciding a response isn't coming
+client = ReliableUDP(read_timeout=4 * TIMEOUT)
 client.bind(('127.0.0.1', 0))  # Let OS pick free port
 server_addr = ('127.0.0.1', 8080)
 
-# Send GET request and wait for response
-request = (
-    "GET / HTTP/1.0\r\n"
-    "Host: 127.0.0.1\r\n"
-    "User-Agent: ReliableClient\r\n\r\n"
+# One persistent HTTP/1.1 connection on stream 0: responses may arrive as
+# several messages (files are streamed) or several in one message
+# (pipelining), so everything the server sends on it goes through one
+# parser, which hands the responses back in the order the requests were sent
+responses = client.makefile(server_addr, stream=0)
+parser = ResponseParser()
+ready = []
+
+
+def send_requests(*requests):
+    """Send requests back to back (pipelined) in one message"""
+    for request in requests:
+        parser.expect(request.split(b" ", 1)[0].decode())
+    client.reliable_send(server_addr, b"".join(requests))
+
+
+def read_response():
+    """Next response, in request order"""
+    while not ready:
+        for chunk in responses.chunks():
+            ready.extend(parser.feed(chunk))
+            if ready:
+                break
+    return ready.pop(0)
+
+
+def download(path, dest):
+    """Fetch path into the file dest, reusing what is already there. A
+    complete copy is revalidated with its ETag, or with its Last-Modified
+    date if the server sent no ETag, and a 304 means nothing is
+    transferred. A partial copy left by an interrupted download is resumed
+    with a Range request for the missing bytes (If-Range makes the server
+    send the whole file instead if it has changed since). The validators
+    are kept next to the file in dest + ".meta". Returns the response."""
+    meta_path, part = dest + ".meta", dest + ".part"
+    meta = {}
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+
+    lines = [f"GET {path} HTTP/1.1", "Host: 127.0.0.1"]
+    etag, last_modified = meta.get("etag"), meta.get("last_modified")
+    if meta.get("complete") and os.path.exists(dest) and (etag or last_modified):
+        lines.append(f"If-None-Match: {etag}" if etag else f"If-Modified-Since: {last_modified}")
+    elif (etag or last_modified) and os.path.exists(part):
+        lines += [f"Range: bytes={os.path.getsize(part)}-", f"If-Range: {etag or last_modified}"]
+
+    def save_meta(response, complete):
+        with open(meta_path, "w") as f:
+            json.dump({"etag": response.header("etag"),
+                       "last_modified": response.header("last-modified"),
+                       "complete": complete}, f)
+
+    out = None
+
+    def on_body(response, data):
+        # The body goes straight to disk, so whatever arrived before an
+        # interruption is kept for the next attempt
+        nonlocal out
+        if out is None:
+            save_meta(response, complete=False)
+            out = open(part, "ab" if response.status == 206 else "wb")
+        out.write(data)
+
+    parser.expect("GET", on_body)
+    client.reliable_send(server_addr, ("\r\n".join(lines) + "\r\n\r\n").encode())
+    try:
+        response = read_response()
+    finally:
+        if out is not None:
+            out.close()
+
+    if response.status in (200, 206):
+        if out is None:  # empty file
+            open(part, "wb").close()
+        os.replace(part, dest)
+        save_meta(response, complete=True)
+    elif response.status == 416:
+        # The partial copy doesn't fit the file any more; start over
+        os.remove(part)
+        os.remove(meta_path)
+        return download(path, dest)
+    return response
+
+
+def fetch_concurrently(paths):
+    """GET several paths at once, each on a stream of its own, like
+    parallel connections. The responses come back independently, so one
+    held up by a lost segment doesn't delay the others; they are returned
+    in the order of paths."""
+    streams = {stream: ResponseParser() for stream in range(1, len(paths) + 1)}
+    for stream_parser in streams.values():
+        stream_parser.expect("GET")
+    client.send_streams(server_addr, {
+        stream: [f"GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n".encode()]
+        for stream, path in zip(streams, paths)})
+    done = {}
+    while len(done) < len(streams):
+        data, addr, stream = client.reliable_recv_stream()
+        if addr == server_addr and stream in streams:
+            for response in streams[stream].feed(data):
+                print(f"[Stream {stream}] {response.status} {response.reason}, "
+                      f"{len(response.body)} bytes for {paths[stream - 1]}")
+                done[stream] = response
+    return [done[stream] for stream in streams]
+
+
+def show(response):
+    print("[Response]\n", response, response.headers)
+    print(response.body.decode(errors="replace"))
+
+
+get_root = (
+    b"GET / HTTP/1.1\r\n"
+    b"Host: 127.0.0.1\r\n"
+    b"User-Agent: ReliableClient\r\n\r\n"
+)
+post = (
+    b"POST /submit HTTP/1.1\r\n"
+    b"Host: 127.0.0.1\r\n"
+    b"Content-Length: 14\r\n"
+    b"Content-Type: text/plain\r\n\r\n"
+    b"Hello, Server!"
 )
+
+# Send GET request and wait for response
 print("Sending GET request...")
-client.reliable_send(server_addr, request.encode())
-response, _ = client.reliable_recv()
-print("[Response]\n", response.decode())
+send_requests(get_root)
+show(read_response())
 
 # Send POST request and wait for response
-request = (
-    "POST /submit HTTP/1.0\r\n"
-    "Host: 127.0.0.1\r\n"
-    "Content-Length: 13\r\n"
-    "Content-Type: text/plain\r\n\r\n"
-    "Hello, Server!"
-)
 print("Sending POST request...")
-client.reliable_send(server_addr, request.encode())
-response, _ = client.reliable_recv()
-print("[Response]\n", response.decode())
+send_requests(post)
+show(read_response())
+
+# Pipeline several requests on the same connection, the last one closing it
+print("Sending pipelined requests...")
+send_requests(get_root, b"GET /missing HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n",
+              post.replace(b"Host: 127.0.0.1\r\n", b"Host: 127.0.0.1\r\nConnection: close\r\n"))
+for _ in range(3):
+    show(read_response())
+
+# Download a file, then again: the second time the server only confirms
+# that the copy is current
+dest = os.path.join(tempfile.gettempdir(), "reliableudp-index.html")
+for _ in range(2):
+    response = download("/index.html", dest)
+    print(f"[Download] {response.status} {response.reason}, {os.path.getsize(dest)} bytes in {dest}")
+
+# Several requests side by side on separate streams
+print("Fetching concurrently...")
+fetch_concurrently(["/", "/index.html", "/missing"])
@@ -1,47 +1,128 @@
+import os
+import socket
+import sys
+import types
+from http import HTTPStatus
+
 from udp import ReliableUDP
+from new_code.stream import read_chunks
+from new_code.httpparser import RequestParser, ParseError
+from new_code.filecache import FileCache
+
+# GET requests are served from files under this directory; another one can
+# be given on the command line
+DOC_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+
+
+def response_head(status, length, keep_alive, content_type=None):
+    """Status line and headers; every response has a Content-Length so the
+    client can find where it ends on a persistent connection"""
+    lines = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}", f"Content-Length: {length}"]
+    if content_type:
+        lines.append(f"Content-Type: {content_type}")
+    lines.append("Connection: keep-alive" if keep_alive else "Connection: close")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode()
+
+
+def end_head(head, keep_alive):
+    """Finish a status line and headers with the Connection header"""
+    return head + (b"Connection: keep-alive\r\n\r\n" if keep_alive else b"Connection: close\r\n\r\n")
+
+
+def file_chunks(entry, head, span):
+    """Head, then part of a file that isn't cached, or isn't wanted whole,
+    as messages to stream; only one chunk of it is in memory at a time,
+    whatever its size"""
+    start, stop = span
+    yield head
+    with open(entry.path, "rb") as f:
+        f.seek(start)
+        yield from read_chunks(f, limit=stop - start)
+
+
+def respond(request, pending):
+    """Answer one request. Responses are added to pending, so the answers
+    to pipelined requests go out together; a file that isn't cached is
+    added as a generator of chunks, streamed after whatever is before it."""
+    print("[Request]\n", request, request.headers)
+    keep_alive = request.keep_alive
+
+    if request.method in ("GET", "HEAD"):
+        entry = files.lookup(request.target)
+        if entry is None:
+            pending.append(response_head(404, 0, keep_alive))
+            return
+        # 200, or 304 / 206 / 416 for conditional and Range requests
+        head, span = entry.respond(request.method, request.headers)
+        head = end_head(head, keep_alive)
+        if span is None:
+            pending.append(head)
+        elif span == (0, entry.size) and entry.data is not None:
+            # Cached: the body is already segmented and checksummed
+            pending += [head, files.body(entry)]
+        else:
+            pending.append(file_chunks(entry, head, span))
+
+    elif request.method == "POST":
+        print("Received POST data:", request.body)
+        body = b"Data received"
+        pending.append(response_head(200, len(body), keep_alive, "text/plain") + body)
+
+    else:
+        pending.append(response_head(404, 0, keep_alive))
+
+
+def messages(parts):
+    """The messages of a stream's pending responses"""
+    for part in parts:
+        if isinstance(part, types.GeneratorType):
+            yield from part  # a streamed file
+        else:
+            yield part
+
 
 server = ReliableUDP()
 server.bind(('127.0.0.1', 8080))
-print("Server ready...")
+files = FileCache(sys.argv[1] if len(sys.argv) > 1 else DOC_ROOT, prepare=server.prepare)
+print("Server ready, serving", files.root)
 
+# Requests may span several messages and one message may hold several
+# pipelined requests, so each client stream has its own parser that keeps
+# any partial request between them. A client can use several streams like
+# separate connections: each is answered on the stream it asked on and a
+# loss on one doesn't hold up the others. The protocol has no connections
+# to close: after a request without keep-alive the stream's parser is
+# dropped, and a client's parsers go with its peer state once it has been
+# idle for the server's idle_timeout.
+parsers = {}
 
 while True:
-    request_data, addr = server.reliable_recv()
-    request = request_data.decode()
-    print("[Request]\n", request)
-
-    lines = request.splitlines()
-    if not lines:
-        continue
-
-    method, path, _ = lines[0].split()
-
-    if method == "GET":
-        if path == "/":
-            body = "<h1>Welcome to ReliableUDP HTTP Server</h1>"
-            response = (
-                "HTTP/1.0 200 OK\r\n"
-                f"Content-Length: {len(body)}\r\n"
-                "Content-Type: text/html\r\n\r\n"
-                + body
-            )
-        else:
-            response = "HTTP/1.0 404 Not Found\r\nContent-Length: 0\r\n\r\n"
-
-        server.reliable_send(addr, response.encode())
-
-    elif method == "POST":
-        content = request.split("\r\n\r\n", 1)[-1]
-        print("Received POST data:", content)
-        body = "Data received"
-        response = (
-            "HTTP/1.0 200 OK\r\n"
-            f"Content-Length: {len(body)}\r\n"
-            "Content-Type: text/plain\r\n\r\n"
-            + body
-        )
-        server.reliable_send(addr, response.encode())
+    try:
+        batch = [server.reliable_recv_stream()]
+    except socket.timeout:
+        batch = []  # idle; keep serving
+    # Whatever else has arrived is answered in the same round, so the
+    # responses on different streams go out side by side
+    while server.ready:
+        batch.append(server.reliable_recv_stream())
 
-    else:
-        response = "HTTP/1.0 404 Not Found\r\nContent-Length: 0\r\n\r\n"
-        server.reliable_send(addr, response.encode())
+    pending = {}  # addr -> {stream: responses}
+    for data, addr, stream in batch:
+        parser = parsers.setdefault((addr, stream), RequestParser())
+        out = pending.setdefault(addr, {}).setdefault(stream, [])
+        try:
+            for request in parser.feed(data):
+                respond(request, out)
+                if not request.keep_alive:
+                    del parsers[addr, stream]
+                    break
+        except ParseError as error:
+            print("[Bad request]", error)
+            out.append(response_head(error.status, 0, keep_alive=False))
+            parsers.pop((addr, stream), None)
+
+    for addr, streams in pending.items():
+        server.send_streams(addr, {stream: messages(parts) for stream, parts in streams.items()})
+
+    for key in [key for key in parsers if key[0] not in server.peers]:
+        del parsers[key]  # the client was idle and has been forgotten
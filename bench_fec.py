@@ -0,0 +1,82 @@
+# bench_fec.py
+"""Goodput of ReliableUDP with forward error correction against ARQ alone.
+
+The sender's packets, parity included, go through unreliable_sendto's
+simulated random loss. With FEC most single losses in a block are
+rebuilt by the receiver from parity, so fewer segments wait for a fast
+retransmit or, at the end of a message, a retransmission timeout.
+Each case is run several times and the median is shown, since one timeout
+more or less dominates a run.
+
+Usage: python bench_fec.py [size_kb] [runs]
+       (defaults: 500 KB, 5 runs per loss rate and mode)
+"""
+import contextlib
+import io
+import re
+import socket
+import statistics
+import sys
+import threading
+import time
+
+from udp import ReliableUDP
+
+HOST = '127.0.0.1'
+LOSS_RATES = (0.01, 0.05, 0.1)
+CASES = [
+    ("ARQ only", dict()),
+    ("FEC 8+1", dict(fec_block=8, fec_ratio=0.125)),
+    ("FEC 8+2", dict(fec_block=8, fec_ratio=0.25)),
+    ("FEC 16+2", dict(fec_block=16, fec_ratio=0.125)),
+]
+
+
+def run(size, loss_rate, **options):
+    receiver = ReliableUDP(timeout=2.0, loss_rate=0.0)
+    receiver.bind((HOST, 0))
+    sender = ReliableUDP(timeout=2.0, loss_rate=loss_rate, window_size=256, **options)
+    sender.bind((HOST, 0))
+    data = bytes(size)
+    received = []
+
+    def receive():
+        while not received:
+            try:
+                received.append(receiver.reliable_recv()[0])
+            except socket.timeout:
+                pass
+
+    thread = threading.Thread(target=receive, daemon=True)
+    thread.start()
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):  # per-packet logging, counted below
+        start = time.perf_counter()
+        sender.reliable_send(receiver.server.getsockname(), data)
+        thread.join()
+        elapsed = time.perf_counter() - start
+    sender.close()
+    receiver.close()
+    assert received[0] == data
+    log = log.getvalue()
+    resent = sum(int(n) for n in re.findall(r"retransmit(?:ting)? (?:of )?(\d+)", log))
+    return elapsed, resent, log.count("[FEC] Recovered")
+
+
+def main():
+    size = int(sys.argv[1]) * 1000 if len(sys.argv) > 1 else 500_000
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    print(f"{size:,} bytes, median of {runs} runs")
+    for loss_rate in LOSS_RATES:
+        print(f"{loss_rate:.0%} loss")
+        for name, options in CASES:
+            results = [run(size, loss_rate, **options) for _ in range(runs)]
+            elapsed = statistics.median(result[0] for result in results)
+            resent = statistics.median(result[1] for result in results)
+            recovered = statistics.median(result[2] for result in results)
+            print(f"  {name:10} {elapsed:6.2f} s  {size / elapsed / 1000:8.1f} KB/s goodput  "
+                  f"{resent:6.0f} resent  {recovered:6.0f} rebuilt from parity")
+
+
+if __name__ == "__main__":
+    main()
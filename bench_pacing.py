@@ -0,0 +1,139 @@
+# bench_pacing.py
+"""Loss and goodput of ReliableUDP with and without send pacing.
+
+The sender's DATA packets go through a bottleneck relay: a link of fixed
+rate behind a small drop-tail queue, like a slow hop or a NIC ring. A
+window sent back to back overflows the queue and loses a run of packets,
+which unreliable_sendto's independent random drops never produce. ACKs
+come back without delay.
+
+Usage: python bench_pacing.py [size_kb] [link_pps] [queue]
+       (defaults: 1000 KB over a 2000 packets/s link with a 16 packet queue)
+"""
+import collections
+import contextlib
+import io
+import socket
+import sys
+import threading
+import time
+
+from udp import ReliableUDP, MAX_DATAGRAM
+
+HOST = '127.0.0.1'
+
+
+class Bottleneck:
+    """Relay sender -> receiver at link_pps with a queue of `queue` packets"""
+
+    def __init__(self, receiver_addr, link_pps, queue):
+        self.receiver_addr = receiver_addr
+        self.interval = 1 / link_pps
+        self.queue = queue
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 << 20)
+        self.sock.bind((HOST, 0))
+        self.sock.settimeout(0.2)
+        self.addr = self.sock.getsockname()
+        self.sender_addr = None
+        self.pending = collections.deque()  # (departure time, datagram)
+        self.link_free_at = 0.0
+        self.lock = threading.Condition()
+        self.arrived = self.dropped = 0
+        self.running = True
+        self.threads = [threading.Thread(target=self._ingress, daemon=True),
+                        threading.Thread(target=self._egress, daemon=True)]
+        for thread in self.threads:
+            thread.start()
+
+    def _ingress(self):
+        while self.running:
+            try:
+                data, addr = self.sock.recvfrom(MAX_DATAGRAM)
+            except socket.timeout:
+                continue
+            if addr == self.receiver_addr:
+                if self.sender_addr is not None:
+                    self.sock.sendto(data, self.sender_addr)  # ACKs skip the queue
+                continue
+            self.sender_addr = addr
+            now = time.monotonic()
+            with self.lock:
+                self.arrived += 1
+                if len(self.pending) >= self.queue:
+                    self.dropped += 1
+                    continue
+                self.link_free_at = max(self.link_free_at, now) + self.interval
+                self.pending.append((self.link_free_at, data))
+                self.lock.notify()
+
+    def _egress(self):
+        while self.running:
+            with self.lock:
+                while not self.pending and self.running:
+                    self.lock.wait(0.2)
+                if not self.pending:
+                    continue
+                depart, data = self.pending[0]
+            delay = depart - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            with self.lock:
+                self.pending.popleft()
+            self.sock.sendto(data, self.receiver_addr)
+
+    def close(self):
+        self.running = False
+        for thread in self.threads:
+            thread.join()
+        self.sock.close()
+
+
+def run(size, link_pps, queue, **options):
+    receiver = ReliableUDP(timeout=2.0, loss_rate=0.0)
+    receiver.bind((HOST, 0))
+    sender = ReliableUDP(timeout=2.0, loss_rate=0.0, window_size=256, **options)
+    sender.bind((HOST, 0))
+    link = Bottleneck(receiver.server.getsockname(), link_pps, queue)
+    data = bytes(size)
+    received = []
+
+    def receive():
+        while not received:
+            try:
+                received.append(receiver.reliable_recv()[0])
+            except socket.timeout:
+                pass
+
+    thread = threading.Thread(target=receive, daemon=True)
+    thread.start()
+    with contextlib.redirect_stdout(io.StringIO()):  # per-packet logging
+        start = time.perf_counter()
+        sender.reliable_send(link.addr, data)
+        thread.join()
+        elapsed = time.perf_counter() - start
+    link.close()
+    sender.close()
+    receiver.close()
+    assert received[0] == data
+    return elapsed, link.arrived, link.dropped
+
+
+def main():
+    size = int(sys.argv[1]) * 1000 if len(sys.argv) > 1 else 1_000_000
+    link_pps = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    queue = int(sys.argv[3]) if len(sys.argv) > 3 else 16
+    cases = [
+        ("no pacing", dict(congestion_control="newreno")),
+        ("paced by cwnd/srtt", dict(congestion_control="paced")),
+        ("paced at link rate", dict(congestion_control="newreno", pacing_rate=link_pps)),
+    ]
+    print(f"{size:,} bytes over a {link_pps} packets/s link, {queue} packet queue")
+    for name, options in cases:
+        elapsed, sent, dropped = run(size, link_pps, queue, **options)
+        print(f"  {name:20} {elapsed:6.2f} s  {size / elapsed / 1000:8.1f} KB/s goodput  "
+              f"{sent:6} packets sent  {dropped / sent:6.1%} lost")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,363 @@
+# aio.py
+"""asyncio transport for the reliable layer.
+
+One datagram endpoint serves every connection: retransmission timers are
+loop.call_later callbacks instead of blocking socket timeouts, so a single
+process can hold thousands of connections. Framing, segmentation and RTT
+estimation are shared with udp.TCP.
+"""
+import asyncio
+import random
+import time
+from collections import OrderedDict
+
+from packet import Packet, FLAG_SYN, FLAG_ACK, FLAG_FIN, FLAG_DATA
+from segment import segment, Reassembler
+from rtt import RTTEstimator, MIN_RTO
+import congestion
+from pacing import TokenBucket, PACING_BURST
+from udp import InFlight, MSS, WINDOW_SIZE, MAX_RTO, HANDSHAKE_RETRIES, FIN_TIMEOUT
+
+
+class ReliableProtocol(asyncio.DatagramProtocol):
+    """Parse datagrams into Packets and hand them to on_packet(pkt, addr)"""
+
+    def __init__(self, on_packet=None):
+        self.on_packet = on_packet
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        try:
+            pkt = Packet.from_bytes(data)
+        except ValueError:
+            return  # corrupted, the sender will retransmit
+        if self.on_packet is not None:
+            self.on_packet(pkt, addr)
+
+
+class AsyncConnection:
+    def __init__(self, transport, peer_addr, window_size=WINDOW_SIZE, min_rto=MIN_RTO,
+                 max_rto=MAX_RTO, max_retries=15, congestion_control="newreno", pacing_rate=None,
+                 pacing_burst=PACING_BURST):
+        self.loop = asyncio.get_running_loop()
+        self.transport = transport
+        self.peer_addr = peer_addr
+        self.seq = random.randint(1000, 5000)
+        self.ack_num = 0
+        self.window_size = window_size
+        self.max_retries = max_retries
+        self.rtt = RTTEstimator(min_rto=min_rto, max_rto=max_rto)
+        self.cc = congestion.create(congestion_control)
+        self.pacing_rate = pacing_rate  # fixed packets/s, or None to follow cc
+        self.pacer = TokenBucket(pacing_rate, pacing_burst)
+
+        self.in_flight = OrderedDict()  # seq -> InFlight
+        self.timer = None               # retransmission TimerHandle
+        self.progress = asyncio.Event() # set whenever in_flight shrinks or we fail
+        self.send_lock = asyncio.Lock() # one message at a time, segments stay in order
+        self.failed = False
+
+        self.recv_buffer = {}  # seq -> payload, out-of-order packets
+        self.reassembler = Reassembler()
+        self.messages = asyncio.Queue()  # complete messages, None at end of stream
+
+        self.established = False
+        self.peer_closed = False
+        self.handshake = None  # future resolved by SYN-ACK (client) / ACK (server)
+        self.syn_ack = None    # server side, resent on a duplicate SYN
+        self.fin_acked = None
+        self.on_close = None
+
+    @property
+    def srtt(self):
+        """Smoothed round-trip time in seconds (None before the first sample)"""
+        return self.rtt.srtt
+
+    @property
+    def rto(self):
+        """Current retransmission timeout in seconds"""
+        return self.rtt.rto
+
+    @property
+    def cwnd(self):
+        """Congestion window in segments"""
+        return self.cc.cwnd
+
+    @property
+    def ssthresh(self):
+        """Slow start threshold in segments"""
+        return self.cc.ssthresh
+
+    def _sendto(self, packet):
+        self.transport.sendto(packet.to_bytes(), self.peer_addr)
+
+    # ---- sending ----
+
+    async def send(self, data):
+        """Send one message; returns True once every segment is acknowledged"""
+        async with self.send_lock:
+            for payload in segment(data, MSS):
+                while len(self.in_flight) >= min(self.window_size, self.cc.window) and not self.failed:
+                    await self._wait_progress()
+                if self.failed:
+                    return False
+                delay = self.pacer.delay()
+                while delay > 0:
+                    await asyncio.sleep(delay)
+                    delay = self.pacer.delay()
+                packet = Packet(seq_num=self.seq, ack_num=self.ack_num, flags=FLAG_DATA, payload=payload)
+                self._sendto(packet)
+                self.in_flight[packet.seq_num] = InFlight(packet, time.monotonic())
+                self.seq += 1
+                if self.pacing_rate is None:
+                    self.pacer.rate = self.cc.pacing_rate(self.rtt.srtt)
+                self.pacer.consume()
+                if self.timer is None:
+                    self._arm_timer()
+
+            while self.in_flight and not self.failed:
+                await self._wait_progress()
+            return not self.failed
+
+    async def _wait_progress(self):
+        self.progress.clear()
+        await self.progress.wait()
+
+    def _arm_timer(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if self.in_flight:
+            base = next(iter(self.in_flight.values()))
+            delay = max(base.timer + self.rtt.rto - time.monotonic(), 0)
+            self.timer = self.loop.call_later(delay, self._on_timeout)
+
+    def _on_timeout(self):
+        self.timer = None
+        if not self.in_flight:
+            return
+        base = next(iter(self.in_flight.values()))
+        if base.attempts >= self.max_retries:
+            print("[Send] Max retries reached, giving up")
+            self.failed = True
+            self.progress.set()
+            return
+        self.rtt.backoff()
+        self.cc.on_timeout(base.packet.seq_num, self.seq)
+        self._sendto(base.packet)
+        self.pacer.consume()
+        now = time.monotonic()
+        base.sent_at = now
+        base.attempts += 1
+        # Restart the timers of later packets so they are not
+        # retransmitted before the hole has had a chance to fill
+        for entry in self.in_flight.values():
+            entry.timer = now
+        self._arm_timer()
+
+    def _on_ack(self, pkt):
+        newest = None
+        retransmitted = False
+        acked = 0
+        while self.in_flight and next(iter(self.in_flight)) < pkt.ack_num:
+            _, newest = self.in_flight.popitem(last=False)
+            retransmitted |= newest.attempts > 1
+            acked += 1
+        if newest is None:
+            return
+        self.cc.on_ack(acked)
+        # Karn's rule: no sample if the ACK may be for a retransmission
+        if not retransmitted:
+            self.rtt.sample(time.monotonic() - newest.sent_at)
+        else:
+            self.rtt.restore()
+        self._arm_timer()
+        self.progress.set()
+
+    # ---- receiving ----
+
+    async def recv(self):
+        """Next complete message, or None once the peer has closed"""
+        if self.peer_closed and self.messages.empty():
+            return None
+        return await self.messages.get()
+
+    def _on_data(self, pkt):
+        seq = pkt.seq_num
+        if seq == self.ack_num:
+            self._deliver(pkt.payload)
+            self.ack_num += 1
+            while self.ack_num in self.recv_buffer:
+                self._deliver(self.recv_buffer.pop(self.ack_num))
+                self.ack_num += 1
+        elif self.ack_num < seq < self.ack_num + self.window_size and seq not in self.recv_buffer:
+            self.recv_buffer[seq] = bytes(pkt.payload)
+        self._sendto(Packet(seq_num=self.seq, ack_num=self.ack_num, flags=FLAG_ACK))
+
+    def _deliver(self, payload):
+        try:
+            message = self.reassembler.feed(payload)
+        except ValueError:
+            return  # a bad segment is dropped
+        if message is not None:
+            self.messages.put_nowait(message)
+
+    def packet_received(self, pkt):
+        if pkt.is_syn:
+            if pkt.is_ack and self.handshake is not None and not self.handshake.done():
+                self.handshake.set_result(pkt)
+            elif pkt.is_ack:
+                # Our final handshake ACK was lost, repeat it
+                self._sendto(Packet(seq_num=self.seq, ack_num=self.ack_num, flags=FLAG_ACK))
+            return
+
+        if not self.established and self.handshake is not None and not self.handshake.done():
+            # Server side: the client's ACK (or its first data) completes the handshake
+            self.handshake.set_result(pkt)
+
+        if pkt.is_data:
+            self._on_data(pkt)
+        elif pkt.is_fin:
+            self.peer_closed = True
+            self._sendto(Packet(seq_num=self.seq, ack_num=pkt.seq_num + 1, flags=FLAG_ACK))
+            self.messages.put_nowait(None)
+        elif pkt.is_ack:
+            if self.fin_acked is not None and pkt.ack_num == self.seq + 1 and not self.fin_acked.done():
+                self.fin_acked.set_result(True)
+            self._on_ack(pkt)
+
+    # ---- lifecycle ----
+
+    async def _connect(self):
+        """Client side of the three-way handshake"""
+        syn = Packet(seq_num=self.seq, ack_num=0, flags=FLAG_SYN)
+        self.seq += 1  # SYN consumes a sequence number
+        self.handshake = self.loop.create_future()
+        for attempt in range(HANDSHAKE_RETRIES):
+            self._sendto(syn)
+            sent_at = time.monotonic()
+            try:
+                pkt = await asyncio.wait_for(asyncio.shield(self.handshake), self.rtt.rto)
+            except asyncio.TimeoutError:
+                self.rtt.backoff()
+                continue
+            if attempt == 0:
+                self.rtt.sample(time.monotonic() - sent_at)
+            self.ack_num = pkt.seq_num + 1
+            self._sendto(Packet(seq_num=self.seq, ack_num=self.ack_num, flags=FLAG_ACK))
+            self.established = True
+            return True
+        return False
+
+    async def close(self):
+        """Send FIN (unless the peer closed first) and release the connection"""
+        if self.established and not self.peer_closed and not self.failed:
+            fin = Packet(seq_num=self.seq, ack_num=self.ack_num, flags=FLAG_FIN)
+            self.fin_acked = self.loop.create_future()
+            for _ in range(HANDSHAKE_RETRIES):
+                self._sendto(fin)
+                try:
+                    await asyncio.wait_for(asyncio.shield(self.fin_acked), FIN_TIMEOUT)
+                    break
+                except asyncio.TimeoutError:
+                    continue
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        self.established = False
+        if self.on_close is not None:
+            self.on_close(self)
+
+
+class AsyncListener:
+    """Accept connections on one datagram endpoint, demultiplexed by peer
+    address and the client's initial sequence number (see udp.Listener)"""
+
+    def __init__(self, **conn_options):
+        self.conn_options = conn_options
+        self.transport = None
+        self.addr = None
+        self.connections = {}  # peer addr -> (isn, AsyncConnection)
+        self.accepted = asyncio.Queue()
+
+    def _on_packet(self, pkt, addr):
+        entry = self.connections.get(addr)
+        if pkt.is_syn and not pkt.is_ack:
+            if entry is None or entry[0] != pkt.seq_num:
+                self._new_connection(pkt, addr)
+            else:
+                entry[1]._sendto(entry[1].syn_ack)  # SYN-ACK was lost
+            return
+        if entry is not None:
+            entry[1].packet_received(pkt)
+
+    def _new_connection(self, syn, addr):
+        conn = AsyncConnection(self.transport, addr, **self.conn_options)
+        conn.ack_num = syn.seq_num + 1
+        conn.syn_ack = Packet(seq_num=conn.seq, ack_num=conn.ack_num, flags=FLAG_SYN | FLAG_ACK)
+        conn.seq += 1  # SYN consumes a sequence number
+        conn.handshake = conn.loop.create_future()
+        conn.on_close = self._remove
+        self.connections[addr] = (syn.seq_num, conn)
+
+        sent_at = time.monotonic()
+        conn._sendto(conn.syn_ack)
+
+        def established(future):
+            if future.cancelled():
+                return
+            if future.result().is_ack:
+                conn.rtt.sample(time.monotonic() - sent_at)
+            conn.established = True
+            self.accepted.put_nowait(conn)
+
+        conn.handshake.add_done_callback(established)
+
+    def _remove(self, conn):
+        entry = self.connections.get(conn.peer_addr)
+        if entry is not None and entry[1] is conn:
+            del self.connections[conn.peer_addr]
+
+    async def accept(self):
+        """Wait for the next connection that completed its handshake"""
+        return await self.accepted.get()
+
+    def close(self):
+        for _, conn in list(self.connections.values()):
+            if conn.timer is not None:
+                conn.timer.cancel()
+        self.connections.clear()
+        self.transport.close()
+
+
+async def create_listener(ip='127.0.0.1', port=12345, **conn_options):
+    loop = asyncio.get_running_loop()
+    listener = AsyncListener(**conn_options)
+    transport, _ = await loop.create_datagram_endpoint(
+        lambda: ReliableProtocol(listener._on_packet), local_addr=(ip, port))
+    listener.transport = transport
+    listener.addr = transport.get_extra_info("sockname")
+    return listener
+
+
+async def open_connection(ip='127.0.0.1', port=12345, **conn_options):
+    """Connect to a listener; returns an AsyncConnection or None if the
+    handshake fails"""
+    loop = asyncio.get_running_loop()
+    protocol = ReliableProtocol()
+    transport, _ = await loop.create_datagram_endpoint(lambda: protocol, local_addr=('0.0.0.0', 0))
+    conn = AsyncConnection(transport, (ip, port), **conn_options)
+
+    def on_packet(pkt, addr):
+        if addr == conn.peer_addr:
+            conn.packet_received(pkt)
+
+    protocol.on_packet = on_packet
+    conn.on_close = lambda _: transport.close()
+    if await conn._connect():
+        return conn
+    transport.close()
+    return None
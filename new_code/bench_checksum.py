@@ -0,0 +1,43 @@
+# bench_checksum.py
+"""Throughput of each checksum algorithm across payload sizes, against the
+byte sum the root stack used before (sum(data) % 256).
+
+Usage: python bench_checksum.py [megabytes]   (default 64 MB per case)
+"""
+import os
+import sys
+import time
+
+import checksum
+
+SIZES = (64, 512, 1024, 8192, 65536)
+
+
+def byte_sum(data, value=0):
+    return (value + sum(data)) % 256
+
+
+def bench(compute, payload, total):
+    rounds = max(total // len(payload), 1)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        compute(payload)
+    elapsed = time.perf_counter() - start
+    return rounds * len(payload) / elapsed / 1e6, elapsed / rounds * 1e9
+
+
+def main():
+    total = int(sys.argv[1]) * 1_000_000 if len(sys.argv) > 1 else 64_000_000
+    cases = [(name, algorithm.compute) for name, algorithm in checksum.ALGORITHMS.items()]
+    cases.append(("sum % 256 (old)", byte_sum))
+    print(f"{total / 1e6:,.0f} MB per case; MB/s and ns per payload, by payload size")
+    print(f"  {'':16}" + "".join(f"{size:>18,} B  " for size in SIZES))
+    for name, compute in cases:
+        # The byte sum is a Python-level loop; a slice of the data will do
+        amount = total // 100 if compute is byte_sum else total
+        results = [bench(compute, os.urandom(size), amount) for size in SIZES]
+        print(f"  {name:16}" + "".join(f"{rate:9,.0f} {ns:8,.0f} ns " for rate, ns in results))
+
+
+if __name__ == "__main__":
+    main()
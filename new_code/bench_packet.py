@@ -0,0 +1,82 @@
+# bench_packet.py
+"""Compare the __slots__/int-flags Packet against the old dict-based one.
+
+Usage: python bench_packet.py [count]   (default 1,000,000 packets)
+"""
+import sys
+import time
+import struct
+import tracemalloc
+import zlib
+
+from packet import Packet, HEADER_FORMAT, FLAG_ACK, FLAG_DATA
+
+
+class DictPacket:
+    """The previous Packet: per-instance __dict__ and a flags dict"""
+
+    def __init__(self, seq_num=0, ack_num=0, flags=None, payload=b""):
+        if flags is None:
+            flags = {"SYN": False, "ACK": False, "FIN": False}
+        self.seq_num = seq_num
+        self.ack_num = ack_num
+        self.flags = flags
+        self.payload = payload
+        self.checksum = self.compute_checksum()
+        self.corrupted = False
+
+    def compute_checksum(self):
+        header = struct.pack(HEADER_FORMAT, self.seq_num, self.ack_num,
+                             self.flags_to_byte(), len(self.payload))
+        return zlib.crc32(header + self.payload)
+
+    def flags_to_byte(self):
+        byte = 0
+        if self.flags.get("SYN"): byte |= 0b00000001
+        if self.flags.get("ACK"): byte |= 0b00000010
+        if self.flags.get("FIN"): byte |= 0b00000100
+        if self.flags.get("DATA"): byte |= 0b00001000
+        return byte
+
+    def to_bytes(self):
+        header = struct.pack(HEADER_FORMAT, self.seq_num, self.ack_num,
+                             self.flags_to_byte(), len(self.payload))
+        return header + struct.pack("!I", self.checksum) + self.payload
+
+
+def bench_time(make, count):
+    start = time.perf_counter()
+    for i in range(count):
+        make(i).to_bytes()
+    return time.perf_counter() - start
+
+
+def bench_memory(make, count):
+    tracemalloc.start()
+    packets = [make(i) for i in range(count)]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del packets
+    return size
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    payload = b"x" * 64
+    cases = [
+        ("dict flags", lambda i: DictPacket(i, 0, {"DATA": True, "ACK": True}, payload)),
+        ("slots + int flags", lambda i: Packet(i, 0, FLAG_DATA | FLAG_ACK, payload)),
+    ]
+
+    # Memory is measured on a smaller sample and scaled to keep RAM bounded
+    sample = min(count, 100_000)
+    print(f"{count:,} packets (build + to_bytes), 64-byte payload")
+    for name, make in cases:
+        elapsed = bench_time(make, count)
+        per_packet = bench_memory(make, sample) / sample
+        print(f"  {name:18} {elapsed:7.2f} s  {elapsed / count * 1e9:7.0f} ns/pkt  "
+              f"{per_packet:6.0f} B/pkt  {per_packet * count / 2**20:8.1f} MiB per {count:,}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+# bulkio.py
+"""Batched datagram I/O for the reliable stacks.
+
+A BatchSocket wraps a UDP socket in non-blocking mode. Each wakeup waits
+once in the selector and then drains every datagram already queued in the
+kernel (up to ``batch``) into preallocated buffers, so a burst costs one
+wait instead of a poll() plus recvfrom() per datagram. Outgoing packets
+can be queued with enqueue() and written together by flush(), e.g. a whole
+window of segments or all the ACKs a batch produced.
+
+CPython has no sendmmsg()/recvmmsg(), so a batch is still one syscall per
+datagram; what goes away is the wait per datagram.
+
+With offload=True on Linux the kernel does the per-datagram work instead:
+flush() hands it runs of equal-sized datagrams as one buffer with a
+UDP_SEGMENT size (GSO), and UDP_GRO lets one receive return several
+coalesced datagrams, which are split again at the size the kernel reports.
+Every queued datagram is one whole packet and a run only ends in a shorter
+one, so segment boundaries are always packet boundaries. Where the kernel
+lacks either feature the socket quietly stays on plain datagrams.
+"""
+import select
+import selectors
+import socket
+import struct
+import sys
+import time
+from collections import deque
+
+MAX_DATAGRAM = 1024
+RECV_BATCH = 64
+
+# UDP offload socket options from linux/udp.h; the socket module doesn't
+# export them
+SOL_UDP = getattr(socket, "SOL_UDP", 17)
+UDP_SEGMENT = 103
+UDP_GRO = 104
+GSO_MAX_SEGMENTS = 64  # UDP_MAX_SEGMENTS in the kernel
+GSO_MAX_BYTES = 65000  # one UDP payload is at most 65507 bytes
+GRO_BUFFER = 65535     # a coalesced receive can be this large
+GRO_BATCH = 8          # buffers per drain when they are GRO_BUFFER sized
+
+
+class BatchSocket:
+    """Socket-like wrapper that receives and sends datagrams in batches.
+
+    Attributes it doesn't define (bind, setsockopt, getsockname, ...) are
+    those of the wrapped socket.
+    """
+
+    def __init__(self, sock=None, batch=RECV_BATCH, max_datagram=MAX_DATAGRAM, offload=False):
+        self.sock = sock if sock is not None else socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        self.timeout = None
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.sock, selectors.EVENT_READ)
+
+        # Segmentation offload in use for sending (gso) and receiving (gro)
+        self.gso = self.gro = False
+        if offload:
+            self._enable_offload()
+        if self.gro:
+            batch, max_datagram = GRO_BATCH, GRO_BUFFER
+
+        # Datagrams land in these buffers; views into them are handed out
+        # and stay valid until the batch is used up and the next one drained
+        self.buffers = [bytearray(max_datagram) for _ in range(batch)]
+        self.views = [memoryview(buf) for buf in self.buffers]
+        self.pending = deque()  # (view, addr) drained but not yet returned
+        self.outbox = []        # (data, addr) waiting for flush()
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+    def settimeout(self, timeout):
+        """Timeout for recvfrom_view() and friends; the socket stays non-blocking"""
+        self.timeout = timeout
+
+    def gettimeout(self):
+        return self.timeout
+
+    def _enable_offload(self):
+        if not sys.platform.startswith("linux") or not hasattr(self.sock, "sendmsg"):
+            return
+        try:
+            self.sock.setsockopt(SOL_UDP, UDP_SEGMENT, 0)  # probe only, sizes go per send
+            self.gso = True
+        except OSError:
+            pass
+        try:
+            self.sock.setsockopt(SOL_UDP, UDP_GRO, 1)
+            self.gro = True
+        except OSError:
+            pass
+
+    # ---- receiving ----
+
+    def _drain(self):
+        """Queue the datagrams the kernel has ready; returns how many"""
+        count = 0   # buffers used
+        queued = 0
+        while count < len(self.buffers):
+            try:
+                if self.gro:
+                    nbytes, ancdata, _, addr = self.sock.recvmsg_into([self.buffers[count]],
+                                                                      socket.CMSG_SPACE(4))
+                else:
+                    nbytes, addr = self.sock.recvfrom_into(self.buffers[count])
+            except (BlockingIOError, InterruptedError):
+                break
+            if not nbytes:
+                continue  # an empty datagram carries no packet; reuse the buffer
+            view = self.views[count]
+            size = nbytes
+            if self.gro:
+                for level, kind, data in ancdata:
+                    if level == SOL_UDP and kind == UDP_GRO:
+                        size = struct.unpack("=i", data[:4])[0]
+            for offset in range(0, nbytes, size or 1):
+                self.pending.append((view[offset:min(offset + size, nbytes)], addr))
+                queued += 1
+            count += 1
+        return queued
+
+    def _wait(self, timeout):
+        """Wait up to timeout (None: forever) until a datagram is pending;
+        False if none came in time"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.pending:
+            # A wakeup that drains nothing (an empty datagram) waits again
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining < 0 or not self.selector.select(remaining):
+                return False
+            self._drain()
+        return True
+
+    def recv_batch(self, timeout=None):
+        """Wait up to timeout (None: forever) for datagrams and return every
+        ready one as a list of (memoryview, addr). An empty list means the
+        timeout expired. The views are only valid until the next receive."""
+        self._wait(timeout)
+        batch = list(self.pending)
+        self.pending.clear()
+        return batch
+
+    def recvfrom_view(self):
+        """Next datagram as (memoryview, addr), waiting up to the timeout.
+        The view is valid until the next receive call."""
+        if not self._wait(self.timeout):
+            raise socket.timeout("timed out")
+        return self.pending.popleft()
+
+    def recvfrom(self, bufsize):
+        view, addr = self.recvfrom_view()
+        return bytes(view[:bufsize]), addr
+
+    def recvfrom_into(self, buffer, nbytes=0):
+        view, addr = self.recvfrom_view()
+        size = min(len(view), nbytes or len(buffer))
+        buffer[:size] = view[:size]
+        return size, addr
+
+    # ---- sending ----
+
+    def sendto(self, data, addr):
+        """Send one datagram now"""
+        while True:
+            try:
+                return self.sock.sendto(data, addr)
+            except (BlockingIOError, InterruptedError):
+                # Send buffer full; wait until the kernel has room
+                select.select([], [self.sock], [])
+
+    def enqueue(self, data, addr):
+        """Queue a datagram for the next flush()"""
+        self.outbox.append((data, addr))
+
+    def flush(self):
+        """Send every queued datagram"""
+        outbox, self.outbox = self.outbox, []
+        if not self.gso:
+            for data, addr in outbox:
+                self.sendto(data, addr)
+            return
+
+        # Runs of datagrams to one address, all the size of the first except
+        # possibly a shorter last one, go out as one GSO send
+        start = 0
+        while start < len(outbox):
+            data, addr = outbox[start]
+            size = total = len(data)
+            end = start + 1
+            while (end < len(outbox) and end - start < GSO_MAX_SEGMENTS and outbox[end][1] == addr
+                   and len(outbox[end][0]) <= size and total + len(outbox[end][0]) <= GSO_MAX_BYTES):
+                total += len(outbox[end][0])
+                end += 1
+                if len(outbox[end - 1][0]) < size:
+                    break
+            if end - start == 1:
+                self.sendto(data, addr)
+            else:
+                self._send_segments([data for data, _ in outbox[start:end]], size, addr)
+            start = end
+
+    def _send_segments(self, datagrams, size, addr):
+        while True:
+            try:
+                self.sock.sendmsg(datagrams, [(SOL_UDP, UDP_SEGMENT, struct.pack("=H", size))], 0, addr)
+                return
+            except (BlockingIOError, InterruptedError):
+                select.select([], [self.sock], [])
+            except OSError:
+                # E.g. EIO from a device without checksum offload: from now
+                # on send datagrams one by one
+                self.gso = False
+                for data in datagrams:
+                    self.sendto(data, addr)
+                return
+
+    def close(self):
+        self.outbox.clear()
+        self.selector.close()
+        self.sock.close()
@@ -0,0 +1,93 @@
+# checksum.py
+"""Packet checksum algorithms, chosen per connection.
+
+Each Algorithm's compute(data, value=0) returns the checksum of data,
+continuing from the checksum ``value`` of the bytes before it, so a
+payload checksummed once (see PreparedMessage) only needs each packet's
+header added. Values fit in 32 bits. For the CRCs, as with zlib.crc32,
+compute(b, compute(a)) == compute(a + b). internet16 keeps no alignment:
+each piece is padded to whole words on its own, so that holds only when
+a has even length. Both ends of a connection checksum the same pieces in
+the same order, which is all the stacks need.
+
+    crc32       zlib's CRC-32, the default; zlib uses carry-less multiply
+                (PCLMULQDQ/PMULL) where the CPU has it
+    crc32c      CRC-32C (Castagnoli, as in iSCSI and SCTP), when the
+                ``crc32c`` package is installed; it uses the CPU's CRC32
+                instruction (SSE 4.2, ARMv8)
+    internet16  16-bit ones-complement sum (RFC 1071), as in IP, UDP and
+                TCP: cheap, but blind to reordered 16-bit words
+    none        no checking at all, for a path that already has it
+
+The TCP stack negotiates one like compression: the client's SYN lists the
+ones it accepts, best first (OPT_CHECKSUM in packet.py), and the server
+names the first it also accepts in the SYN-ACK; without a match both keep
+crc32. SYN packets themselves always use crc32.
+"""
+import zlib
+
+try:
+    import crc32c
+except ImportError:
+    crc32c = None
+
+INTERNET16_MODULUS = 0xFFFF  # ones-complement 16-bit arithmetic is arithmetic mod 2**16 - 1
+
+
+class Algorithm:
+    __slots__ = ("name", "id", "compute")
+
+    def __init__(self, name, algorithm_id, compute):
+        self.name = name
+        self.id = algorithm_id
+        self.compute = compute
+
+
+def _internet16(data, value=0):
+    # The sum of a buffer's 16-bit big-endian words is congruent to the
+    # buffer read as one big-endian number, since 2**16 = 1 mod 2**16 - 1:
+    # one conversion and one remainder in C instead of a loop over words.
+    # An odd-length buffer is padded with a zero byte, as RFC 1071 does;
+    # a continuation starts on a word boundary whatever came before.
+    number = int.from_bytes(data, "big")
+    if len(data) % 2:
+        number <<= 8
+    return (value + number) % INTERNET16_MODULUS
+
+
+def _none(data, value=0):
+    return 0
+
+
+CRC32 = Algorithm("crc32", 1, zlib.crc32)
+ALGORITHMS = {"crc32": CRC32, "internet16": Algorithm("internet16", 3, _internet16),
+              "none": Algorithm("none", 0, _none)}
+if crc32c is not None:
+    ALGORITHMS["crc32c"] = Algorithm("crc32c", 2, crc32c.crc32c)
+ALGORITHMS_BY_ID = {algorithm.id: algorithm for algorithm in ALGORITHMS.values()}
+
+# What a connection accepts by default, best first; "none" must be asked for
+DEFAULT_CHECKSUMS = tuple(name for name in ("crc32c", "crc32", "internet16") if name in ALGORITHMS)
+
+
+def get(name):
+    """Algorithm for a name; ValueError if it isn't available here"""
+    try:
+        return ALGORITHMS[name]
+    except KeyError:
+        raise ValueError(f"Unknown or unavailable checksum {name!r}") from None
+
+
+def offer(names):
+    """OPT_CHECKSUM value for a SYN offering these algorithms"""
+    return bytes(ALGORITHMS[name].id for name in names if name in ALGORITHMS)
+
+
+def choose(offered, names):
+    """Algorithm to use given the ids a SYN offered and the names this end
+    accepts; crc32 if they have none in common"""
+    accepted = {ALGORITHMS[name].id for name in names if name in ALGORITHMS}
+    for algorithm_id in offered:
+        if algorithm_id in accepted:
+            return ALGORITHMS_BY_ID[algorithm_id]
+    return CRC32
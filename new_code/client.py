@@ -1,5 +1,5 @@
 from udp import TCP
-from packet import Packet
+from httpparser import ResponseParser
 import time
 
 # def main():
@@ -15,33 +15,40 @@ import time
 
         # from packet import Packet
 
+def read_responses(client, parser, count):
+    """Read count responses, in the order their requests were sent"""
+    responses = []
+    while len(responses) < count:
+        data = client.recv()
+        if data is None:
+            responses += parser.close()
+            break
+        responses += parser.feed(data)
+    return responses
+
+
 def main():
     client = TCP(is_server=False, ip='127.0.0.1', port=12345)
     client.set_corruption_rate(0.7)
     if client.hand_shake():
         print("[Client] Connected successfully")
-        
-        num_pkts = 2
-        while num_pkts:
-            # Construct packet manually
-            if num_pkts==1:
-                payload = b"GET /index.html HTTP/1.0\r\n\r\n"
-                packet = Packet(seq_num=1, ack_num=0, flags={"DATA": True, "FIN":True}, payload=payload)
-            else:
-                payload = b"POST /submit HTTP/1.0\r\nContent-Length: 11\r\n\r\nHello=World"
-
-                packet = Packet(seq_num=1, ack_num=0, flags={"DATA": True}, payload=payload)
-                print(f"[Client] Sending packet with checksum: {packet.checksum}")
-            if client.send(packet.to_json().encode()):
-                print("[Client] Message successfully sent and acknowledged")
-                num_pkts-=1
-            else:
-                print("[Client] Failed to send message after retries")
-                break
-           
-                
-            
-        # time.sleep(1)
+
+        # One handshake for all of these: the connection is kept alive and
+        # the requests are pipelined, the last one asking to close it
+        requests = [
+            (b"POST", b"POST /submit HTTP/1.1\r\nContent-Length: 11\r\n\r\nHello=World"),
+            (b"GET", b"GET /index.html HTTP/1.1\r\n\r\n"),
+            (b"GET", b"GET /index.html HTTP/1.1\r\nConnection: close\r\n\r\n"),
+        ]
+        parser = ResponseParser()
+        for method, _ in requests:
+            parser.expect(method.decode())
+        if client.send_many([request for _, request in requests]):
+            print("[Client] Requests successfully sent and acknowledged")
+            for response in read_responses(client, parser, len(requests)):
+                print(f"[Client] Received response: {response}\n{response.body.decode()}")
+        else:
+            print("[Client] Failed to send requests after retries")
 
     client.close()
 
@@ -0,0 +1,119 @@
+# compress.py
+"""Per-message payload compression, negotiated in the handshake.
+
+The client's SYN lists the codecs it can use, most preferred first
+(OPT_COMPRESSION in packet.py); the server picks the first of them it also
+accepts and names it in the SYN-ACK. From then on every message both ways
+starts with one byte: 0 if the rest is the message as is, else the id of
+the codec it was compressed with. Messages shorter than ``threshold``, or
+that don't get smaller, are sent as they are, so small packets and
+incompressible data cost only that byte. Compression happens before
+segmentation, so fewer segments go on the wire.
+
+zstd is used when the ``zstandard`` package is installed.
+
+A compressed message may claim, or expand to, any size, so decompression
+stops at ``max_size`` bytes (by default the largest message a stack
+reassembles) and anything longer is rejected.
+"""
+import zlib
+
+from segment import MAX_MESSAGE
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESS_THRESHOLD = 256  # bytes; shorter messages aren't worth it
+ZLIB_LEVEL = 1            # fast: the links, not the CPU, are the bottleneck
+ZSTD_LEVEL = 3
+RAW = 0                   # marker byte of an uncompressed message
+
+
+class Codec:
+    __slots__ = ("name", "id", "compress", "decompress")
+
+    def __init__(self, name, codec_id, compress, decompress):
+        self.name = name
+        self.id = codec_id
+        self.compress = compress
+        self.decompress = decompress
+
+
+def _zlib_decompress(data, limit):
+    decompressor = zlib.decompressobj()
+    out = decompressor.decompress(data, limit + 1)
+    if len(out) > limit:
+        raise ValueError(f"Expands past {limit} bytes")
+    if not decompressor.eof:
+        raise ValueError("Truncated data")
+    return out
+
+
+def _zstd_decompress(data, limit):
+    # Not ZstdDecompressor.decompress(): it allocates whatever size the
+    # frame header claims. A stream reader only produces what is read.
+    with zstandard.ZstdDecompressor().stream_reader(data) as reader:
+        out = reader.read(limit + 1)
+    if len(out) > limit:
+        raise ValueError(f"Expands past {limit} bytes")
+    return out
+
+
+CODECS = {"zlib": Codec("zlib", 1, lambda data: zlib.compress(data, ZLIB_LEVEL), _zlib_decompress)}
+if zstandard is not None:
+    CODECS["zstd"] = Codec("zstd", 2, zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress, _zstd_decompress)
+CODECS_BY_ID = {codec.id: codec for codec in CODECS.values()}
+
+# What a connection offers by default, best first
+DEFAULT_CODECS = tuple(name for name in ("zstd", "zlib") if name in CODECS)
+
+
+def offer(names):
+    """OPT_COMPRESSION value for a SYN offering these codecs"""
+    return bytes(CODECS[name].id for name in names if name in CODECS)
+
+
+def choose(offered, names):
+    """Codec to use given the ids a SYN offered and the codec names this
+    end accepts, or None for no compression"""
+    accepted = {CODECS[name].id for name in names if name in CODECS}
+    for codec_id in offered:
+        if codec_id in accepted:
+            return CODECS_BY_ID[codec_id]
+    return None
+
+
+class Compressor:
+    """Frames the messages of one connection with the negotiated codec"""
+
+    def __init__(self, codec, threshold=COMPRESS_THRESHOLD, max_size=MAX_MESSAGE):
+        self.codec = codec
+        self.threshold = threshold
+        self.max_size = max_size  # largest message decode() produces
+
+    @property
+    def framing(self):
+        """Key for messages encoded the same way (see PreparedMessage)"""
+        return self.codec.name, self.threshold
+
+    def encode(self, message):
+        if len(message) >= self.threshold:
+            packed = self.codec.compress(message)
+            if len(packed) < len(message):
+                return bytes([self.codec.id]) + packed
+        return bytes([RAW]) + message
+
+    def decode(self, message):
+        if not message:
+            raise ValueError("Empty compressed message")
+        if message[0] == RAW:
+            return message[1:]
+        codec = CODECS_BY_ID.get(message[0])
+        if codec is None:
+            raise ValueError(f"Unknown codec id {message[0]}")
+        try:
+            return codec.decompress(memoryview(message)[1:], self.max_size)
+        except Exception as e:  # zlib.error, zstandard.ZstdError
+            raise ValueError(f"Bad {codec.name} data: {e}") from None
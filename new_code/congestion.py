@@ -0,0 +1,120 @@
+# congestion.py
+"""Congestion control for the windowed senders.
+
+A controller decides how many segments may be in flight (``window``) and,
+optionally, how fast to send them (``pacing_rate``). Senders report three
+events, with sequence numbers in their own numbering:
+
+    on_ack(n)                 n segments were newly acknowledged
+    on_loss(seq, next_seq)    seq was found lost while ACKs keep arriving
+    on_timeout(seq, next_seq) seq hit its retransmission timeout
+
+next_seq is the sender's next new sequence number; it marks the end of the
+current window so one loss episode only reduces the window once.
+"""
+from functools import partial
+
+INITIAL_CWND = 10  # segments (RFC 6928)
+MIN_CWND = 2       # floor for ssthresh
+LOSS_WINDOW = 1    # cwnd after a retransmission timeout
+
+# Pacing rate as a multiple of cwnd / srtt, as in Linux: ahead of the ACK
+# clock while probing in slow start, just above it in congestion avoidance
+SLOW_START_GAIN = 2.0
+AVOIDANCE_GAIN = 1.25
+
+
+class CongestionController:
+    """Fixed window that ignores loss; base class for real controllers"""
+
+    def __init__(self, initial_cwnd=INITIAL_CWND):
+        self.cwnd = float(initial_cwnd)
+        self.ssthresh = float("inf")
+
+    @property
+    def window(self):
+        """Segments the sender may have in flight"""
+        return max(int(self.cwnd), 1)
+
+    def pacing_rate(self, srtt):
+        """Segments per second to send at, or None to send as the window opens"""
+        return None
+
+    def on_ack(self, acked):
+        pass
+
+    def on_loss(self, seq, next_seq):
+        pass
+
+    def on_timeout(self, seq, next_seq):
+        pass
+
+
+class NewReno(CongestionController):
+    """Slow start and AIMD congestion avoidance (RFC 5681, RFC 6582).
+
+    cwnd grows by one segment per ACKed segment below ssthresh and by about
+    one segment per round trip above it. A loss halves the window once per
+    window of data; a timeout also drops cwnd to LOSS_WINDOW and slow
+    starts again. With pacing=True, sends are spread over the RTT at a rate
+    derived from cwnd / srtt instead of going out in bursts.
+    """
+
+    def __init__(self, initial_cwnd=INITIAL_CWND, pacing=False):
+        super().__init__(initial_cwnd)
+        self.pacing = pacing
+        self.recover = None    # next_seq when the window was last reduced
+        self.timed_out = None  # seq of the last retransmission timeout
+
+    def pacing_rate(self, srtt):
+        if not self.pacing or not srtt:
+            return None
+        gain = SLOW_START_GAIN if self.cwnd < self.ssthresh else AVOIDANCE_GAIN
+        return gain * self.cwnd / srtt
+
+    def on_ack(self, acked):
+        if self.cwnd < self.ssthresh:
+            self.cwnd += acked
+        else:
+            self.cwnd += acked / self.cwnd
+
+    def _reduce(self, seq, next_seq):
+        """Halve the window unless seq was sent before the last reduction"""
+        if self.recover is not None and seq < self.recover:
+            return False
+        self.ssthresh = max(self.cwnd / 2, MIN_CWND)
+        self.recover = next_seq
+        return True
+
+    def on_loss(self, seq, next_seq):
+        if self._reduce(seq, next_seq):
+            self.cwnd = self.ssthresh
+
+    def on_timeout(self, seq, next_seq):
+        # Other holes of a window that already timed out may expire one
+        # after another; only a new episode or the same segment timing out
+        # again restarts slow start, so recovery can grow the window
+        if self._reduce(seq, next_seq) or seq == self.timed_out:
+            self.cwnd = LOSS_WINDOW
+        self.timed_out = seq
+
+
+CONTROLLERS = {
+    "none": CongestionController,
+    "newreno": NewReno,
+    "paced": partial(NewReno, pacing=True),
+}
+
+
+def create(controller="newreno"):
+    """Build a controller from a name in CONTROLLERS, a class or factory, or
+    return an existing instance as is. Listeners create one per connection,
+    so give them a name or factory rather than an instance."""
+    if isinstance(controller, CongestionController):
+        return controller
+    if isinstance(controller, str):
+        try:
+            controller = CONTROLLERS[controller]
+        except KeyError:
+            raise ValueError(f"Unknown congestion controller: {controller!r}") from None
+    return controller()
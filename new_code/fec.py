@@ -0,0 +1,88 @@
+# fec.py
+"""Forward error correction with XOR parity packets.
+
+The sender splits each block of data packets into ``parity`` interleaved
+groups, packet i of the block going to group i % parity, and sends one
+parity packet per group: the XOR of the group's payloads, zero-padded to
+the longest, behind a small header with the group's stride and size and
+the XOR of the payload lengths. A receiver that has all but one packet of
+a group rebuilds the missing one from the others and the parity, without
+waiting a round trip for a retransmission. Interleaving spreads a burst
+over the groups, so a block survives up to ``parity`` consecutive losses.
+
+The redundancy ratio is parity packets per data packet; see parity_count().
+XOR runs over whole buffers at once, with NumPy when it is installed and
+Python's big integers otherwise.
+"""
+import struct
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+FEC_FORMAT = "!B B H"  # stride (groups in the block), packets in the group, XOR of their lengths
+FEC_HEADER_SIZE = struct.calcsize(FEC_FORMAT)
+MAX_BLOCK = 255        # data packets per block
+FEC_RATIO = 0.125      # default redundancy: one parity packet per 8 data packets
+
+
+def parity_count(block, ratio=FEC_RATIO):
+    """Parity packets for a block of `block` data packets at this ratio"""
+    if not 0 < block <= MAX_BLOCK:
+        raise ValueError(f"FEC block must be between 1 and {MAX_BLOCK} packets")
+    if ratio <= 0:
+        raise ValueError("FEC ratio must be positive")
+    return min(block, max(1, round(block * ratio)))
+
+
+def xor(payloads):
+    """XOR of byte strings, the shorter ones zero-padded to the longest"""
+    size = max(map(len, payloads), default=0)
+    if numpy is not None:
+        out = numpy.zeros(size, numpy.uint8)
+        for payload in payloads:
+            out[:len(payload)] ^= numpy.frombuffer(payload, numpy.uint8)
+        return out.tobytes()
+    # Little-endian, so padding a payload with zeros doesn't change its value
+    acc = 0
+    for payload in payloads:
+        acc ^= int.from_bytes(payload, "little")
+    return acc.to_bytes(size, "little")
+
+
+def encode(payloads, parity):
+    """Parity payloads for a block, one per group: the one at index j
+    protects payloads j, j + parity, j + 2 * parity, ..."""
+    parity = min(parity, len(payloads))
+    out = []
+    for group in range(parity):
+        members = payloads[group::parity]
+        lengths = 0
+        for payload in members:
+            lengths ^= len(payload)
+        out.append(struct.pack(FEC_FORMAT, parity, len(members), lengths) + xor(members))
+    return out
+
+
+def parse(payload):
+    """(stride, count) of a parity payload: it covers count packets,
+    stride apart"""
+    if len(payload) < FEC_HEADER_SIZE:
+        raise ValueError("Truncated FEC packet")
+    stride, count, _ = struct.unpack_from(FEC_FORMAT, payload)
+    if not stride or not count:
+        raise ValueError("Empty FEC group")
+    return stride, count
+
+
+def recover(payload, others):
+    """The one missing payload of a group, from its parity payload and the
+    group's other payloads"""
+    _, _, length = struct.unpack_from(FEC_FORMAT, payload)
+    for other in others:
+        length ^= len(other)
+    data = memoryview(payload)[FEC_HEADER_SIZE:]
+    if length > len(data):
+        raise ValueError("FEC group doesn't match its parity")
+    return xor([data] + list(others))[:length]
@@ -0,0 +1,216 @@
+# filecache.py
+"""Static files for the HTTP servers, with an LRU cache of hot responses.
+
+A FileCache maps request targets to files under a document root. Each
+file's entity headers (Content-Length, Content-Type, ETag, Last-Modified)
+are worked out once, and files up to ``max_entry`` bytes are kept in
+memory along with their bodies as the sending stack's prepare() makes
+them: segmented, checksummed and, for connections that negotiated
+compression, compressed, once per framing. Serving the same asset again
+costs neither a read nor a compression or checksum pass.
+Entries are checked against the file's mtime and size on every lookup and
+rebuilt when it changes; the least recently used ones are dropped once the
+cache holds more than ``max_bytes``. One cache can serve several threads.
+
+CachedFile.respond() applies a request's conditional and Range headers
+(RFC 7232, RFC 7233): a client whose copy is current gets a 304 with no
+body, and one resuming a download gets only the bytes it is missing.
+"""
+import mimetypes
+import os
+import threading
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+
+CACHE_BYTES = 32 * 1024 * 1024  # total size of the cached files
+ENTRY_BYTES = 1024 * 1024       # larger files are streamed from disk
+INDEX_FILE = "index.html"       # served for a directory
+
+
+class CachedFile:
+    __slots__ = ("path", "size", "mtime_ns", "content_type", "etag", "last_modified",
+                 "validators", "headers", "data", "bodies", "cost")
+
+    def __init__(self, path, stat, data=None):
+        self.path = path
+        self.size = stat.st_size
+        self.mtime_ns = stat.st_mtime_ns
+        self.content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        self.etag = f'"{self.mtime_ns:x}-{self.size:x}"'
+        self.last_modified = formatdate(stat.st_mtime, usegmt=True)
+        # Header lines, ready to go after a status line: those a 304 repeats,
+        # and all of them for a 200
+        self.validators = (f"ETag: {self.etag}\r\n"
+                           f"Last-Modified: {self.last_modified}\r\n").encode()
+        self.headers = (f"Content-Length: {self.size}\r\n"
+                        f"Content-Type: {self.content_type}\r\n"
+                        "Accept-Ranges: bytes\r\n").encode() + self.validators
+        self.data = data   # the content, or None to stream the file
+        self.bodies = {}   # framing -> prepared content
+        self.cost = self.size
+
+    def matches(self, stat):
+        return (self.mtime_ns, self.size) == (stat.st_mtime_ns, stat.st_size)
+
+    def respond(self, method, headers):
+        """Status line and headers (without Connection or the blank line
+        that ends them) for a GET or HEAD request with these headers, and
+        the (start, stop) byte range of the file to send, or None for no
+        body. A 200 for GET has the range (0, size)."""
+        if self._not_modified(headers):
+            return b"HTTP/1.1 304 Not Modified\r\n" + self.validators, None
+        span = self._range(headers)
+        if span is None:
+            return b"HTTP/1.1 200 OK\r\n" + self.headers, (0, self.size) if method != "HEAD" else None
+        if span is False:
+            return (b"HTTP/1.1 416 Range Not Satisfiable\r\n"
+                    + f"Content-Range: bytes */{self.size}\r\nContent-Length: 0\r\n".encode()), None
+        start, stop = span
+        head = (b"HTTP/1.1 206 Partial Content\r\n"
+                + f"Content-Range: bytes {start}-{stop - 1}/{self.size}\r\n"
+                  f"Content-Length: {stop - start}\r\n"
+                  f"Content-Type: {self.content_type}\r\n".encode()
+                + self.validators)
+        return head, span if method != "HEAD" else None
+
+    def _not_modified(self, headers):
+        if "if-none-match" in headers:
+            # Weak comparison; If-Modified-Since is then ignored
+            tags = [tag.strip() for tag in headers["if-none-match"].split(",")]
+            return "*" in tags or self.etag in (tag[2:] if tag.startswith("W/") else tag for tag in tags)
+        since = _parse_date(headers.get("if-modified-since"))
+        return since is not None and self.mtime_ns // 10**9 <= since
+
+    def _range(self, headers):
+        """(start, stop) of a satisfiable single byte range, False for an
+        unsatisfiable one, None to send the whole file"""
+        spec = headers.get("range", "")
+        if not spec.startswith("bytes=") or "," in spec:
+            return None  # only single byte ranges; for others send it all
+        if_range = headers.get("if-range")
+        if if_range is not None:
+            # Resume only if the client's part came from this version
+            if if_range.startswith(('"', 'W/"')):
+                if if_range != self.etag:
+                    return None
+            elif _parse_date(if_range) != self.mtime_ns // 10**9:
+                return None
+        first, sep, last = spec[6:].strip().partition("-")
+        if not sep or not (first.isdigit() or last.isdigit()) or (first + last).strip("0123456789"):
+            return None  # malformed: ignored (RFC 7233 3.1)
+        if not first:
+            start, stop = max(self.size - int(last), 0), self.size  # the last bytes
+        else:
+            start = int(first)
+            stop = min(int(last) + 1, self.size) if last else self.size
+            if last and stop <= start:
+                return None
+        if start >= self.size or start >= stop:
+            return False
+        return start, stop
+
+
+def _parse_date(value):
+    """Seconds since the epoch of an HTTP date, or None"""
+    if not value:
+        return None
+    try:
+        return int(parsedate_to_datetime(value).timestamp())
+    except (TypeError, ValueError):
+        return None
+
+
+class FileCache:
+    def __init__(self, root, prepare=None, max_bytes=CACHE_BYTES, max_entry=ENTRY_BYTES):
+        """prepare turns file content into what the sender sends (e.g. a
+        stack's prepare()) unless body() is given another one"""
+        self.root = os.path.realpath(root)
+        self.prepare = prepare
+        self.max_bytes = max_bytes
+        self.max_entry = min(max_entry, max_bytes)
+        self.entries = OrderedDict()  # path -> CachedFile, least recently used first
+        self.cached_bytes = 0
+        self.hits = self.misses = 0
+        self.lock = threading.Lock()
+
+    def resolve(self, target):
+        """Filesystem path for a request target, or None if it is outside the
+        document root or no file could have its name"""
+        path = target.split("?", 1)[0]
+        if any(ord(c) < 0x20 or c == "\x7f" for c in path):
+            return None  # a NUL would make os.path raise; no control bytes in names served
+        try:
+            full = os.path.realpath(os.path.join(self.root, path.lstrip("/")))
+            if os.path.commonpath([self.root, full]) != self.root:
+                return None
+            if os.path.isdir(full):
+                full = os.path.join(full, INDEX_FILE)
+        except ValueError:
+            return None
+        return full
+
+    def lookup(self, target):
+        """CachedFile for a request target, or None if there is no such file"""
+        full = self.resolve(target)
+        if full is None:
+            return None
+        with self.lock:
+            return self._lookup(full)
+
+    def _lookup(self, full):
+        try:
+            stat = os.stat(full)
+        except (OSError, ValueError):
+            self._drop(full)
+            return None
+
+        entry = self.entries.get(full)
+        if entry is not None and entry.matches(stat):
+            self.entries.move_to_end(full)
+            self.hits += 1
+            return entry
+        self.misses += 1
+        self._drop(full)
+        if not os.path.isfile(full):
+            return None
+        if stat.st_size > self.max_entry:
+            return CachedFile(full, stat)
+
+        with open(full, "rb") as f:
+            # The size and mtime of what was actually read
+            stat = os.fstat(f.fileno())
+            data = f.read()
+        if len(data) != stat.st_size:  # still being written
+            return CachedFile(full, stat)
+        entry = CachedFile(full, stat, data)
+        self.entries[full] = entry
+        self.cached_bytes += entry.cost
+        self._evict()
+        return entry
+
+    def body(self, entry, prepare=None, framing=None):
+        """The content of a cached entry as prepare (default: the one given
+        to the cache) makes it, built on first use for each framing; the
+        content itself if there is no prepare"""
+        prepare = prepare or self.prepare
+        if prepare is None:
+            return entry.data
+        with self.lock:
+            body = entry.bodies.get(framing)
+            if body is None:
+                body = entry.bodies[framing] = prepare(entry.data)
+                if self.entries.get(entry.path) is entry:
+                    entry.cost += len(entry.data)
+                    self.cached_bytes += len(entry.data)
+                    self._evict()
+            return body
+
+    def _evict(self):
+        while self.cached_bytes > self.max_bytes and len(self.entries) > 1:
+            _, old = self.entries.popitem(last=False)
+            self.cached_bytes -= old.cost
+
+    def _drop(self, path):
+        entry = self.entries.pop(path, None)
+        if entry is not None:
+            self.cached_bytes -= entry.cost
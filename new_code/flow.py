@@ -0,0 +1,51 @@
+# flow.py
+"""Receiver-advertised flow control, shared by both stacks.
+
+Every ACK carries the receiver's free space in segments past the
+cumulative ACK: what is left of ``read_buffer`` once the complete messages
+the application hasn't read yet are counted, at most ``window_size``. It
+shrinks as messages wait and grows as they are read, and once it has
+grown by half a window (or opened from zero) the receiver sends a window
+update without waiting for more data.
+
+The edge of the last advertised window never moves back, since the sender
+may already have sent up to it: a segment below it is always taken.
+"""
+
+
+class ReceiveWindow:
+    """Free space of one ordered sequence of segments (a connection, or a
+    stream of one)"""
+    __slots__ = ("window_size", "read_buffer", "mss", "unread", "advertised", "edge")
+
+    def __init__(self, window_size, read_buffer, mss, edge=0):
+        """edge: first seq past the window the sender may assume before
+        the first ACK"""
+        self.window_size = window_size
+        self.read_buffer = read_buffer
+        self.mss = mss
+        self.unread = 0              # bytes of complete messages the application hasn't read
+        self.advertised = window_size  # window sent in the last ACK
+        self.edge = edge             # next expected seq + advertised at the time
+
+    def free(self):
+        """Segments past the next expected one there is room for"""
+        return min(self.window_size, max(self.read_buffer - self.unread, 0) // self.mss)
+
+    def has_room(self, seq, expected):
+        """seq fits, expected being the next seq in order: within the space
+        free now, or below the edge of the last window advertised"""
+        return 0 <= seq - expected < self.window_size and (seq < self.edge or seq - expected < self.free())
+
+    def advertise(self, expected):
+        """Window for an ACK of everything before expected"""
+        self.advertised = self.free()
+        self.edge = max(self.edge, expected + self.advertised)
+        return self.advertised
+
+    def update_due(self):
+        """The window has opened enough since the last ACK to tell the
+        sender at once"""
+        window = self.free()
+        return window > self.advertised and (
+            self.advertised == 0 or window - self.advertised >= (self.window_size + 1) // 2)
@@ -0,0 +1,308 @@
+# httpparser.py
+"""Incremental HTTP/1.0 and HTTP/1.1 message parsing.
+
+A RequestParser (server side) or ResponseParser (client side) is fed the
+bytes of a connection as they arrive, in pieces of any size, and returns
+each message once it is complete. It works on bytes throughout and
+remembers how far it has looked for the end of the current line, so each
+byte is scanned once however the input is split. Bodies are delimited by
+Content-Length or by chunked transfer coding; several messages back to
+back (pipelining) come out in order.
+"""
+from collections import deque
+
+MAX_LINE = 8 * 1024           # start line, header line or chunk size line
+MAX_HEADERS = 100             # header fields per message
+MAX_BODY = 64 * 1024 * 1024   # bytes of body per message
+
+# Parser states
+START_LINE, HEADERS, BODY, CHUNK_SIZE, CHUNK_DATA, CHUNK_END, TRAILERS, UNTIL_CLOSE = range(8)
+
+
+class ParseError(ValueError):
+    """Malformed or unacceptable message; status is the response to send"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class Message:
+    __slots__ = ("version", "headers", "body")
+
+    def __init__(self, version, headers=None, body=b""):
+        self.version = version
+        self.headers = headers if headers is not None else {}  # lower-cased name -> value
+        self.body = body
+
+    def header(self, name, default=None):
+        return self.headers.get(name.lower(), default)
+
+    @property
+    def keep_alive(self):
+        """Whether the connection stays open after this message: by default
+        in HTTP/1.1, only with "Connection: keep-alive" in HTTP/1.0"""
+        tokens = {token.strip().lower() for token in self.headers.get("connection", "").split(",")}
+        if "close" in tokens:
+            return False
+        return self.version != "HTTP/1.0" or "keep-alive" in tokens
+
+
+class Request(Message):
+    __slots__ = ("method", "target")
+
+    def __init__(self, method, target, version, headers=None, body=b""):
+        super().__init__(version, headers, body)
+        self.method = method
+        self.target = target
+
+    @property
+    def path(self):
+        """Target without the query string"""
+        return self.target.split("?", 1)[0]
+
+    def __repr__(self):
+        return f"Request({self.method} {self.target} {self.version}, {len(self.body)} byte body)"
+
+
+class Response(Message):
+    __slots__ = ("status", "reason")
+
+    def __init__(self, version, status, reason, headers=None, body=b""):
+        super().__init__(version, headers, body)
+        self.status = status
+        self.reason = reason
+
+    def __repr__(self):
+        return f"Response({self.version} {self.status} {self.reason}, {len(self.body)} byte body)"
+
+
+class _Parser:
+    """The parts common to requests and responses; subclasses parse the
+    start line and decide how the body is delimited"""
+
+    def __init__(self, max_body=MAX_BODY):
+        self.max_body = max_body
+        self.buffer = bytearray()
+        self.pos = 0      # start of the unparsed data in buffer
+        self.scanned = 0  # no line end in buffer[pos:scanned]
+        self.state = START_LINE
+        self.message = None
+        self.body = None
+        self.sink = None    # takes the body of the current message instead of self.body
+        self.remaining = 0  # body or chunk bytes still to come
+
+    def feed(self, data):
+        """Add received bytes; return the list of messages they completed.
+        Raises ParseError on a malformed message, after which the
+        connection should be closed (a server answers error.status first)."""
+        self.buffer += data
+        done = []
+        while self._step():
+            if self.message is not None and self.state == START_LINE:
+                done.append(self.message)
+                self.message = None
+        # Drop what has been parsed; the rest is at most one partial line or
+        # the part of a body that is being collected
+        if self.pos:
+            del self.buffer[:self.pos]
+            self.scanned -= self.pos
+            self.pos = 0
+        return done
+
+    def _line(self):
+        """Next line without its line end (CRLF or a bare LF), or None if it
+        hasn't fully arrived"""
+        end = self.buffer.find(b"\n", self.scanned, self.pos + MAX_LINE + 1)
+        if end < 0:
+            self.scanned = min(len(self.buffer), self.pos + MAX_LINE + 1)
+            if self.scanned - self.pos > MAX_LINE:
+                raise ParseError("Line too long", 414 if self.state == START_LINE else 431)
+            return None
+        line = bytes(self.buffer[self.pos:end])
+        self.pos = self.scanned = end + 1
+        return line[:-1] if line.endswith(b"\r") else line
+
+    def _step(self):
+        """Advance the state machine; False when more data is needed"""
+        if self.state == START_LINE:
+            line = self._line()
+            if line is None:
+                return False
+            if line:  # empty lines before a message are allowed (RFC 7230 3.5)
+                self.message = self._start(line)
+                self.state = HEADERS
+            return True
+
+        if self.state in (HEADERS, TRAILERS):
+            line = self._line()
+            if line is None:
+                return False
+            if line:
+                if self.state == HEADERS:
+                    self._header(line)
+                return True
+            if self.state == HEADERS:
+                self._begin_body()
+            else:
+                self._finish()
+            return True
+
+        if self.state in (BODY, CHUNK_DATA, UNTIL_CLOSE):
+            available = len(self.buffer) - self.pos
+            if self.state != UNTIL_CLOSE:
+                available = min(available, self.remaining)
+                if available == 0 and self.remaining:
+                    return False
+            if self.sink is not None:
+                if available:
+                    self.sink(self.message, bytes(self.buffer[self.pos:self.pos + available]))
+            else:
+                if self.state == UNTIL_CLOSE:
+                    self._check_body(len(self.body) + available)
+                self.body += self.buffer[self.pos:self.pos + available]
+            self.pos += available
+            self.scanned = self.pos
+            self.remaining -= available
+            if self.remaining > 0 or self.state == UNTIL_CLOSE:
+                return False
+            if self.state == BODY:
+                self._finish()
+            else:
+                self.state = CHUNK_END
+            return True
+
+        if self.state == CHUNK_SIZE:
+            line = self._line()
+            if line is None:
+                return False
+            size = line.split(b";", 1)[0].strip()  # ignore chunk extensions
+            # Plain hex digits only: int() would also take "0x5", "+5" or "1_0"
+            if not size or size.strip(b"0123456789abcdefABCDEF"):
+                raise ParseError("Bad chunk size")
+            self.remaining = int(size, 16)
+            if self.sink is None:
+                self._check_body(len(self.body) + self.remaining)
+            self.state = CHUNK_DATA if self.remaining else TRAILERS
+            return True
+
+        # CHUNK_END: the line end after a chunk's data
+        line = self._line()
+        if line is None:
+            return False
+        if line:
+            raise ParseError("Missing line end after chunk")
+        self.state = CHUNK_SIZE
+        return True
+
+    def _start(self, line):
+        raise NotImplementedError
+
+    def _check_version(self, version):
+        if not version.startswith("HTTP/1."):
+            raise ParseError(f"Unsupported version {version}", 505)
+
+    def _header(self, line):
+        name, sep, value = line.partition(b":")
+        if not sep or not name or name != name.strip():
+            raise ParseError("Bad header line")
+        headers = self.message.headers
+        if len(headers) >= MAX_HEADERS:
+            raise ParseError("Too many headers", 431)
+        name = name.decode("latin-1").lower()
+        value = value.strip().decode("latin-1")
+        # Repeated fields combine into one comma-separated value
+        headers[name] = f"{headers[name]}, {value}" if name in headers else value
+
+    def _has_body(self):
+        return True
+
+    def _begin_body(self):
+        headers = self.message.headers
+        self.body = bytearray()
+        if not self._has_body():
+            self._finish()
+            return
+        if "transfer-encoding" in headers:
+            # Chunked coding takes precedence over any Content-Length
+            if headers["transfer-encoding"].lower().rsplit(",", 1)[-1].strip() != "chunked":
+                raise ParseError("Unsupported transfer coding", 501)
+            self.state = CHUNK_SIZE
+            return
+        length = headers.get("content-length")
+        if length is None:
+            self._no_length()
+            return
+        if not (length.isascii() and length.isdigit()):  # str.isdigit() also takes "²"
+            raise ParseError("Bad Content-Length")
+        self.remaining = int(length)
+        if self.sink is None:
+            self._check_body(self.remaining)
+        self.state = BODY
+
+    def _no_length(self):
+        self.state = BODY  # an empty body
+
+    def _check_body(self, size):
+        if size > self.max_body:
+            raise ParseError("Body too large", 413)
+
+    def _finish(self):
+        self.message.body = bytes(self.body)
+        self.body = None
+        self.sink = None
+        self.state = START_LINE
+
+
+class RequestParser(_Parser):
+    def _start(self, line):
+        parts = line.split()
+        if len(parts) != 3:
+            raise ParseError("Bad request line")
+        method, target, version = (part.decode("latin-1") for part in parts)
+        self._check_version(version)
+        return Request(method, target, version)
+
+
+class ResponseParser(_Parser):
+    """Parses the responses to the requests passed to expect(), in order.
+    Responses to HEAD, 1xx, 204 and 304 have no body; one with neither
+    Content-Length nor chunked coding ends when close() is called."""
+
+    def __init__(self, max_body=MAX_BODY):
+        super().__init__(max_body)
+        self.expected = deque()  # (method, on_body) of the requests still to be answered
+
+    def expect(self, method, on_body=None):
+        """Record that a request with this method was sent. With on_body,
+        the body of its response is passed to on_body(response, data) as it
+        arrives, in any size of pieces, and isn't kept in response.body."""
+        self.expected.append((method, on_body))
+
+    def close(self):
+        """The connection closed; return the list holding the response that
+        was being read to the end of the connection, if any"""
+        if self.state != UNTIL_CLOSE:
+            return []
+        self._finish()
+        response, self.message = self.message, None
+        return [response]
+
+    def _start(self, line):
+        version, _, rest = line.partition(b" ")
+        status, _, reason = rest.partition(b" ")  # the reason phrase may be empty
+        version = version.decode("latin-1")
+        self._check_version(version)
+        if len(status) != 3 or not status.isdigit():
+            raise ParseError("Bad status line")
+        return Response(version, int(status), reason.strip().decode("latin-1"))
+
+    def _has_body(self):
+        response = self.message
+        if 100 <= response.status < 200:
+            return False  # interim; the real response is still to come
+        method, self.sink = self.expected.popleft() if self.expected else ("GET", None)
+        return method != "HEAD" and response.status not in (204, 304)
+
+    def _no_length(self):
+        self.state = UNTIL_CLOSE
@@ -0,0 +1,58 @@
+# pacing.py
+"""Token bucket pacing between a reliable sender and its socket.
+
+The bucket fills at ``rate`` packets per second up to ``burst`` packets; a
+sender may transmit a new packet when delay() is 0 and takes a token with
+consume() for every packet it puts on the wire, retransmissions included
+(those may drive the bucket negative rather than wait). With rate None the
+bucket never holds anything back.
+
+Senders either configure a fixed rate or set ``rate`` from their congestion
+controller's pacing_rate() as the RTT and window change.
+"""
+import time
+
+PACING_BURST = 4  # packets that may leave back to back after an idle period
+
+
+class TokenBucket:
+    def __init__(self, rate=None, burst=PACING_BURST):
+        if burst < 1:
+            raise ValueError("burst must be at least one packet")
+        self.burst = burst
+        self.tokens = float(burst)
+        self.stamp = time.monotonic()
+        self._rate = rate
+
+    @property
+    def rate(self):
+        """Packets per second, or None for no pacing"""
+        return self._rate
+
+    @rate.setter
+    def rate(self, rate):
+        self._refill(time.monotonic())  # tokens earned so far accrue at the old rate
+        self._rate = rate
+
+    def _refill(self, now):
+        if self._rate:
+            self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self._rate)
+        else:
+            self.tokens = float(self.burst)
+        self.stamp = now
+
+    def delay(self, now=None):
+        """Seconds until one packet may be sent"""
+        if not self._rate:
+            return 0.0
+        if now is None:
+            now = time.monotonic()
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self._rate
+
+    def consume(self, now=None):
+        """Account for one packet sent"""
+        if now is None:
+            now = time.monotonic()
+        self._refill(now)
+        self.tokens -= 1
@@ -1,27 +1,88 @@
 # packet.py
 import json
-import zlib
 import struct
 import base64
 import random
 
+import checksum
+
 HEADER_FORMAT = "!I I B H"  # Network order: unsigned int, unsigned int, unsigned char, unsigned short
 HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+WIRE_FORMAT = HEADER_FORMAT + " I"  # header followed by the checksum (see checksum.py)
+WIRE_HEADER_SIZE = struct.calcsize(WIRE_FORMAT)
+FLAGS_OFFSET = struct.calcsize("!I I")  # byte offset of the flags in the header
 
 # Flag bits (you can combine flags using bitwise OR)
 FLAG_SYN = 0b00000001
 FLAG_ACK = 0b00000010
 FLAG_FIN = 0b00000100
 FLAG_DATA = 0b00001000
+FLAG_NACK = 0b00010000  # with ACK: the receiver just found a gap at ack_num
+
+FLAG_NAMES = {"SYN": FLAG_SYN, "ACK": FLAG_ACK, "FIN": FLAG_FIN, "DATA": FLAG_DATA, "NACK": FLAG_NACK}
+
+# Options carried in the payload of SYN and SYN-ACK packets, as
+# kind, length, value triples; unknown kinds are skipped
+OPT_COMPRESSION = 1  # SYN: codec ids in order of preference; SYN-ACK: the chosen one
+OPT_CHECKSUM = 2     # the same for checksum algorithms
+
+# The payload of an ACK, if any, is the receiver's free buffer space in
+# segments past ack_num (flow control); an ACK without one doesn't limit
+# the sender
+WINDOW_FORMAT = "!I"
+WINDOW_FIELD_SIZE = struct.calcsize(WINDOW_FORMAT)
+
+
+def encode_options(options):
+    """Encode a {kind: value bytes} dict as a SYN payload"""
+    out = bytearray()
+    for kind, value in options.items():
+        out += bytes([kind, len(value)]) + value
+    return bytes(out)
+
+
+def decode_options(payload):
+    """Decode a SYN payload to a {kind: value bytes} dict"""
+    options = {}
+    payload = bytes(payload)
+    pos = 0
+    while pos + 2 <= len(payload):
+        kind, length = payload[pos], payload[pos + 1]
+        options[kind] = payload[pos + 2:pos + 2 + length]
+        pos += 2 + length
+    return options
+
+
+def flags_from_dict(flags):
+    """Convert a {"SYN": True, ...} dict to the wire-format flags byte"""
+    byte = 0
+    for name, bit in FLAG_NAMES.items():
+        if flags.get(name):
+            byte |= bit
+    return byte
+
+
 class Packet:
-    def __init__(self, seq_num=0, ack_num=0, flags=None, payload=""):
-        if flags is None:
-            flags = {"SYN": False, "ACK": False, "FIN": False}
+    # No per-instance __dict__: a packet is just its header fields and payload
+    __slots__ = ("seq_num", "ack_num", "flags", "payload", "checksum", "corrupted")
+
+    def __init__(self, seq_num=0, ack_num=0, flags=0, payload="", payload_checksum=None, algorithm=None):
+        """flags is the wire-format int (FLAG_* bits OR-ed together); a
+        {"SYN": True, ...} dict is still accepted and converted.
+        algorithm is the connection's checksum.Algorithm (default crc32;
+        SYNs always use crc32) and payload_checksum its checksum of payload
+        if the caller already has it"""
         self.seq_num = seq_num
         self.ack_num = ack_num
+        if flags is None:
+            flags = 0
+        elif isinstance(flags, dict):
+            flags = flags_from_dict(flags)
         self.flags = flags
-        self.payload = payload if isinstance(payload, bytes) else payload.encode()
-        self.checksum = self.compute_checksum()
+        # bytes, bytearray or memoryview; payloads parsed by from_bytes are
+        # views into the receive buffer and are not copied
+        self.payload = payload.encode() if isinstance(payload, str) else payload
+        self.checksum = self.compute_checksum(payload_checksum, algorithm)
         self.corrupted = False
 
     # def compute_checksum(self):
@@ -34,37 +95,59 @@ class Packet:
     #                        self.flags_to_byte(), len(self.payload))
     #     return zlib.crc32(header + self.payload)
 
-    def compute_checksum(self):
-        """Calculate checksum including all critical fields"""
-        flags_byte = 0
-        if self.flags.get("SYN"): flags_byte |= 0b00000001
-        if self.flags.get("ACK"): flags_byte |= 0b00000010
-        if self.flags.get("FIN"): flags_byte |= 0b00000100
-        if self.flags.get("DATA"): flags_byte |= 0b00001000
-        
+    def compute_checksum(self, payload_checksum=None, algorithm=None):
+        """Calculate checksum including all critical fields.
+
+        The checksum runs over the payload first and then the header, so a
+        payload sent again and again (a cached response) is checksummed
+        once and each packet only adds its header to it.
+        """
+        if algorithm is None or self.flags & FLAG_SYN:
+            algorithm = checksum.CRC32
         header = struct.pack(HEADER_FORMAT, 
                            self.seq_num, 
                            self.ack_num, 
-                           flags_byte, 
+                           self.flags, 
                            len(self.payload))
-        return zlib.crc32(header + self.payload)
+        if payload_checksum is None:
+            payload_checksum = algorithm.compute(self.payload)
+        return algorithm.compute(header, payload_checksum)
     
     def flags_to_byte(self):
-        """Convert flags dict to single byte"""
-        byte = 0
-        if self.flags.get("SYN"): byte |= 0b00000001
-        if self.flags.get("ACK"): byte |= 0b00000010
-        if self.flags.get("FIN"): byte |= 0b00000100
-        if self.flags.get("DATA"): byte |= 0b00001000
-        return byte
+        """Flags are already stored as the wire-format byte"""
+        return self.flags
+
+    def flags_dict(self):
+        """Flags as a {"SYN": bool, ...} dict"""
+        return {name: bool(self.flags & bit) for name, bit in FLAG_NAMES.items()}
+
+    @property
+    def is_syn(self):
+        return bool(self.flags & FLAG_SYN)
+
+    @property
+    def is_ack(self):
+        return bool(self.flags & FLAG_ACK)
+
+    @property
+    def is_fin(self):
+        return bool(self.flags & FLAG_FIN)
+
+    @property
+    def is_data(self):
+        return bool(self.flags & FLAG_DATA)
 
+    @property
+    def is_nack(self):
+        return bool(self.flags & FLAG_NACK)
 
 
     def to_json(self):
+        """Debug/trace encoding only; packets go on the wire via to_bytes()"""
         return json.dumps({
             "seq_num": self.seq_num,
             "ack_num": self.ack_num,
-            "flags": self.flags,
+            "flags": self.flags_dict(),
             "payload": base64.b64encode(self.payload).decode() if self.payload else "",
             "checksum": self.checksum  # <- Add this line
         })
@@ -89,15 +172,9 @@ class Packet:
 
     def to_bytes(self):
         """Serialize packet with checksum"""
-        if self.corrupted:
-            bad_checksum = random.randint(0, 0xFFFFFFFF)
-            header = struct.pack(HEADER_FORMAT, self.seq_num, self.ack_num,
-                               self.flags_to_byte(), len(self.payload))
-            return header + struct.pack("!I", bad_checksum) + self.payload
-        
-        header = struct.pack(HEADER_FORMAT, self.seq_num, self.ack_num,
-                           self.flags_to_byte(), len(self.payload))
-        return header + struct.pack("!I", self.checksum) + self.payload
+        checksum = random.randint(0, 0xFFFFFFFF) if self.corrupted else self.checksum
+        return struct.pack(WIRE_FORMAT, self.seq_num, self.ack_num,
+                           self.flags, len(self.payload), checksum) + self.payload
     
     # @classmethod
     # def from_bytes(cls,data):
@@ -108,27 +185,36 @@ class Packet:
 
 
     @classmethod
-    def from_bytes(cls, data):
-        """Deserialize packet and verify checksum"""
-        header = data[:HEADER_SIZE]
-        seq, ack, flags_byte, length = struct.unpack(HEADER_FORMAT, header)
-        
-        flags = {
-            "SYN": bool(flags_byte & 0b00000001),
-            "ACK": bool(flags_byte & 0b00000010),
-            "FIN": bool(flags_byte & 0b00000100),
-            "DATA": bool(flags_byte & 0b00001000)
-        }
-        
-        checksum = struct.unpack("!I", data[HEADER_SIZE:HEADER_SIZE+4])[0]
-        payload = data[HEADER_SIZE+4:HEADER_SIZE+4+length]
-        
-        # Create temporary packet for verification
-        temp_pkt = cls(seq, ack, flags, payload)
-        if temp_pkt.checksum != checksum:
+    def from_bytes(cls, data, algorithm=None):
+        """Deserialize packet and verify checksum with algorithm (default
+        crc32, which SYNs always use).
+
+        data may be bytes, a bytearray or a memoryview (e.g. the buffer
+        filled by recvfrom_into). The header is unpacked in place and the
+        checksum is computed incrementally over the header and payload
+        slices, so nothing is copied; the payload is a memoryview into data.
+        """
+        view = memoryview(data)
+        if len(view) < WIRE_HEADER_SIZE:
+            raise ValueError("Truncated packet")
+        seq, ack, flags_byte, length, value = struct.unpack_from(WIRE_FORMAT, view)
+        payload = view[WIRE_HEADER_SIZE:WIRE_HEADER_SIZE + length]
+        if len(payload) != length:
+            raise ValueError("Truncated packet")
+
+        if algorithm is None or flags_byte & FLAG_SYN:
+            algorithm = checksum.CRC32
+        if algorithm.compute(view[:HEADER_SIZE], algorithm.compute(payload)) != value:
             raise ValueError("Checksum verification failed")
-        
-        return temp_pkt
+
+        pkt = cls.__new__(cls)
+        pkt.seq_num = seq
+        pkt.ack_num = ack
+        pkt.flags = flags_byte
+        pkt.payload = payload
+        pkt.checksum = value
+        pkt.corrupted = False
+        return pkt
     
 
     def simulate_corruption(self):
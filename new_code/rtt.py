@@ -0,0 +1,48 @@
+# rtt.py
+INITIAL_RTO = 1.0
+MIN_RTO = 0.2
+MAX_RTO = 60.0
+
+ALPHA = 1 / 8  # gain for smoothed RTT
+BETA = 1 / 4   # gain for RTT variance
+K = 4
+
+
+class RTTEstimator:
+    """Smoothed RTT / RTTVAR estimation and retransmission timeout (RFC 6298).
+
+    Callers must follow Karn's rule: only call sample() for packets that were
+    transmitted exactly once, since an ACK for a retransmitted packet can't
+    be matched to a particular transmission. backoff() doubles the RTO after
+    a timeout; a new ACK that makes progress undoes the backoff (restore()),
+    even if Karn's rule left it without a sample.
+    """
+
+    def __init__(self, initial_rto=INITIAL_RTO, min_rto=MIN_RTO, max_rto=MAX_RTO):
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+        self.srtt = None
+        self.rttvar = None
+        self.rto = self._clamp(initial_rto)
+
+    def _clamp(self, rto):
+        return min(max(rto, self.min_rto), self.max_rto)
+
+    def sample(self, rtt):
+        """Update the estimates with one RTT measurement in seconds"""
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - BETA) * self.rttvar + BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - ALPHA) * self.srtt + ALPHA * rtt
+        self.rto = self._clamp(self.srtt + K * self.rttvar)
+
+    def restore(self):
+        """Drop any backoff and go back to the RTO given by the estimates"""
+        if self.srtt is not None:
+            self.rto = self._clamp(self.srtt + K * self.rttvar)
+
+    def backoff(self):
+        """Exponential backoff after a retransmission timeout"""
+        self.rto = self._clamp(self.rto * 2)
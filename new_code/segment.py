@@ -0,0 +1,86 @@
+# segment.py
+import struct
+
+SEGMENT_FORMAT = "!I I"  # Network order: offset in message, total message length
+SEGMENT_HEADER_SIZE = struct.calcsize(SEGMENT_FORMAT)
+# Largest message a Reassembler takes; its buffer is allocated for the
+# length the first segment claims, so this bounds what one packet can cost
+MAX_MESSAGE = 16 * 1024 * 1024
+
+
+def segment(data, mss):
+    """Split a message into payloads of at most mss bytes of data, each
+    prefixed with its offset and the total message length"""
+    total = len(data)
+    view = memoryview(data)
+    segments = []
+    offset = 0
+    while True:
+        chunk = view[offset:offset + mss]
+        segments.append(struct.pack(SEGMENT_FORMAT, offset, total) + chunk)
+        offset += len(chunk)
+        if offset >= total:
+            return segments
+
+
+class PreparedMessage(tuple):
+    """A message already split into segments, as (payload, payload checksum)
+    pairs. A stack's prepare() builds one so a message sent many times (a
+    cached file) is segmented and checksummed once; only the stack that
+    built it can send it, since MSS and checksum differ between stacks.
+    framing identifies any per-connection encoding applied first (see
+    compress.Compressor.framing), None for the message as is, and the
+    checksum the pairs were made with where a stack has a choice of them."""
+
+    def __new__(cls, pairs, framing=None):
+        self = super().__new__(cls, pairs)
+        self.framing = framing
+        return self
+
+    @property
+    def size(self):
+        """Bytes held, segment headers included"""
+        return sum(len(payload) for payload, _ in self)
+
+
+class Reassembler:
+    """Rebuild messages from segments into one preallocated buffer.
+
+    Segments are fed in order, as both stacks deliver them; each one is
+    copied once to its offset. feed() returns the complete message when the
+    last byte arrives, else None. A segment at offset 0 starts a new
+    message, abandoning one that lost a segment. Any other segment that
+    isn't the next one of the message being rebuilt (a duplicate, or one
+    past a gap), a malformed one, or one of a message longer than
+    max_message raises ValueError and leaves the message as it was.
+    """
+
+    def __init__(self, max_message=MAX_MESSAGE):
+        self.max_message = max_message
+        self.buffer = None
+        self.received = 0
+
+    def feed(self, payload):
+        if len(payload) < SEGMENT_HEADER_SIZE:
+            raise ValueError("Truncated segment")
+        offset, total = struct.unpack_from(SEGMENT_FORMAT, payload)
+        chunk = memoryview(payload)[SEGMENT_HEADER_SIZE:]
+        if offset + len(chunk) > total:
+            raise ValueError("Segment exceeds message length")
+        if total > self.max_message:
+            raise ValueError(f"Message of {total} bytes exceeds the {self.max_message} byte limit")
+        if offset and (self.buffer is None or len(self.buffer) != total or offset != self.received):
+            raise ValueError(f"Segment at offset {offset} is not the next one")
+
+        if offset == 0:
+            self.buffer = bytearray(total)
+            self.received = 0
+        self.buffer[offset:offset + len(chunk)] = chunk
+        self.received += len(chunk)
+
+        if self.received < total:
+            return None
+        message = bytes(self.buffer)
+        self.buffer = None
+        self.received = 0
+        return message
@@ -1,41 +1,109 @@
-from udp import TCP
+import itertools
+import os
+import sys
+import threading
+from http import HTTPStatus
 
-def main():
-    server = TCP(is_server=True, ip='127.0.0.1', port=12345)
-    if server.hand_shake():
-        print("[Server] Connection established")
-        while True:
-            data = server.recv()
-            if data is not None:
-                try:
-                    request = data.decode()
-                    print(f"[Server] Received request:\n{request}")
+from udp import Listener
+from httpparser import RequestParser, ParseError
+from filecache import FileCache
+from stream import read_chunks
+
+# Files are served from the repository's static directory, or the one given
+# on the command line; all connections share one cache
+DOC_ROOT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "static")
+files = FileCache(sys.argv[1] if len(sys.argv) > 1 else DOC_ROOT)
+
+
+def response(status, body=b"", keep_alive=False):
+    """A complete response; the Content-Length lets the client find its end
+    on a persistent connection"""
+    head = (f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    return head.encode() + body
 
-                    # Basic HTTP parsing
-                    if request.startswith("GET"):
-                        resource = request.split()[1]
-                        if resource == "/index.html":
-                            response = b"HTTP/1.0 200 OK\r\n\r\n<html><body><h1>Welcome</h1></body></html>"
-                        else:
-                            response = b"HTTP/1.0 404 Not Found\r\n\r\n<html><body><h1>404 Not Found</h1></body></html>"
 
-                    elif request.startswith("POST"):
-                        response = b"HTTP/1.0 200 OK\r\n\r\n<html><body><h1>POST received</h1></body></html>"
+def end_head(head, keep_alive):
+    """Finish a status line and headers with the Connection header"""
+    return head + (b"Connection: keep-alive\r\n\r\n" if keep_alive else b"Connection: close\r\n\r\n")
 
-                    else:
-                        response = b"HTTP/1.0 400 Bad Request\r\n\r\n"
 
-                    server.send(response)
+def respond(server, request, responses):
+    """Add the response to one request to responses. A file that isn't
+    cached, or a part of one, is streamed right away, after the responses
+    before it."""
+    keep_alive = request.keep_alive
+    if request.method in ("GET", "HEAD"):
+        entry = files.lookup(request.target)
+        if entry is None:
+            responses.append(response(404, b"<html><body><h1>404 Not Found</h1></body></html>", keep_alive))
+            return
+        # 200, or 304 / 206 / 416 for conditional and Range requests
+        head, span = entry.respond(request.method, request.headers)
+        head = end_head(head, keep_alive)
+        if span is None:
+            responses.append(head)
+        elif span == (0, entry.size) and entry.data is not None:
+            # Cached: the body is already compressed (if negotiated),
+            # segmented and checksummed
+            responses += [head, files.body(entry, server.prepare, server.framing)]
+        else:
+            if responses:
+                server.send_many(responses)
+                responses.clear()
+            start, stop = span
+            with open(entry.path, "rb") as f:
+                f.seek(start)
+                server.sendfile(itertools.chain([head], read_chunks(f, limit=stop - start)))
 
-                except UnicodeDecodeError:
-                    print("[Server] Binary data received (cannot decode)")
-            else:
-                print("[Server] No valid data received")
-                break
+    elif request.method == "POST":
+        responses.append(response(200, b"<html><body><h1>POST received</h1></body></html>", keep_alive))
 
+    else:
+        responses.append(response(400, keep_alive=keep_alive))
 
 
+def handle(server):
+    print("[Server] Connection established")
+    # A request may arrive over several messages and one message may hold
+    # several (pipelined) requests; the parser keeps whatever is incomplete.
+    # The connection serves requests until one doesn't ask for keep-alive.
+    parser = RequestParser()
+    keep_alive = True
+    while keep_alive:
+        data = server.recv()
+        if data is None:
+            print("[Server] Connection closed or no valid data received")
+            break
+        responses = []
+        try:
+            for request in parser.feed(data):
+                print(f"[Server] Received request: {request}")
+                respond(server, request, responses)
+                keep_alive = request.keep_alive
+                if not keep_alive:
+                    break
+        except ParseError as error:
+            print(f"[Server] Bad request: {error}")
+            responses.append(response(error.status))
+            keep_alive = False
+        # Answers to pipelined requests share the send window, in order
+        if responses:
+            server.send_many(responses)
+
     server.close()
 
+
+def main():
+    listener = Listener(ip='127.0.0.1', port=12345)
+    try:
+        while True:
+            conn = listener.accept()
+            if conn is not None:
+                threading.Thread(target=handle, args=(conn,), daemon=True).start()
+    finally:
+        listener.close()
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,108 @@
+# stream.py
+"""Byte streams over message-oriented connections.
+
+The reliable layers deliver whole messages. MessageStream reads them as
+one continuous byte stream, like socket.makefile('rb'): only the message
+being consumed is held, so a body of any size streams in the memory of
+one message. read_chunks() is the sending side, turning a file object or
+an iterable into a bounded series of chunks for sendfile().
+"""
+import io
+
+STREAM_CHUNK = 64 * 1024  # bytes per message when streaming a file
+
+
+class MessageStream(io.RawIOBase):
+    """Read-only file object over the messages returned by next_message(),
+    which returns None at the end of the stream"""
+
+    def __init__(self, next_message):
+        super().__init__()
+        self._next_message = next_message
+        self._chunk = b""  # message being consumed
+        self._pos = 0      # how much of it has been read
+        self._eof = False
+
+    def readable(self):
+        return True
+
+    def _fill(self):
+        """Make sure there is unread data; False at the end of the stream"""
+        while self._pos == len(self._chunk):
+            if self._eof:
+                return False
+            message = self._next_message()
+            if message is None:
+                self._eof = True
+                return False
+            self._chunk, self._pos = message, 0
+        return True
+
+    def readinto(self, buffer):
+        if not self._fill():
+            return 0
+        size = min(len(buffer), len(self._chunk) - self._pos)
+        buffer[:size] = memoryview(self._chunk)[self._pos:self._pos + size]
+        self._pos += size
+        return size
+
+    def read(self, size=-1):
+        """Read size bytes, fewer only at the end of the stream, like a
+        buffered file; -1 reads to the end"""
+        if size is None or size < 0:
+            return self.readall()
+        parts = []
+        while size > 0 and self._fill():
+            end = min(len(self._chunk), self._pos + size)
+            parts.append(self._chunk[self._pos:end])
+            size -= end - self._pos
+            self._pos = end
+        return b"".join(parts)
+
+    def readline(self, size=-1):
+        parts = []
+        remaining = size if size is not None and size >= 0 else None
+        while remaining != 0 and self._fill():
+            limit = len(self._chunk) if remaining is None else min(len(self._chunk), self._pos + remaining)
+            end = self._chunk.find(b"\n", self._pos, limit) + 1 or limit
+            parts.append(self._chunk[self._pos:end])
+            if remaining is not None:
+                remaining -= end - self._pos
+            self._pos = end
+            if parts[-1].endswith(b"\n"):
+                break
+        return b"".join(parts)
+
+    def chunks(self):
+        """Iterate over the rest of the stream a message at a time"""
+        while self._fill():
+            chunk = self._chunk[self._pos:] if self._pos else self._chunk
+            self._pos = len(self._chunk)
+            yield chunk
+
+
+def read_chunks(source, chunk_size=STREAM_CHUNK, limit=None):
+    """Chunks of a binary file object (read through one reused buffer, so
+    each chunk is only valid until the next one), stopping after limit
+    bytes if given, or of an iterable of bytes-like objects"""
+    remaining = float("inf") if limit is None else limit
+    if hasattr(source, "readinto"):
+        buffer = bytearray(chunk_size)
+        view = memoryview(buffer)
+        while remaining > 0:
+            size = source.readinto(view[:min(chunk_size, remaining)])
+            if not size:
+                return
+            remaining -= size
+            yield view[:size]
+    elif hasattr(source, "read"):
+        while remaining > 0:
+            chunk = source.read(min(chunk_size, remaining))
+            if not chunk:
+                return
+            remaining -= len(chunk)
+            yield chunk
+    else:
+        for chunk in source:
+            if chunk:
+                yield chunk
@@ -0,0 +1,40 @@
+# test_aio.py
+import asyncio
+import os
+
+from aio import create_listener, open_connection
+
+
+async def echo_session(clients):
+    listener = await create_listener(port=0)
+
+    async def serve():
+        while True:
+            conn = await listener.accept()
+            asyncio.ensure_future(echo(conn))
+
+    async def echo(conn):
+        while True:
+            message = await conn.recv()
+            if message is None:
+                break
+            await conn.send(message[::-1])
+        await conn.close()
+
+    async def client(size):
+        conn = await open_connection(*listener.addr)
+        data = os.urandom(size)
+        assert await conn.send(data)
+        reply = await conn.recv()
+        await conn.close()
+        return reply == data[::-1]
+
+    server = asyncio.ensure_future(serve())
+    results = await asyncio.gather(*(client(3000 + i) for i in range(clients)))
+    server.cancel()
+    listener.close()
+    return results
+
+
+def test_many_connections_echo():
+    assert all(asyncio.run(echo_session(20)))
@@ -0,0 +1,94 @@
+# test_bulkio.py
+import socket
+import time
+
+import pytest
+
+from bulkio import BatchSocket
+
+
+def make_pair():
+    a, b = BatchSocket(), BatchSocket()
+    a.bind(('127.0.0.1', 0))
+    b.bind(('127.0.0.1', 0))
+    return a, b
+
+
+def test_flush_and_drain_a_batch():
+    a, b = make_pair()
+    try:
+        for i in range(10):
+            a.enqueue(bytes([i]) * 100, b.getsockname())
+        assert a.outbox
+        a.flush()
+        assert not a.outbox
+
+        received = []
+        deadline = time.monotonic() + 2
+        while len(received) < 10 and time.monotonic() < deadline:
+            received += [(bytes(view), addr) for view, addr in b.recv_batch(0.5)]
+        assert [data for data, _ in received] == [bytes([i]) * 100 for i in range(10)]
+        assert all(addr == a.getsockname() for _, addr in received)
+    finally:
+        a.close()
+        b.close()
+
+
+def test_recv_timeouts():
+    a, b = make_pair()
+    try:
+        assert b.recv_batch(0.01) == []
+        b.settimeout(0.01)
+        with pytest.raises(socket.timeout):
+            b.recvfrom_view()
+        a.sendto(b"ping", b.getsockname())
+        b.settimeout(1)
+        data, addr = b.recvfrom(1024)
+        assert data == b"ping" and addr == a.getsockname()
+    finally:
+        a.close()
+        b.close()
+
+
+@pytest.mark.parametrize("gro", [False, True])
+def test_offload_keeps_datagram_boundaries(gro):
+    a, b = BatchSocket(offload=True), BatchSocket(offload=gro)
+    if not a.gso:
+        a.close()
+        b.close()
+        pytest.skip("kernel without UDP_SEGMENT")
+    a.bind(('127.0.0.1', 0))
+    b.bind(('127.0.0.1', 0))
+    try:
+        # A run of full-sized packets ending in a short one, then an odd one out
+        sent = [bytes([i]) * 1000 for i in range(10)] + [b"end" * 10, b"ack"]
+        for data in sent:
+            a.enqueue(data, b.getsockname())
+        a.flush()
+
+        received = []
+        deadline = time.monotonic() + 2
+        while len(received) < len(sent) and time.monotonic() < deadline:
+            received += [bytes(view) for view, _ in b.recv_batch(0.5)]
+        assert received == sent
+    finally:
+        a.close()
+        b.close()
+
+
+def test_empty_datagrams_are_skipped():
+    a, b = make_pair()
+    try:
+        a.sendto(b"", b.getsockname())
+        b.settimeout(0.2)
+        with pytest.raises(socket.timeout):
+            b.recvfrom_view()
+        assert b.recv_batch(0.05) == []
+        a.sendto(b"", b.getsockname())
+        a.sendto(b"after", b.getsockname())
+        b.settimeout(1)
+        data, _ = b.recvfrom(1024)
+        assert data == b"after"
+    finally:
+        a.close()
+        b.close()
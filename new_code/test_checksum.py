@@ -1,7 +1,13 @@
 # test_checksum.py
-from packet import Packet
+import os
 import random
 
+import pytest
+
+import checksum
+from packet import Packet, FLAG_SYN, FLAG_ACK, FLAG_DATA, FLAG_NACK
+
+
 def test_checksum_verification():
     # Create a valid packet
     pkt = Packet(seq_num=100, ack_num=200, payload=b"test data")
@@ -15,5 +21,85 @@ def test_checksum_verification():
     except ValueError:
         print("TEST PASSED: Corrupted packet detected")
 
+
+def test_from_bytes_memoryview():
+    pkt = Packet(seq_num=7, ack_num=8, flags={"DATA": True}, payload=b"payload")
+    buf = bytearray(64)
+    data = pkt.to_bytes()
+    buf[:len(data)] = data
+
+    parsed = Packet.from_bytes(memoryview(buf)[:len(data)])
+    assert isinstance(parsed.payload, memoryview)
+    assert parsed.payload == b"payload"
+    assert parsed.checksum == pkt.checksum
+    assert parsed.to_bytes() == data
+
+
+def test_flags_dict_compatibility():
+    pkt = Packet(seq_num=1, ack_num=2, flags={"SYN": True, "ACK": True, "FIN": False})
+    assert pkt.flags == FLAG_SYN | FLAG_ACK
+    assert pkt.is_syn and pkt.is_ack and not pkt.is_fin and not pkt.is_data
+    assert pkt.checksum == Packet(seq_num=1, ack_num=2, flags=FLAG_SYN | FLAG_ACK).checksum
+
+
+def test_nack_flag_round_trip():
+    pkt = Packet.from_bytes(Packet(seq_num=1, ack_num=7, flags=FLAG_ACK | FLAG_NACK).to_bytes())
+    assert pkt.is_ack and pkt.is_nack
+    assert pkt.flags_dict()["NACK"] and not Packet(flags=FLAG_ACK).is_nack
+
+
+def test_internet16_is_the_rfc1071_sum():
+    def reference(data):
+        if len(data) % 2:
+            data += b"\0"
+        total = 0
+        for i in range(0, len(data), 2):
+            total += data[i] << 8 | data[i + 1]
+            total = (total & 0xFFFF) + (total >> 16)  # end-around carry
+        return total
+
+    for size in (0, 1, 2, 3, 100, 1001):
+        data = os.urandom(size)
+        # Ones-complement sums have two zeros, 0 and 0xFFFF
+        assert checksum.ALGORITHMS["internet16"].compute(data) == reference(data) % 0xFFFF
+
+
+def test_checksums_continue_from_a_previous_value():
+    for head in (b"header!!", b"odd"):
+        tail = b"the payload"
+        for name, algorithm in checksum.ALGORITHMS.items():
+            continued = algorithm.compute(tail, algorithm.compute(head))
+            if name == "internet16" and len(head) % 2:
+                # Each piece is padded on its own: the same as a zero byte after head
+                assert continued == algorithm.compute(head + b"\0" + tail)
+                assert continued != algorithm.compute(head + tail)
+            else:
+                assert continued == algorithm.compute(head + tail)
+
+
+def test_checksum_negotiation():
+    offered = checksum.offer(["nope", "internet16", "crc32"])
+    assert checksum.choose(offered, ["crc32", "internet16"]).name == "internet16"
+    assert checksum.choose(offered, ["none"]) is checksum.CRC32
+    assert checksum.choose(b"", ["internet16"]) is checksum.CRC32
+    assert "none" not in checksum.DEFAULT_CHECKSUMS
+
+
+def test_packets_use_the_connection_checksum():
+    internet16 = checksum.ALGORITHMS["internet16"]
+    pkt = Packet(seq_num=1, ack_num=2, flags=FLAG_DATA, payload=b"data", algorithm=internet16)
+    data = pkt.to_bytes()
+    assert Packet.from_bytes(data, internet16).payload == b"data"
+    with pytest.raises(ValueError):
+        Packet.from_bytes(data)  # crc32
+    # Without checking anything gets through
+    none = checksum.ALGORITHMS["none"]
+    data = Packet(seq_num=1, ack_num=2, flags=FLAG_DATA, payload=b"data", algorithm=none).to_bytes()
+    assert Packet.from_bytes(data[:-4] + b"dada", none).payload == b"dada"
+    # SYNs are always crc32, whatever has been negotiated
+    syn = Packet(seq_num=1, flags=FLAG_SYN, algorithm=internet16)
+    assert Packet.from_bytes(syn.to_bytes(), internet16).checksum == Packet(seq_num=1, flags=FLAG_SYN).checksum
+
+
 if __name__ == "__main__":
-    test_checksum_verification()
\ No newline at end of file
+    test_checksum_verification()
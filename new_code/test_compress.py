@@ -0,0 +1,54 @@
+# test_compress.py
+import os
+import zlib
+
+import pytest
+
+import compress
+from compress import Compressor, CODECS, RAW
+from packet import encode_options, decode_options, OPT_COMPRESSION
+
+
+def test_options_round_trip():
+    payload = encode_options({OPT_COMPRESSION: b"\x02\x01", 9: b""})
+    assert decode_options(payload) == {OPT_COMPRESSION: b"\x02\x01", 9: b""}
+    assert decode_options(b"") == {}
+
+
+def test_negotiation_follows_the_client_preference():
+    offered = compress.offer(["nope", "zlib"])
+    assert offered == bytes([CODECS["zlib"].id])
+    assert compress.choose(offered, ["zlib"]) is CODECS["zlib"]
+    assert compress.choose(offered, []) is None
+    assert compress.choose(b"\x7f", ["zlib"]) is None  # unknown codec ids are skipped
+
+
+def test_threshold_and_incompressible_messages_go_raw():
+    compressor = Compressor(CODECS["zlib"], threshold=100)
+    text = b"<p>compress me</p>" * 100
+    packed = compressor.encode(text)
+    assert packed[0] == CODECS["zlib"].id and len(packed) < len(text) // 5
+    assert compressor.decode(packed) == text
+
+    for message in (b"tiny", os.urandom(1000)):
+        framed = compressor.encode(message)
+        assert framed[0] == RAW and framed[1:] == message
+        assert compressor.decode(framed) == message
+
+
+def test_bad_data_is_a_value_error():
+    compressor = Compressor(CODECS["zlib"])
+    with pytest.raises(ValueError):
+        compressor.decode(bytes([CODECS["zlib"].id]) + b"not zlib")
+    with pytest.raises(ValueError):
+        compressor.decode(b"\x7fdata")
+
+
+def test_decompression_stops_at_max_size():
+    bomb = bytes([CODECS["zlib"].id]) + zlib.compress(bytes(10_000_000))
+    assert len(bomb) < 20_000
+    with pytest.raises(ValueError):
+        Compressor(CODECS["zlib"], max_size=1_000_000).decode(bomb)
+    assert len(Compressor(CODECS["zlib"], max_size=10_000_000).decode(bomb)) == 10_000_000
+    with pytest.raises(ValueError):
+        Compressor(CODECS["zlib"]).decode(bomb[:100])  # truncated
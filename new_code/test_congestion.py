@@ -0,0 +1,49 @@
+# test_congestion.py
+import pytest
+
+import congestion
+from congestion import NewReno, CongestionController, LOSS_WINDOW, MIN_CWND
+
+
+def test_slow_start_then_congestion_avoidance():
+    cc = NewReno(initial_cwnd=2)
+    cc.ssthresh = 8
+    cc.on_ack(2)
+    cc.on_ack(4)
+    assert cc.cwnd == 8  # doubles per round trip below ssthresh
+    cc.on_ack(8)
+    assert cc.cwnd == pytest.approx(9)  # about one segment per round trip above it
+
+
+def test_loss_halves_window_once_per_window():
+    cc = NewReno(initial_cwnd=20)
+    cc.on_loss(seq=5, next_seq=25)
+    assert cc.cwnd == cc.ssthresh == 10
+    cc.on_loss(seq=7, next_seq=25)  # same window of data
+    assert cc.cwnd == 10
+    cc.on_loss(seq=25, next_seq=40)  # sent after the reduction
+    assert cc.cwnd == 5
+
+
+def test_timeout_restarts_slow_start():
+    cc = NewReno(initial_cwnd=3)
+    cc.on_timeout(seq=0, next_seq=3)
+    assert cc.cwnd == LOSS_WINDOW
+    assert cc.ssthresh == MIN_CWND
+    assert cc.window == 1
+
+
+def test_pacing_rate_follows_cwnd_over_srtt():
+    assert NewReno().pacing_rate(0.1) is None
+    cc = NewReno(initial_cwnd=10, pacing=True)
+    assert cc.pacing_rate(None) is None
+    assert cc.pacing_rate(0.1) == pytest.approx(200)  # slow start gain 2
+
+
+def test_create():
+    assert isinstance(congestion.create("none"), CongestionController)
+    assert congestion.create("paced").pacing
+    cc = NewReno()
+    assert congestion.create(cc) is cc
+    with pytest.raises(ValueError):
+        congestion.create("cubic")
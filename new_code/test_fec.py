@@ -0,0 +1,59 @@
+# test_fec.py
+import os
+
+import pytest
+
+import fec
+
+
+def test_parity_count_follows_the_ratio():
+    assert fec.parity_count(8) == 1
+    assert fec.parity_count(8, 0.25) == 2
+    assert fec.parity_count(4, 0.01) == 1  # at least one
+    assert fec.parity_count(4, 2) == 4     # at most one per packet
+    with pytest.raises(ValueError):
+        fec.parity_count(0)
+    with pytest.raises(ValueError):
+        fec.parity_count(fec.MAX_BLOCK + 1)
+    with pytest.raises(ValueError):
+        fec.parity_count(8, 0)
+
+
+def test_xor_pads_the_shorter_payloads():
+    assert fec.xor([b"\x0f\xf0", b"\xff"]) == b"\xf0\xf0"
+    assert fec.xor([b"abc", b"abc"]) == b"\x00\x00\x00"
+    assert fec.xor([]) == b""
+
+
+def test_any_one_lost_packet_is_rebuilt():
+    block = [os.urandom(n) for n in (100, 37, 100, 0, 64)]
+    parity, = fec.encode(block, 1)
+    assert fec.parse(parity) == (1, len(block))
+    for lost in range(len(block)):
+        others = block[:lost] + block[lost + 1:]
+        assert fec.recover(parity, others) == block[lost]
+
+
+def test_interleaved_groups_survive_a_burst():
+    block = [os.urandom(50 + i) for i in range(8)]
+    parities = fec.encode(block, 2)
+    assert [fec.parse(parity) for parity in parities] == [(2, 4), (2, 4)]
+    # Packets 4 and 5 are lost: one from each group
+    for group, parity in enumerate(parities):
+        members = list(range(group, len(block), 2))
+        lost = 4 + group
+        assert fec.recover(parity, [block[i] for i in members if i != lost]) == block[lost]
+
+
+def test_short_block_gets_no_more_parity_than_packets():
+    assert len(fec.encode([b"x"], 4)) == 1
+
+
+def test_malformed_parity_is_rejected():
+    with pytest.raises(ValueError):
+        fec.parse(b"\x01")
+    with pytest.raises(ValueError):
+        fec.parse(b"\x00\x01\x00\x00")
+    parity, = fec.encode([b"ab", b"c"], 1)
+    with pytest.raises(ValueError):
+        fec.recover(parity, [b"much longer than anything in the group"])
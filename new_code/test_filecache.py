@@ -0,0 +1,122 @@
+# test_filecache.py
+import os
+
+import pytest
+
+from filecache import FileCache
+from segment import PreparedMessage, Reassembler, segment
+
+
+def write(path, data, mtime_ns=None):
+    path.write_bytes(data)
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_hits_until_the_file_changes(tmp_path):
+    write(tmp_path / "index.html", b"<h1>one</h1>", 10**18)
+    files = FileCache(tmp_path)
+    entry = files.lookup("/")
+    assert entry.data == b"<h1>one</h1>"
+    assert entry.content_type == "text/html"
+    assert b"Content-Length: 12\r\n" in entry.headers and entry.etag.encode() in entry.headers
+    assert files.lookup("/index.html?v=2") is entry
+    assert (files.hits, files.misses) == (1, 1)
+
+    write(tmp_path / "index.html", b"<h1>two</h1>", 2 * 10**18)
+    changed = files.lookup("/index.html")
+    assert changed.data == b"<h1>two</h1>" and changed.etag != entry.etag
+    assert files.misses == 2
+
+
+def test_missing_and_outside_files(tmp_path):
+    (tmp_path / "root").mkdir()
+    write(tmp_path / "secret", b"x")
+    files = FileCache(tmp_path / "root")
+    assert files.lookup("/../secret") is None
+    assert files.lookup("/nothing.txt") is None
+
+
+@pytest.mark.parametrize("target", ["/a\x00b", "/index.html\x00", "/\x01", "/a\nb", "/\x7f"])
+def test_control_characters_are_not_found(tmp_path, target):
+    write(tmp_path / "index.html", b"x")
+    files = FileCache(tmp_path)
+    assert files.resolve(target) is None
+    assert files.lookup(target) is None
+
+
+def test_lru_eviction_and_large_files(tmp_path):
+    for name in "abc":
+        write(tmp_path / name, name.encode() * 40)
+    write(tmp_path / "big", b"x" * 200)
+    files = FileCache(tmp_path, max_bytes=100)
+    files.lookup("/a")
+    files.lookup("/b")
+    files.lookup("/a")
+    files.lookup("/c")  # evicts b, the least recently used
+    assert set(files.entries) == {str(tmp_path / "a"), str(tmp_path / "c")}
+    assert files.cached_bytes == 80
+    big = files.lookup("/big")
+    assert big.data is None and big.size == 200  # streamed from disk instead
+
+
+def test_prepared_bodies_per_framing(tmp_path):
+    data = os.urandom(5000)
+    write(tmp_path / "blob.bin", data)
+    prepared = []
+
+    def prepare(content, framing=None):
+        prepared.append(framing)
+        return PreparedMessage(((seg, None) for seg in segment(content, 1000)), framing)
+
+    files = FileCache(tmp_path, prepare=prepare)
+    entry = files.lookup("/blob.bin")
+    assert entry.data == data and files.cached_bytes == 5000
+    body = files.body(entry)
+    assert isinstance(body, PreparedMessage) and len(body) == 5
+    assert files.body(files.lookup("/blob.bin")) is body  # prepared once
+    reassembler = Reassembler()
+    assert [reassembler.feed(payload) for payload, _ in body][-1] == data
+
+    other = files.body(entry, lambda content: prepare(content, "zlib"), framing="zlib")
+    assert other.framing == "zlib" and prepared == [None, "zlib"]
+    assert files.cached_bytes == 15000
+
+
+def test_conditional_get(tmp_path):
+    write(tmp_path / "a.txt", b"0123456789", 10**18)
+    entry = FileCache(tmp_path).lookup("/a.txt")
+
+    head, span = entry.respond("GET", {})
+    assert head.startswith(b"HTTP/1.1 200 ") and span == (0, 10)
+    head, span = entry.respond("GET", {"if-none-match": f'"other", W/{entry.etag}'})
+    assert head.startswith(b"HTTP/1.1 304 ") and span is None
+    assert entry.respond("GET", {"if-none-match": '"other"'})[1] == (0, 10)
+    assert entry.respond("GET", {"if-modified-since": entry.last_modified})[1] is None
+    assert entry.respond("GET", {"if-modified-since": "Mon, 01 Jan 1990 00:00:00 GMT"})[1] == (0, 10)
+    assert entry.respond("HEAD", {})[1] is None
+
+
+@pytest.mark.parametrize("spec, status, span", [
+    ("bytes=2-4", 206, (2, 5)),
+    ("bytes=7-", 206, (7, 10)),
+    ("bytes=-3", 206, (7, 10)),
+    ("bytes=5-100", 206, (5, 10)),
+    ("bytes=10-", 416, None),
+    ("bytes=1-2,4-5", 200, (0, 10)),  # multiple ranges: the whole file
+    ("bytes=x-", 200, (0, 10)),
+])
+def test_range_requests(tmp_path, spec, status, span):
+    write(tmp_path / "a.txt", b"0123456789")
+    entry = FileCache(tmp_path).lookup("/a.txt")
+    head, got = entry.respond("GET", {"range": spec})
+    assert head.startswith(f"HTTP/1.1 {status} ".encode()) and got == span
+    if status == 206:
+        assert f"Content-Range: bytes {span[0]}-{span[1] - 1}/10\r\n".encode() in head
+
+
+def test_if_range_resumes_only_the_same_version(tmp_path):
+    write(tmp_path / "a.txt", b"0123456789")
+    entry = FileCache(tmp_path).lookup("/a.txt")
+    assert entry.respond("GET", {"range": "bytes=4-", "if-range": entry.etag})[1] == (4, 10)
+    assert entry.respond("GET", {"range": "bytes=4-", "if-range": '"stale"'})[1] == (0, 10)
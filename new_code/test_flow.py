@@ -0,0 +1,44 @@
+# test_flow.py
+from flow import ReceiveWindow
+
+
+def test_window_shrinks_with_unread_data_and_reopens():
+    flow = ReceiveWindow(window_size=8, read_buffer=1000, mss=100)
+    assert flow.free() == 8
+    flow.unread = 950
+    assert flow.advertise(10) == 0
+    assert not flow.has_room(10, 10)
+    flow.unread = 0
+    # Any opening from zero is worth an update
+    assert flow.update_due()
+    assert flow.advertise(10) == 8
+    assert not flow.update_due()
+
+
+def test_update_waits_for_half_a_window():
+    flow = ReceiveWindow(window_size=8, read_buffer=800, mss=100)
+    flow.unread = 500
+    assert flow.advertise(0) == 3
+    flow.unread = 200
+    assert not flow.update_due()  # 6 free, 3 more than advertised
+    flow.unread = 100
+    assert flow.update_due()      # 7 free, 4 more
+
+
+def test_advertised_edge_never_moves_back():
+    flow = ReceiveWindow(window_size=8, read_buffer=800, mss=100)
+    assert flow.advertise(0) == 8
+    flow.unread = 800
+    # The sender may already have sent up to seq 7
+    assert flow.has_room(7, 0)
+    assert not flow.has_room(8, 0)
+    assert flow.advertise(2) == 0
+    assert flow.edge == 8
+    assert flow.has_room(7, 2)
+    assert not flow.has_room(1, 2)
+
+
+def test_initial_edge():
+    flow = ReceiveWindow(window_size=4, read_buffer=0, mss=100, edge=4)
+    assert flow.has_room(3, 0)
+    assert not flow.has_room(4, 0)
@@ -0,0 +1,104 @@
+# test_httpparser.py
+import pytest
+
+from httpparser import RequestParser, ResponseParser, ParseError, MAX_LINE
+
+REQUEST = (b"POST /submit?x=1 HTTP/1.1\r\nHost: example\r\nContent-Length: 11\r\n"
+           b"X-Tag: a\r\nx-tag: b\r\n\r\nHello=World")
+
+
+def test_parses_request_fed_byte_by_byte():
+    parser = RequestParser()
+    done = []
+    for i in range(len(REQUEST)):
+        done += parser.feed(REQUEST[i:i + 1])
+    assert len(done) == 1
+    request = done[0]
+    assert (request.method, request.target, request.path, request.version) == \
+        ("POST", "/submit?x=1", "/submit", "HTTP/1.1")
+    assert request.header("Host") == "example"
+    assert request.headers["x-tag"] == "a, b"
+    assert request.body == b"Hello=World"
+
+
+def test_several_requests_in_one_feed():
+    parser = RequestParser()
+    data = b"GET / HTTP/1.0\r\n\r\n" + REQUEST + b"GET /a HTTP/1.0\n\nGET /b"
+    done = parser.feed(data)
+    assert [r.target for r in done] == ["/", "/submit?x=1", "/a"]
+    assert parser.feed(b" HTTP/1.0\r\n\r\n")[0].target == "/b"
+
+
+def test_chunked_body_with_trailers():
+    parser = RequestParser()
+    data = (b"POST /up HTTP/1.1\r\nTransfer-Encoding: chunked\r\nContent-Length: 3\r\n\r\n"
+            b"5;ext=1\r\nHello\r\n7\r\n, World\r\n0\r\nX-Checksum: 1\r\n\r\n")
+    assert parser.feed(data[:40]) == []
+    request, = parser.feed(data[40:])
+    assert request.body == b"Hello, World"
+
+
+@pytest.mark.parametrize("data, status", [
+    (b"GET /\r\n\r\n", 400),
+    (b"GET / HTTP/2.0\r\n\r\n", 505),
+    (b"GET / HTTP/1.1\r\nNoColon\r\n\r\n", 400),
+    (b"POST / HTTP/1.1\r\nContent-Length: -1\r\n\r\n", 400),
+    (b"POST / HTTP/1.1\r\nTransfer-Encoding: gzip\r\n\r\n", 501),
+    (b"POST / HTTP/1.1\r\nContent-Length: \xb2\r\n\r\n", 400),  # a latin-1 superscript two
+    (b"POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\nzz\r\n", 400),
+    (b"POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n0x5\r\n", 400),
+    (b"POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n+5\r\n", 400),
+    (b"POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n1_0\r\n", 400),
+    (b"GET /" + b"a" * MAX_LINE, 414),
+])
+def test_malformed_requests(data, status):
+    with pytest.raises(ParseError) as error:
+        RequestParser().feed(data)
+    assert error.value.status == status
+
+
+def test_body_limit():
+    with pytest.raises(ParseError) as error:
+        RequestParser(max_body=10).feed(b"POST / HTTP/1.1\r\nContent-Length: 11\r\n\r\n")
+    assert error.value.status == 413
+
+
+@pytest.mark.parametrize("head, keep_alive", [
+    (b"GET / HTTP/1.1\r\n", True),
+    (b"GET / HTTP/1.1\r\nConnection: close\r\n", False),
+    (b"GET / HTTP/1.0\r\n", False),
+    (b"GET / HTTP/1.0\r\nConnection: Keep-Alive\r\n", True),
+])
+def test_keep_alive(head, keep_alive):
+    request, = RequestParser().feed(head + b"\r\n")
+    assert request.keep_alive is keep_alive
+
+
+def test_pipelined_responses_in_request_order():
+    parser = ResponseParser()
+    for method in ("GET", "HEAD", "GET", "GET"):
+        parser.expect(method)
+    data = (b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nhi"
+            b"HTTP/1.1 200 OK\r\nContent-Length: 99\r\n\r\n"  # HEAD: no body
+            b"HTTP/1.1 304 Not Modified\r\n\r\n"
+            b"HTTP/1.0 200\r\n\r\nto the end")
+    responses = parser.feed(data)
+    assert [(r.status, r.reason, r.body) for r in responses] == \
+        [(200, "OK", b"hi"), (200, "OK", b""), (304, "Not Modified", b"")]
+    last, = parser.feed(b" of the connection") + parser.close()
+    assert last.body == b"to the end of the connection"
+    assert not last.keep_alive
+
+
+def test_streamed_response_body():
+    parser = ResponseParser()
+    received = []
+    parser.expect("GET", on_body=lambda response, data: received.append((response.status, data)))
+    parser.expect("GET")
+    data = (b"HTTP/1.1 206 Partial Content\r\nTransfer-Encoding: chunked\r\n\r\n"
+            b"3\r\nabc\r\n2\r\nde\r\n0\r\n\r\n"
+            b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok")
+    first, second = parser.feed(data)
+    assert first.body == b"" and b"".join(data for _, data in received) == b"abcde"
+    assert {status for status, _ in received} == {206}
+    assert second.body == b"ok"
@@ -0,0 +1,42 @@
+# test_pacing.py
+import pytest
+
+from pacing import TokenBucket
+
+
+def test_unlimited_bucket_never_waits():
+    bucket = TokenBucket(rate=None, burst=1)
+    for _ in range(100):
+        assert bucket.delay() == 0
+        bucket.consume()
+
+
+def test_burst_then_rate():
+    bucket = TokenBucket(rate=100, burst=3)
+    now = bucket.stamp
+    for _ in range(3):
+        assert bucket.delay(now) == 0
+        bucket.consume(now)
+    assert bucket.delay(now) == pytest.approx(0.01)
+    assert bucket.delay(now + 0.01) == 0
+
+
+def test_refill_is_capped_at_burst():
+    bucket = TokenBucket(rate=1000, burst=2)
+    now = bucket.stamp + 10
+    bucket.consume(now)
+    bucket.consume(now)
+    assert bucket.delay(now) > 0
+
+
+def test_retransmissions_can_go_into_debt():
+    bucket = TokenBucket(rate=10, burst=1)
+    now = bucket.stamp
+    bucket.consume(now)
+    bucket.consume(now)
+    assert bucket.delay(now) == pytest.approx(0.2)
+
+
+def test_burst_must_hold_a_packet():
+    with pytest.raises(ValueError):
+        TokenBucket(rate=10, burst=0)
@@ -0,0 +1,37 @@
+# test_rtt.py
+from rtt import RTTEstimator
+
+
+def test_first_sample_initializes_estimates():
+    rtt = RTTEstimator(min_rto=0.0)
+    rtt.sample(0.1)
+    assert rtt.srtt == 0.1
+    assert rtt.rttvar == 0.05
+    assert abs(rtt.rto - 0.3) < 1e-9
+
+
+def test_rto_is_clamped():
+    rtt = RTTEstimator(min_rto=0.2, max_rto=1.0)
+    rtt.sample(0.001)
+    assert rtt.rto == 0.2
+    for _ in range(10):
+        rtt.backoff()
+    assert rtt.rto == 1.0
+
+
+def test_backoff_doubles_until_next_sample():
+    rtt = RTTEstimator(initial_rto=0.5, min_rto=0.1)
+    rtt.backoff()
+    assert rtt.rto == 1.0
+    rtt.sample(0.05)
+    assert rtt.rto < 1.0
+
+
+def test_restore_undoes_backoff():
+    rtt = RTTEstimator(min_rto=0.2)
+    rtt.sample(0.01)
+    rtt.backoff()
+    rtt.backoff()
+    assert rtt.rto == 0.8
+    rtt.restore()
+    assert rtt.rto == 0.2
@@ -0,0 +1,71 @@
+# test_segment.py
+import random
+import struct
+
+import pytest
+
+from segment import segment, Reassembler, SEGMENT_FORMAT
+
+
+def test_roundtrip_large_message():
+    data = bytes(random.getrandbits(8) for _ in range(10 * 1024))
+    segments = segment(data, 1000)
+    assert len(segments) == 11
+
+    reassembler = Reassembler()
+    results = [reassembler.feed(seg) for seg in segments]
+    assert results[:-1] == [None] * 10
+    assert results[-1] == data
+
+
+def test_duplicate_segment_does_not_finish_a_message():
+    data = bytes(range(256)) * 10
+    first, second, third = segment(data, 1000)
+    reassembler = Reassembler()
+    assert reassembler.feed(first) is None
+    assert reassembler.feed(second) is None
+    with pytest.raises(ValueError):
+        reassembler.feed(second)
+    assert reassembler.feed(third) == data
+
+
+def test_message_that_lost_a_segment_is_abandoned():
+    old, new = b"a" * 2500, b"b" * 2500
+    lost = segment(old, 1000)
+    reassembler = Reassembler()
+    assert reassembler.feed(lost[0]) is None
+    with pytest.raises(ValueError):
+        reassembler.feed(lost[2])  # lost[1] never came
+    # The next message of the same length starts afresh at offset 0
+    results = [reassembler.feed(seg) for seg in segment(new, 1000)]
+    assert results == [None, None, new]
+
+
+def test_segments_without_a_start_are_rejected():
+    data = b"x" * 2500
+    reassembler = Reassembler()
+    with pytest.raises(ValueError):
+        reassembler.feed(segment(data, 1000)[1])
+    assert reassembler.buffer is None
+
+
+def test_empty_message():
+    assert Reassembler().feed(segment(b"", 500)[0]) == b""
+
+
+def test_bad_segments_are_rejected_without_allocating():
+    reassembler = Reassembler(max_message=1000)
+    with pytest.raises(ValueError):
+        reassembler.feed(struct.pack(SEGMENT_FORMAT, 0, 2**32 - 1))  # claims 4 GiB
+    assert reassembler.buffer is None
+    with pytest.raises(ValueError):
+        reassembler.feed(b"\x00\x01")  # shorter than a segment header
+    with pytest.raises(ValueError):
+        reassembler.feed(struct.pack(SEGMENT_FORMAT, 10, 12) + b"xyz")  # past the end
+
+    # The message being rebuilt is unaffected
+    first, second = segment(b"a" * 600, 500)
+    assert reassembler.feed(first) is None
+    with pytest.raises(ValueError):
+        reassembler.feed(struct.pack(SEGMENT_FORMAT, 0, 5000))
+    assert reassembler.feed(second) == b"a" * 600
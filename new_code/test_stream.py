@@ -0,0 +1,42 @@
+# test_stream.py
+import io
+
+from stream import MessageStream, read_chunks
+
+
+def stream_of(*messages):
+    return MessageStream(iter(messages + (None,)).__next__)
+
+
+def test_readline_spans_messages():
+    stream = stream_of(b"HTTP/1.0 200 OK\r\nContent-", b"Length: 5\r\n", b"\r\nhello")
+    assert stream.readline() == b"HTTP/1.0 200 OK\r\n"
+    assert stream.readline() == b"Content-Length: 5\r\n"
+    assert stream.readline() == b"\r\n"
+    assert stream.readline(3) == b"hel"
+    assert stream.readline() == b"lo"
+    assert stream.readline() == b""
+
+
+def test_read_and_readinto():
+    stream = stream_of(b"abc", b"", b"defg", b"h")
+    assert stream.read(5) == b"abcde"  # across messages, not one at a time
+    buffer = bytearray(10)
+    assert stream.readinto(buffer) == 2
+    assert buffer[:2] == b"fg"
+    assert stream.read() == b"h"
+    assert stream.read(1) == b""
+
+
+def test_chunks_yield_the_rest_a_message_at_a_time():
+    stream = stream_of(b"head\nbody", b"more")
+    assert stream.readline() == b"head\n"
+    assert list(stream.chunks()) == [b"body", b"more"]
+
+
+def test_read_chunks_from_file_and_iterable():
+    source = io.BytesIO(b"x" * 10)
+    assert [bytes(chunk) for chunk in read_chunks(source, 4)] == [b"xxxx", b"xxxx", b"xx"]
+    assert list(read_chunks([b"a", b"", b"bc"])) == [b"a", b"bc"]
+    source.seek(3)
+    assert [bytes(chunk) for chunk in read_chunks(source, 4, limit=5)] == [b"xxxx", b"x"]
@@ -0,0 +1,197 @@
+# test_udp.py
+import os
+import threading
+
+import pytest
+
+from packet import Packet, FLAG_ACK, FLAG_SYN
+from udp import TCP, Listener, MSS, WINDOW_SIZE
+
+
+def connect(**options):
+    """A listener and a connected (client, server) pair on loopback"""
+    listener = Listener(port=0, **options)
+    accepted = []
+    thread = threading.Thread(target=lambda: accepted.append(listener.accept(timeout=5)))
+    thread.start()
+    client = TCP(port=listener.addr[1], **options)
+    assert client.hand_shake()
+    thread.join()
+    assert accepted[0] is not None
+    return listener, client, accepted[0]
+
+
+def receive(conn, count):
+    """Receive count messages on a thread; join it, then read the list"""
+    received = []
+
+    def run():
+        while len(received) < count:
+            message = conn.recv()
+            if message is None:
+                return
+            received.append(message)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread, received
+
+
+def drop_first(conn, offsets):
+    """Lose the first transmission of the DATA packets these many packets
+    past conn's next seq; returns their seqs"""
+    seqs = [conn.seq + offset for offset in offsets]
+    targets = set(seqs)
+    transmit = conn._transmit
+
+    def lossy(packet, flush=True):
+        if packet.is_data and packet.seq_num in targets:
+            targets.discard(packet.seq_num)
+            return
+        transmit(packet, flush)
+
+    conn._transmit = lossy
+    return seqs
+
+
+def echo(conn):
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        conn.send(message[::-1])
+    conn.close()
+
+
+def test_listener_serves_concurrent_clients():
+    listener = Listener(port=0)
+    results = {}
+
+    def serve():
+        while True:
+            conn = listener.accept(timeout=5)
+            if conn is None:
+                return
+            threading.Thread(target=echo, args=(conn,), daemon=True).start()
+
+    def client(i):
+        conn = TCP(port=listener.addr[1])
+        data = os.urandom(2000 + 100 * i)
+        results[i] = conn.hand_shake() and conn.send(data) and conn.recv() == data[::-1]
+        conn.close()
+
+    server = threading.Thread(target=serve, daemon=True)
+    server.start()
+    clients = [threading.Thread(target=client, args=(i,)) for i in range(10)]
+    try:
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join(30)
+        assert results == {i: True for i in range(10)}
+    finally:
+        listener.close()
+
+
+def test_accept_times_out_without_clients():
+    listener = Listener(port=0)
+    try:
+        assert listener.accept(timeout=0.05) is None
+    finally:
+        listener.close()
+
+
+def test_dispatch_by_peer_and_isn():
+    listener = Listener(port=0)
+    try:
+        addr = ('127.0.0.1', 40000)
+        # Not a SYN, from an unknown peer: nowhere to go
+        listener._dispatch(Packet(seq_num=1, ack_num=1, flags=FLAG_ACK).to_bytes(), addr)
+        assert not listener.connections and listener.pending.empty()
+
+        syn = Packet(seq_num=100, flags=FLAG_SYN).to_bytes()
+        listener._dispatch(syn, addr)
+        isn, conn_sock = listener.connections[addr]
+        assert isn == 100 and listener.pending.qsize() == 1
+
+        # A repeated SYN goes to the same connection
+        listener._dispatch(syn, addr)
+        assert listener.connections[addr][1] is conn_sock
+        assert listener.pending.qsize() == 1 and conn_sock.queue.qsize() == 2
+
+        # A new ISN from the same address is a new connection
+        listener._dispatch(Packet(seq_num=500, flags=FLAG_SYN).to_bytes(), addr)
+        assert listener.connections[addr][0] == 500
+        assert listener.connections[addr][1] is not conn_sock
+        assert listener.pending.qsize() == 2
+    finally:
+        listener.close()
+
+
+def test_window_sized_messages_survive_corruption():
+    listener, client, server = connect()
+    try:
+        client.set_corruption_rate(0.05)
+        server.set_corruption_rate(0.05)
+        messages = [os.urandom(WINDOW_SIZE * MSS - i) for i in range(6)] + [b"last"]
+        thread, received = receive(server, len(messages))
+        assert client.send_many(messages)
+        thread.join(30)
+        assert received == messages
+    finally:
+        client.close()
+        server.close()
+        listener.close()
+
+
+def test_lost_last_packet_is_resent_on_timeout(capsys):
+    listener, client, server = connect()
+    try:
+        drop_first(client, [0])
+        thread, received = receive(server, 1)
+        assert client.send(b"only packet")
+        thread.join(10)
+        assert received == [b"only packet"]
+        assert "[Send] Timeout for seq=" in capsys.readouterr().out
+    finally:
+        client.close()
+        server.close()
+        listener.close()
+
+
+@pytest.mark.parametrize("nack, reason", [(False, "3 duplicate ACKs"), (True, "NACK")])
+def test_lost_packet_is_resent_before_the_timeout(capsys, nack, reason):
+    listener, client, server = connect(nack=nack)
+    try:
+        data = os.urandom(10 * MSS)
+        lost, = drop_first(client, [2])
+        thread, received = receive(server, 1)
+        assert client.send(data)
+        thread.join(10)
+        assert received == [data]
+        out = capsys.readouterr().out
+        assert f"Fast retransmit of seq={lost} ({reason})" in out
+        assert "[Send] Timeout" not in out
+    finally:
+        client.close()
+        server.close()
+        listener.close()
+
+
+def test_partial_ack_resends_the_next_hole(capsys):
+    listener, client, server = connect()
+    try:
+        data = os.urandom(10 * MSS)
+        first, second = drop_first(client, [2, 5])
+        thread, received = receive(server, 1)
+        assert client.send(data)
+        thread.join(10)
+        assert received == [data]
+        out = capsys.readouterr().out
+        assert f"Fast retransmit of seq={first} (3 duplicate ACKs)" in out
+        assert f"Fast retransmit of seq={second} (partial ACK)" in out
+        assert "[Send] Timeout" not in out
+    finally:
+        client.close()
+        server.close()
+        listener.close()
@@ -2,14 +2,65 @@
 import socket
 import random
 import time
+import queue
+import struct
+import threading
+from collections import OrderedDict, deque
 from typing import Optional
-from packet import Packet
+from packet import (Packet, HEADER_SIZE, FLAGS_OFFSET, FLAG_SYN, FLAG_ACK, FLAG_FIN, FLAG_DATA, FLAG_NACK,
+                    OPT_COMPRESSION, OPT_CHECKSUM, encode_options, decode_options, WINDOW_FORMAT,
+                    WINDOW_FIELD_SIZE)
+from segment import segment, Reassembler, PreparedMessage, SEGMENT_HEADER_SIZE
+from rtt import RTTEstimator, MIN_RTO
+import congestion
+from pacing import TokenBucket, PACING_BURST
+from bulkio import BatchSocket
+from flow import ReceiveWindow
+from stream import MessageStream, read_chunks, STREAM_CHUNK
+import compress
+import checksum
 
 TIMEOUT = 8
+MAX_RTO = 3  # below TIMEOUT, so a backed-off sender still beats the peer's idle timeout
+WINDOW_SIZE = 8  # packets in flight
+HANDSHAKE_RETRIES = 3
+FIN_TIMEOUT = 1
+LISTENER_POLL = 0.5  # how often the Listener's reader thread checks for close()
+MAX_DATAGRAM = 1024
+MSS = MAX_DATAGRAM - HEADER_SIZE - 4 - SEGMENT_HEADER_SIZE  # header, checksum, segment header
+READ_BUFFER = 256 * 1024  # bytes of unread messages held before the window closes
+DUPACK_THRESHOLD = 3  # duplicate ACKs that trigger a fast retransmit
+
+class InFlight:
+    """A sent DATA packet awaiting its ACK"""
+    __slots__ = ("packet", "sent_at", "timer", "attempts", "probe")
+
+    def __init__(self, packet, sent_at, probe=False):
+        self.packet = packet
+        self.sent_at = sent_at  # last transmission, for RTT samples
+        self.timer = sent_at    # start of the retransmission timer
+        self.attempts = 1
+        self.probe = probe      # sent past the peer's advertised window
+
 
 class TCP:
-    def __init__(self, is_server=False, ip='127.0.0.1', port=12345):
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    def __init__(self, is_server=False, ip='127.0.0.1', port=12345, window_size=WINDOW_SIZE, window_bytes=None,
+                 min_rto=MIN_RTO, max_rto=MAX_RTO, congestion_control="newreno", pacing_rate=None, pacing_burst=PACING_BURST, offload=False,
+                 compression=compress.DEFAULT_CODECS, compress_threshold=compress.COMPRESS_THRESHOLD,
+                 read_buffer=READ_BUFFER, nack=False, checksums=checksum.DEFAULT_CHECKSUMS, sock=None):
+        # sock: a socket-like object to use instead of a new bound socket
+        # (Listener passes a ConnectionSocket for each accepted connection)
+        # offload: use UDP GSO/GRO where the kernel supports it (see bulkio)
+        # compression: codec names to negotiate in the handshake, best first
+        # (see compress); () or None never compresses
+        # read_buffer: bytes of received messages recv() hasn't returned
+        # yet before the peer is told to stop sending
+        # nack: flag the ACK for the first packet past a gap as a NACK, so
+        # the peer resends at once rather than after DUPACK_THRESHOLD
+        # duplicate ACKs (reordered packets then cost a needless resend)
+        # checksums: checksum algorithm names to negotiate in the handshake,
+        # best first (see checksum); crc32 is used if none is agreed on
+        self.socket = sock if sock is not None else BatchSocket(offload=offload)
         self.socket.settimeout(TIMEOUT)
 
         self.ip = ip
@@ -20,13 +71,69 @@ class TCP:
         self.ack_num = 0
         self.corruption_rate = 0.0
 
-        if is_server:
+        # Adaptive retransmission timeout; TIMEOUT stays the idle timeout of recv()
+        self.rtt = RTTEstimator(min_rto=min_rto, max_rto=max_rto)
+
+        # Congestion control: the window is min(window_size, cc.window).
+        # Sends are paced by a token bucket, at pacing_rate packets/s if
+        # given, else at the rate the controller asks for (if any)
+        self.cc = congestion.create(congestion_control)
+        self.pacing_rate = pacing_rate
+        self.pacer = TokenBucket(pacing_rate, pacing_burst)
+
+        # Sliding window: limit by packet count and optionally by payload bytes
+        self.window_size = window_size
+        self.window_bytes = window_bytes
+        self.recv_buffer = {}  # seq -> payload, out-of-order packets
+        self.ready = deque()   # complete messages not yet returned by recv()
+        self.reassembler = Reassembler()
+        self.peer_closed = False  # FIN received
+
+        # Flow control: every ACK carries the free space left in
+        # read_buffer, as segments past ack_num, and the sender keeps
+        # within what the peer advertised (see flow)
+        self.flow = ReceiveWindow(window_size, read_buffer, MSS)
+        self.send_limit = None      # first seq past the peer's window (None: not advertised)
+
+        self.nack = nack
+        self.nacked = None          # ack_num when a gap was last reported
+
+        # Payload compression, once the handshake has agreed on a codec
+        self.compression = tuple(compression or ())
+        self.compress_threshold = compress_threshold
+        self.compressor = None
+
+        # Packet checksums, crc32 until the handshake agrees on another
+        self.checksums = tuple(checksums or ())
+        self.checksum_algorithm = checksum.CRC32
+
+        if sock is None and is_server:
             self.socket.bind(self.addr)
             print(f"[Server] Listening on {self.addr}")
-        else:
+        elif sock is None:
             self.socket.bind(('0.0.0.0', 0))  # Client binds to ephemeral port
             print(f"[Client] ready to connect to {self.addr}")
 
+    @property
+    def srtt(self):
+        """Smoothed round-trip time in seconds (None before the first sample)"""
+        return self.rtt.srtt
+
+    @property
+    def rto(self):
+        """Current retransmission timeout in seconds"""
+        return self.rtt.rto
+
+    @property
+    def cwnd(self):
+        """Congestion window in segments"""
+        return self.cc.cwnd
+
+    @property
+    def ssthresh(self):
+        """Slow start threshold in segments"""
+        return self.cc.ssthresh
+
     def set_corruption_rate(self, rate):
         """Set probability of simulated packet corruption (0.0 to 1.0)"""
         self.corruption_rate = rate
@@ -37,45 +144,94 @@ class TCP:
     def _server_handshake(self):
         print("[Server] Waiting for SYN ..")
         try:
-            data, addr = self.socket.recvfrom(1024)
-            pkt = Packet.from_json(data.decode())
-            if pkt.flags.get("SYN"):
+            pkt, addr = self._recv_valid()
+            if pkt.is_syn:
                 print(f"[Server] SYN received from {addr}")
                 self.peer_addr = addr
 
+                # Take the first codec the client offers that we accept too
+                options = {}
+                codec = compress.choose(decode_options(pkt.payload).get(OPT_COMPRESSION, b""),
+                                        self.compression)
+                if codec is not None:
+                    self.compressor = compress.Compressor(codec, self.compress_threshold)
+                    options[OPT_COMPRESSION] = bytes([codec.id])
+                offered = decode_options(pkt.payload).get(OPT_CHECKSUM)
+                if offered:
+                    self.checksum_algorithm = checksum.choose(offered, self.checksums)
+                    options[OPT_CHECKSUM] = bytes([self.checksum_algorithm.id])
+
                 syn_ack = Packet(
                     seq_num=self.seq,
                     ack_num=pkt.seq_num + 1,
-                    flags={"SYN": True, "ACK": True, "FIN": False}
+                    flags=FLAG_SYN | FLAG_ACK,
+                    payload=encode_options(options)
                 )
-                self.socket.sendto(syn_ack.to_json().encode(), addr)
-
-                data, _ = self.socket.recvfrom(1024)
-                ack = Packet.from_json(data.decode())
-                if ack.flags.get("ACK"):
-                    print("[Server] Handshake complete")
-                    return True
+                self.socket.sendto(syn_ack.to_bytes(), addr)
+                sent_at = time.monotonic()
+                resent = False
+                self.seq += 1  # SYN consumes a sequence number
+                self.ack_num = pkt.seq_num + 1
+
+                while True:
+                    ack, _ = self._recv_valid()
+                    if ack.is_syn:
+                        # SYN-ACK was lost and the client retried its SYN
+                        self.socket.sendto(syn_ack.to_bytes(), addr)
+                        resent = True
+                        continue
+                    if ack.is_data:
+                        # Final ACK was lost but the client already sends data
+                        self._handle_data(ack, addr)
+                    if ack.is_ack or ack.is_data:
+                        if ack.is_ack and not resent:
+                            self.rtt.sample(time.monotonic() - sent_at)
+                        print("[Server] Handshake complete")
+                        return True
         except socket.timeout:
             print("[Server] Timeout waiting for handshake.")
         return False
 
     def _client_handshake(self):
-        syn = Packet(seq_num=self.seq, ack_num=0, flags={"SYN": True, "ACK": False, "FIN": False})
-        self.socket.sendto(syn.to_json().encode(), self.addr)
-
-        try:
-            data, addr = self.socket.recvfrom(1024)
-            pkt = Packet.from_json(data.decode())
-            if pkt.flags.get("SYN") and pkt.flags.get("ACK"):
-                print("[Client] received SYN-ACK")
-                self.peer_addr = addr
-
-                ack = Packet(seq_num=pkt.ack_num, ack_num=pkt.seq_num + 1, flags={"SYN": False, "ACK": True, "FIN": False})
-                self.socket.sendto(ack.to_json().encode(), addr)
-                print("[Client] Handshake complete")
-                return True
-        except socket.timeout:
-            print("[Client] Timeout waiting for SYN-ACK.")
+        offered = compress.offer(self.compression)
+        options = {OPT_COMPRESSION: offered} if offered else {}
+        checksums = checksum.offer(self.checksums)
+        if checksums:
+            options[OPT_CHECKSUM] = checksums
+        syn = Packet(seq_num=self.seq, ack_num=0, flags=FLAG_SYN, payload=encode_options(options))
+        self.seq += 1  # SYN consumes a sequence number
+
+        for attempt in range(HANDSHAKE_RETRIES):
+            self.socket.sendto(syn.to_bytes(), self.addr)
+            sent_at = time.monotonic()
+            self.socket.settimeout(self.rtt.rto)
+            try:
+                pkt, addr = self._recv_valid()
+                if pkt.is_syn and pkt.is_ack:
+                    print("[Client] received SYN-ACK")
+                    if attempt == 0:
+                        self.rtt.sample(time.monotonic() - sent_at)
+                    self.socket.settimeout(TIMEOUT)
+                    self.peer_addr = addr
+                    self.ack_num = pkt.seq_num + 1
+                    chosen_options = decode_options(pkt.payload)
+                    chosen = chosen_options.get(OPT_COMPRESSION, b"")
+                    if len(chosen) == 1 and chosen[0] in offered:
+                        self.compressor = compress.Compressor(compress.CODECS_BY_ID[chosen[0]],
+                                                              self.compress_threshold)
+                    chosen = chosen_options.get(OPT_CHECKSUM, b"")
+                    if len(chosen) == 1 and chosen[0] in checksums:
+                        self.checksum_algorithm = checksum.ALGORITHMS_BY_ID[chosen[0]]
+
+                    ack = Packet(seq_num=pkt.ack_num, ack_num=pkt.seq_num + 1, flags=FLAG_ACK,
+                                 algorithm=self.checksum_algorithm)
+                    self.socket.sendto(ack.to_bytes(), addr)
+                    print("[Client] Handshake complete")
+                    return True
+            except socket.timeout:
+                print(f"[Client] Timeout waiting for SYN-ACK (attempt {attempt + 1}).")
+                self.rtt.backoff()
+        self.socket.settimeout(TIMEOUT)
         return False
     
 
@@ -97,7 +253,7 @@ class TCP:
     #             self.socket.settimeout(1)
     #             ack_data, _ = self.socket.recvfrom(1024)
     #             ack_pkt = Packet.from_json(ack_data.decode())
-    #             if ack_pkt.flags.get("ACK") and ack_pkt.ack_num == packet.seq_num + 1:
+    #             if ack_pkt.is_ack and ack_pkt.ack_num == packet.seq_num + 1:
     #                 print(f"[Send] ACK received for seq={packet.seq_num}")
     #                 self.seq += 1
     #                 ack_received = True
@@ -109,40 +265,328 @@ class TCP:
 
     def send(self, data, max_retries=15):
         """Send data with checksum and retransmission on failure"""
-        original_packet = Packet(
-            seq_num=self.seq,
-            ack_num=self.ack_num,
-            flags={"DATA": True},
-            payload=data
-        )
-        
-       
-
-        for attempt in range(max_retries):
+        return self.send_many([data], max_retries=max_retries)
+
+    def sendfile(self, source, chunk_size=STREAM_CHUNK, max_retries=15):
+        """Stream a binary file object or an iterable of bytes as a series
+        of messages of at most chunk_size bytes, holding about one chunk
+        plus the send window in memory. The peer reads them back in order,
+        e.g. through makefile(). Returns the number of bytes sent, or None if
+        the transfer failed."""
+        sent = 0
+
+        def chunks():
+            nonlocal sent
+            for chunk in read_chunks(source, chunk_size):
+                sent += len(chunk)
+                yield chunk
+
+        return sent if self.send_many(chunks(), max_retries=max_retries) else None
+
+    def makefile(self):
+        """Binary file object reading the incoming messages as one byte
+        stream; it ends when recv() returns None (FIN, reset or timeout)"""
+        return MessageStream(self.recv)
+
+    @property
+    def framing(self):
+        """How this connection encodes and checksums messages: the
+        compressor's framing (None: as they are) and the checksum name"""
+        return self.compressor.framing if self.compressor else None, self.checksum_algorithm.name
+
+    def prepare(self, message):
+        """Compress (if negotiated), segment and checksum a message once, for
+        sending it any number of times with send_many() on this connection
+        or another with the same framing"""
+        if self.compressor:
+            message = self.compressor.encode(message)
+        compute = self.checksum_algorithm.compute
+        return PreparedMessage(((seg, compute(seg)) for seg in segment(message, MSS)), self.framing)
+
+    def _segments(self, message):
+        """(payload, payload checksum or None) pairs of a message"""
+        if isinstance(message, PreparedMessage):
+            if message.framing != self.framing:
+                raise ValueError("Message was prepared for a connection with other framing")
+            return message
+        if self.compressor:
+            message = self.compressor.encode(message)
+        return ((seg, None) for seg in segment(message, MSS))
+
+    def send_many(self, messages, max_retries=15):
+        """Send several messages pipelined through the sliding window.
+
+        Each message is split into MSS-sized segments carrying their offset
+        and the total message length, so recv() can rebuild it. Messages
+        from prepare() are sent as they are.
+
+        Up to ``window_size`` packets (and, if set, ``window_bytes`` bytes of
+        payload) are kept in flight. ACKs are cumulative: ``ack_num`` is the
+        next sequence number the receiver expects, so one ACK can release
+        several packets. On timeout only the oldest unacknowledged packet is
+        retransmitted, since everything after it is buffered by the receiver.
+        The receiver ACKs every packet, so packets arriving past a hole
+        repeat the same ACK: DUPACK_THRESHOLD duplicates (or one flagged as
+        a NACK) resend the oldest packet at once, about an RTT after the
+        loss instead of an RTO. ACKs that only cover part of the packets
+        sent before that resend the next hole as well (NewReno).
+
+        The congestion controller (``cc``) further limits the packets in
+        flight and may pace them; timeouts shrink its window. So does the
+        space the receiver advertises in its ACKs: when it has none left, a
+        single packet is sent as a probe and resent on the timer until an
+        ACK opens the window.
+        """
+        # Segments are produced as the window opens, so a long iterable of
+        # messages (see sendfile) is never held in memory all at once
+        payloads = (pair for message in messages for pair in self._segments(message))
+        next_payload = next(payloads, None)
+        in_flight = OrderedDict()  # seq -> InFlight
+        bytes_in_flight = 0
+        acked_at = 0  # when the last ACK arrived
+        dupacks = 0   # ACKs in a row for the oldest packet in flight
+        last_window = None
+        recover = None  # self.seq at the last fast retransmit, until ACKed past
 
-            packet_bytes = original_packet.to_bytes()
-             # Randomly simulate corruption based on corruption_rate
-            if random.random() < self.corruption_rate:
-                packet_bytes = Packet.corrupt_bytes(packet_bytes)
-            try:
-                self.socket.sendto(packet_bytes, self.peer_addr)
-                print(f"[Send] Sent packet (seq={original_packet.seq_num}), attempt {attempt+1}")
-
-                # Wait for ACK
-                ack_data, _ = self.socket.recvfrom(1024)
-                ack_packet = Packet.from_bytes(ack_data)
-                
-                if ack_packet.flags["ACK"] and ack_packet.ack_num == original_packet.seq_num + 1:
+        try:
+            while next_payload is not None or in_flight:
+                # Fill the window
+                while next_payload is not None and self._window_open(in_flight, bytes_in_flight,
+                                                                     len(next_payload[0])):
+                    packet = Packet(
+                        seq_num=self.seq,
+                        ack_num=self.ack_num,
+                        flags=FLAG_DATA,
+                        payload=next_payload[0],
+                        payload_checksum=next_payload[1],
+                        algorithm=self.checksum_algorithm
+                    )
+                    self._transmit(packet, flush=False)
+                    probe = self.send_limit is not None and self.seq >= self.send_limit
+                    in_flight[packet.seq_num] = InFlight(packet, time.monotonic(), probe)
+                    bytes_in_flight += len(packet.payload)
                     self.seq += 1
-                    return True
+                    next_payload = next(payloads, None)
+                    self._paced()
+                self.socket.flush()  # the new part of the window goes out together
+
+                now = time.monotonic()
+                pace = self.pacer.delay(now) if next_payload is not None else 0
+                if not in_flight:
+                    # Window open but held back by pacing
+                    time.sleep(pace)
+                    continue
+                base = next(iter(in_flight.values()))
+                deadline = base.timer + self.rtt.rto
+                wake = min(deadline, now + pace) if pace > 0 else deadline
+                try:
+                    if wake <= now:
+                        raise socket.timeout("timed out")
+                    self.socket.settimeout(wake - now)
+                    ack_packet, addr = self._recv_packet()
+                except (socket.timeout, ValueError) as e:
+                    if isinstance(e, ValueError):
+                        print(f"[Send] Error: {str(e)}, ignoring")
+                        continue
+                    if time.monotonic() < deadline:
+                        continue  # woke up to send the next paced packet
+                    if base.probe and acked_at >= base.sent_at:
+                        # The peer answered the probe, so it is there but
+                        # had no room; not a loss
+                        self._transmit(base.packet)
+                        base.sent_at = base.timer = time.monotonic()
+                        base.probe = base.packet.seq_num >= self.send_limit
+                        continue
+                    if base.attempts >= max_retries:
+                        print("[Send] Max retries reached, giving up")
+                        return False
+                    self.rtt.backoff()
+                    self.cc.on_timeout(base.packet.seq_num, self.seq)
+                    print(f"[Send] Timeout for seq={base.packet.seq_num}, retransmitting "
+                          f"(attempt {base.attempts + 1}, rto={self.rtt.rto:.3f}s)")
+                    self._transmit(base.packet)
+                    self.pacer.consume()
+                    now = time.monotonic()
+                    base.sent_at = now
+                    base.attempts += 1
+                    # Restart the timers of later packets so they are not
+                    # retransmitted before the hole has had a chance to fill
+                    for entry in in_flight.values():
+                        entry.timer = now
+                    continue
 
-            except (socket.timeout, ValueError) as e:
-                print(f"[Send] Error: {str(e)}, retrying...")
-                # time.sleep(0.2)
-                continue
+                if ack_packet.is_data:
+                    # Peer is sending too (e.g. our ACK to its data was lost)
+                    self._handle_data(ack_packet, addr)
+                    continue
+                if ack_packet.is_fin:
+                    self._handle_fin(ack_packet, addr)
+                    continue
 
-        print("[Send] Max retries reached, giving up")
-        return False
+                if ack_packet.is_ack:
+                    acked_at = time.monotonic()
+                    newest = None
+                    retransmitted = False
+                    acked = 0
+                    while in_flight and next(iter(in_flight)) < ack_packet.ack_num:
+                        _, newest = in_flight.popitem(last=False)
+                        bytes_in_flight -= len(newest.packet.payload)
+                        retransmitted |= newest.attempts > 1
+                        acked += 1
+                    if acked:
+                        self.cc.on_ack(acked)
+                    # Karn's rule: no sample if the ACK may be for a retransmission
+                    if newest is not None and not retransmitted:
+                        self.rtt.sample(time.monotonic() - newest.sent_at)
+                    elif newest is not None:
+                        self.rtt.restore()
+
+                    if ack_packet.is_syn:
+                        continue  # a late SYN-ACK
+                    window = None
+                    oldest = next(iter(in_flight)) if in_flight else self.seq
+                    if len(ack_packet.payload) >= WINDOW_FIELD_SIZE:
+                        window, = struct.unpack_from(WINDOW_FORMAT, ack_packet.payload)
+                        # Only an ACK for the oldest packet still out is
+                        # current; an older one may carry a stale window
+                        if ack_packet.ack_num == oldest:
+                            self.send_limit = ack_packet.ack_num + window
+                            if in_flight and in_flight[oldest].probe and oldest < self.send_limit:
+                                in_flight[oldest].timer = 0  # the window opened over a probe: resend it now
+
+                    if acked:
+                        dupacks = 0
+                        if recover is not None and ack_packet.ack_num >= recover:
+                            recover = None
+                        elif recover is not None and in_flight and in_flight[oldest].attempts == 1:
+                            self._fast_retransmit(in_flight[oldest], "partial ACK")
+                    elif (in_flight and ack_packet.ack_num == oldest and window == last_window
+                          and not in_flight[oldest].probe):
+                        dupacks += 1
+                        if recover is None and (dupacks >= DUPACK_THRESHOLD or ack_packet.is_nack):
+                            recover = self.seq
+                            self.cc.on_loss(oldest, self.seq)
+                            self._fast_retransmit(in_flight[oldest], "NACK" if ack_packet.is_nack
+                                                  else f"{dupacks} duplicate ACKs")
+                    last_window = window
+        finally:
+            self.socket.settimeout(TIMEOUT)
+
+        return True
+
+    def _fast_retransmit(self, entry, reason):
+        print(f"[Send] Fast retransmit of seq={entry.packet.seq_num} ({reason})")
+        self._transmit(entry.packet)
+        self.pacer.consume()
+        entry.sent_at = entry.timer = time.monotonic()
+        entry.attempts += 1
+
+    def _window_open(self, in_flight, bytes_in_flight, next_len):
+        if len(in_flight) >= min(self.window_size, self.cc.window):
+            return False
+        if self.pacer.delay() > 0:
+            return False
+        if self.window_bytes is not None and in_flight and bytes_in_flight + next_len > self.window_bytes:
+            return False
+        if self.send_limit is not None and self.seq >= self.send_limit and in_flight:
+            return False  # no room at the peer; with nothing out, send a probe
+        return True
+
+    def _paced(self):
+        """Take a pacing token for a packet that went out"""
+        if self.pacing_rate is None:
+            self.pacer.rate = self.cc.pacing_rate(self.rtt.srtt)
+        self.pacer.consume()
+
+    def _transmit(self, packet, flush=True):
+        """Send a packet, or with flush=False queue it for socket.flush()"""
+        packet_bytes = packet.to_bytes()
+        # Randomly simulate corruption based on corruption_rate
+        if random.random() < self.corruption_rate:
+            packet_bytes = Packet.corrupt_bytes(packet_bytes)
+        if flush:
+            self.socket.sendto(packet_bytes, self.peer_addr)
+        else:
+            self.socket.enqueue(packet_bytes, self.peer_addr)
+        print(f"[Send] Sent packet (seq={packet.seq_num})")
+
+    def _recv_packet(self):
+        """Receive one datagram and parse it without copying; the packet
+        points into the socket's receive buffers until the next receive"""
+        data, addr = self.socket.recvfrom_view()
+        return Packet.from_bytes(data, self.checksum_algorithm), addr
+
+    def _recv_valid(self):
+        """Receive the next packet that passes checksum verification"""
+        while True:
+            try:
+                return self._recv_packet()
+            except ValueError as e:
+                print(f"[Recv] Dropped corrupted packet: {str(e)}")
+
+    def _ack_packet(self, nack=False):
+        """Cumulative ACK advertising the free buffer space"""
+        return Packet(seq_num=self.seq, ack_num=self.ack_num, flags=FLAG_ACK | FLAG_NACK if nack else FLAG_ACK,
+                      payload=struct.pack(WINDOW_FORMAT, self.flow.advertise(self.ack_num)),
+                      algorithm=self.checksum_algorithm)
+
+    def _handle_data(self, packet, addr):
+        """Buffer a DATA packet that there is room for and answer with a
+        cumulative ACK"""
+        seq = packet.seq_num
+        nack = False
+        if not self.flow.has_room(seq, self.ack_num):
+            # A duplicate, or past the window we advertised
+            if seq > self.ack_num:
+                print(f"[Recv] No room for seq={seq}, expecting {self.ack_num}")
+        elif seq == self.ack_num:
+            # In-order payloads go straight from recv_buf into the message
+            self._deliver(packet.payload)
+            self.ack_num += 1
+            while self.ack_num in self.recv_buffer:
+                self._deliver(self.recv_buffer.pop(self.ack_num))
+                self.ack_num += 1
+        elif seq not in self.recv_buffer:
+            # recv_buf is reused, so out-of-order payloads must be copied
+            self.recv_buffer[seq] = bytes(packet.payload)
+            print(f"[Recv] Buffered out-of-order packet (seq={seq}), expecting {self.ack_num}")
+            if self.nack and self.nacked != self.ack_num:
+                self.nacked = self.ack_num  # a new gap
+                nack = True
+
+        self.socket.sendto(self._ack_packet(nack).to_bytes(), addr)
+
+    def _handle_fin(self, packet, addr):
+        print("[Recv] FIN received, peer closed the connection")
+        self.peer_closed = True
+        ack = Packet(seq_num=self.seq, ack_num=packet.seq_num + 1, flags=FLAG_ACK, algorithm=self.checksum_algorithm)
+        self.socket.sendto(ack.to_bytes(), addr)
+
+    def _deliver(self, payload):
+        try:
+            message = self.reassembler.feed(payload)
+        except ValueError as e:
+            print(f"[Recv] Dropped bad segment: {e}")
+            return
+        if message is None:
+            return
+        if self.compressor:
+            try:
+                message = self.compressor.decode(message)
+            except ValueError as e:
+                print(f"[Recv] Dropped undecodable message: {e}")
+                return
+        self.ready.append(message)
+        self.flow.unread += len(message)
+
+    def _next_ready(self):
+        """Hand the application the oldest complete message, and tell the
+        peer once the window has opened by a good part"""
+        message = self.ready.popleft()
+        self.flow.unread -= len(message)
+        if self.peer_addr is not None and self.flow.update_due():
+            self.socket.sendto(self._ack_packet().to_bytes(), self.peer_addr)  # window update
+        return message
 
 
 
@@ -169,37 +613,171 @@ class TCP:
 
 
     def recv(self):
-        """Receive data with checksum verification"""
+        """Receive one complete message with checksum verification"""
         while True:
+            if self.ready:
+                return self._next_ready()
             try:
-                data, addr = self.socket.recvfrom(1024)
-                try:
-                    packet = Packet.from_bytes(data)
-                    print(f"[Recv] Received valid packet (seq={packet.seq_num})")
-
-                    # Send ACK
-                    ack = Packet(
-                        seq_num=self.seq,
-                        ack_num=packet.seq_num + 1,
-                        flags={"ACK": True, }
-                    )
-                    self.socket.sendto(ack.to_bytes(), addr)
-                    
-                    self.ack_num = packet.seq_num + 1
-                    return packet.payload
-
-                except ValueError as e:
-                    print(f"[Recv] Dropped corrupted packet: {str(e)}")
-                    continue
+                packet, addr = self._recv_packet()
+            except ValueError as e:
+                print(f"[Recv] Dropped corrupted packet: {str(e)}")
+                continue
             except socket.timeout:
                 print("[Recv] Timeout waiting for packet")
                 return None
             except ConnectionResetError:
                 print("[Recv] Connection reset by peer")
                 return None
+
+            print(f"[Recv] Received valid packet (seq={packet.seq_num})")
+            if packet.is_data:
+                self._handle_data(packet, addr)
+            elif packet.is_fin:
+                self._handle_fin(packet, addr)
+                return None
         
 
 
     def close(self):
+        """Send FIN (unless the peer closed first) and close the socket"""
+        if self.peer_addr is not None and not self.peer_closed:
+            fin = Packet(seq_num=self.seq, ack_num=self.ack_num, flags=FLAG_FIN, algorithm=self.checksum_algorithm)
+            self.socket.settimeout(FIN_TIMEOUT)
+            for _ in range(HANDSHAKE_RETRIES):
+                try:
+                    self.socket.sendto(fin.to_bytes(), self.peer_addr)
+                    pkt, _ = self._recv_valid()
+                    if pkt.is_ack and pkt.ack_num == fin.seq_num + 1:
+                        print("[Connection] FIN acknowledged")
+                        break
+                except socket.timeout:
+                    continue
+                except ConnectionResetError:
+                    break
         print("[Connection] Closing socket.")
         self.socket.close()
+
+
+class ConnectionSocket:
+    """Socket-like view of one connection on a Listener's shared socket.
+
+    Datagrams for this connection are queued by the Listener; sends go
+    out through the shared socket. Supports just what TCP uses.
+    """
+
+    def __init__(self, listener, peer_addr):
+        self.listener = listener
+        self.peer_addr = peer_addr
+        self.queue = queue.Queue()
+        self.timeout = None
+        self.outbox = []  # (data, addr) waiting for flush()
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def recvfrom_view(self):
+        try:
+            return self.queue.get(timeout=self.timeout), self.peer_addr
+        except queue.Empty:
+            raise socket.timeout("timed out")
+
+    def sendto(self, data, addr):
+        return self.listener.socket.sendto(data, addr)
+
+    def enqueue(self, data, addr):
+        self.outbox.append((data, addr))
+
+    def flush(self):
+        outbox, self.outbox = self.outbox, []
+        for data, addr in outbox:
+            self.listener.socket.sendto(data, addr)
+
+    def close(self):
+        self.listener._remove(self.peer_addr, self)
+
+
+class Listener:
+    """Accept many TCP connections on one UDP port.
+
+    A reader thread demultiplexes datagrams onto per-connection queues keyed
+    by peer address, draining the shared socket a batch at a time (see
+    bulkio). The connection id is the client's initial sequence
+    number from its SYN: a repeated SYN goes to the existing connection, a
+    SYN with a new ISN from the same address (client restarted on the same
+    port) replaces it.
+    """
+
+    def __init__(self, ip='127.0.0.1', port=12345, backlog=128, offload=False, **tcp_options):
+        self.socket = BatchSocket(offload=offload)
+        self.socket.bind((ip, port))
+        self.addr = self.socket.getsockname()
+        self.tcp_options = tcp_options
+        self.connections = {}  # peer addr -> (isn, ConnectionSocket)
+        self.pending = queue.Queue(backlog)  # (isn, TCP) waiting for accept()
+        self.lock = threading.Lock()
+        self.running = True
+        self.reader = threading.Thread(target=self._read_loop, daemon=True)
+        self.reader.start()
+        print(f"[Server] Listening on {self.addr}")
+
+    def _read_loop(self):
+        while self.running:
+            try:
+                batch = self.socket.recv_batch(LISTENER_POLL)
+            except OSError:
+                break
+            for data, addr in batch:
+                # Connections read on their own threads, after the buffers
+                # have been reused
+                self._dispatch(bytes(data), addr)
+
+    def _dispatch(self, data, addr):
+        with self.lock:
+            entry = self.connections.get(addr)
+        isn = None
+        # Only unknown peers and SYNs need parsing here; the rest is queued raw
+        if entry is None or (len(data) > FLAGS_OFFSET and data[FLAGS_OFFSET] & FLAG_SYN):
+            try:
+                pkt = Packet.from_bytes(data)
+            except ValueError:
+                return
+            if pkt.is_syn and not pkt.is_ack:
+                isn = pkt.seq_num
+            elif entry is None:
+                return  # stray packet for an unknown connection
+
+        if isn is not None and (entry is None or entry[0] != isn):
+            conn_sock = ConnectionSocket(self, addr)
+            conn = TCP(is_server=True, sock=conn_sock, **self.tcp_options)
+            try:
+                self.pending.put_nowait((isn, conn))
+            except queue.Full:
+                print(f"[Server] Backlog full, dropping SYN from {addr}")
+                return
+            with self.lock:
+                self.connections[addr] = (isn, conn_sock)
+            entry = (isn, conn_sock)
+        entry[1].queue.put(data)
+
+    def accept(self, timeout=None):
+        """Wait for a client, complete its handshake and return its TCP
+        connection (None on timeout)"""
+        while True:
+            try:
+                _, conn = self.pending.get(timeout=timeout)
+            except queue.Empty:
+                return None
+            if conn.hand_shake():
+                return conn
+            conn.socket.close()
+
+    def _remove(self, addr, conn_sock):
+        with self.lock:
+            entry = self.connections.get(addr)
+            if entry is not None and entry[1] is conn_sock:
+                del self.connections[addr]
+
+    def close(self):
+        self.running = False
+        self.reader.join()
+        self.socket.close()
@@ -6,6 +6,9 @@ import random
 import sys
 import os
 import logging
+import contextlib
+import io
+import struct
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, 
@@ -13,7 +16,8 @@ logging.basicConfig(level=logging.INFO,
 logger = logging.getLogger('TestReliableUDP')
 
 # Import the ReliableUDP class
-from udp import ReliableUDP
+from udp import (ReliableUDP, RangeSet, seq_diff, unwrap, MAX_SEQ, MSS, DATA, WINDOW_SIZE,
+                 HEADER_FORMAT, CHECKSUM_SIZE, FEC_HISTORY)
 
 # Constants
 HOST = '127.0.0.1'
@@ -244,6 +248,281 @@ class TestReliableUDPHTTP(unittest.TestCase):
         self.assertIn("405 Method Not Allowed", response_str)
 
 
+class TestIdlePeers(unittest.TestCase):
+
+    def make(self, server_idle, client_idle):
+        self.server = ReliableUDP(timeout=0.1, loss_rate=0.0, idle_timeout=server_idle)
+        self.client = ReliableUDP(timeout=0.1, loss_rate=0.0, idle_timeout=client_idle)
+        self.server.bind((HOST, 0))
+        self.client.bind((HOST, 0))
+        self.addCleanup(self.server.close)
+        self.addCleanup(self.client.close)
+
+    def exchange(self, data):
+        """Send data from the client; what the server got and whether the
+        send returned"""
+        # reliable_send returns once ACKed, so the server must be reading
+        sender = threading.Thread(target=self.client.reliable_send,
+                                  args=(self.server.server.getsockname(), data), daemon=True)
+        sender.start()
+        received = None
+        deadline = time.monotonic() + 10
+        while received is None and time.monotonic() < deadline:
+            try:
+                received = self.server.reliable_recv()[0]
+            except socket.timeout:
+                pass
+        sender.join(10)
+        return received, not sender.is_alive()
+
+    def idle(self, end, seconds):
+        """Let end poll without traffic, so idle peers expire"""
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            end._poll(deadline)
+
+    def test_idle_peer_is_forgotten(self):
+        self.make(0.3, None)
+        self.assertEqual(self.exchange(b"hello"), (b"hello", True))
+        self.assertEqual(len(self.server.peers), 1)
+        self.idle(self.server, 1)
+        self.assertEqual(self.server.peers, {})
+
+    def test_server_forgot_client(self):
+        self.make(0.3, None)
+        self.assertEqual(self.exchange(b"one"), (b"one", True))
+        self.idle(self.server, 1)
+        # The client still numbers from where it was; the server's answer
+        # makes it start again
+        self.assertEqual(self.exchange(b"two"), (b"two", True))
+        self.assertEqual(self.exchange(b"three"), (b"three", True))
+
+    def test_client_forgot_server(self):
+        self.make(None, 0.3)
+        self.assertEqual(self.exchange(b"one"), (b"one", True))
+        self.idle(self.client, 1)
+        self.assertEqual(self.client.peers, {})
+        self.assertEqual(self.exchange(b"two"), (b"two", True))
+        self.assertEqual(self.exchange(b"three"), (b"three", True))
+
+    def test_both_forget_while_client_is_idle(self):
+        self.make(0.5, 0.5)
+        self.assertEqual(self.exchange(b"one"), (b"one", True))
+        # Only the server polls meanwhile; the client finds out once it sends
+        self.idle(self.server, 1.5)
+        self.assertEqual(self.exchange(b"two"), (b"two", True))
+        self.idle(self.client, 1)
+        self.idle(self.server, 1)
+        self.assertEqual(self.exchange(b"three"), (b"three", True))
+
+
+class TestChecksums(unittest.TestCase):
+
+    def test_sender_with_another_checksum_gets_crc32_acks(self):
+        receiver = ReliableUDP(timeout=0.5, loss_rate=0.0)
+        sender = ReliableUDP(timeout=0.5, loss_rate=0.0, checksums=("internet16",))
+        self.addCleanup(receiver.close)
+        self.addCleanup(sender.close)
+        receiver.bind((HOST, 0))
+        sender.bind((HOST, 0))
+        thread = threading.Thread(target=sender.reliable_send,
+                                  args=(receiver.server.getsockname(), b"hello"), daemon=True)
+        thread.start()
+        self.assertEqual(receiver.reliable_recv()[0], b"hello")
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+
+
+class TestSequenceNumbers(unittest.TestCase):
+
+    def test_seq_diff_across_wraparound(self):
+        self.assertEqual(seq_diff(5, 3), 2)
+        self.assertEqual(seq_diff(3, 5), -2)
+        self.assertEqual(seq_diff(2, MAX_SEQ - 3), 5)
+        self.assertEqual(seq_diff(MAX_SEQ - 3, 2), -5)
+        self.assertEqual(seq_diff(7, 7), 0)
+
+    def test_unwrap_new_seqs_past_2_32(self):
+        self.assertEqual(unwrap(MAX_SEQ - 2, 1), MAX_SEQ + 1)
+        self.assertEqual(unwrap(MAX_SEQ + 10, 12), MAX_SEQ + 12)
+        self.assertEqual(unwrap(3 * MAX_SEQ + 5, 5), 3 * MAX_SEQ + 5)
+
+    def test_unwrap_old_and_duplicate_seqs(self):
+        # Before the reference, across the wrap: an old segment resent
+        self.assertEqual(unwrap(MAX_SEQ + 1, MAX_SEQ - 3), MAX_SEQ - 3)
+        self.assertEqual(unwrap(100, 90), 90)
+        self.assertEqual(unwrap(MAX_SEQ, 0), MAX_SEQ)
+
+
+class TestRangeSet(unittest.TestCase):
+
+    def ranges(self, seqs):
+        ranges = RangeSet()
+        for seq in seqs:
+            ranges.add(seq)
+        return ranges.first(len(ranges))
+
+    def test_adjacent_seqs_merge(self):
+        self.assertEqual(self.ranges([5, 7, 6]), [(5, 8)])
+        self.assertEqual(self.ranges([3, 1, 2, 10, 9]), [(1, 4), (9, 11)])
+        self.assertEqual(self.ranges([4, 4, 3, 4]), [(3, 5)])
+
+    def test_ranges_stay_sorted_and_disjoint(self):
+        seqs = list(range(0, 39, 3)) + list(range(1, 39, 3))
+        random.Random(1).shuffle(seqs)
+        self.assertEqual(self.ranges(seqs), [(start, start + 2) for start in range(0, 39, 3)])
+
+    def test_discard_below(self):
+        ranges = RangeSet()
+        for seq in (2, 3, 4, 8, 9, 20):
+            ranges.add(seq)
+        ranges.discard_below(3)
+        self.assertEqual(ranges.first(10), [(3, 5), (8, 10), (20, 21)])
+        ranges.discard_below(10)
+        self.assertEqual(ranges.first(10), [(20, 21)])
+        ranges.discard_below(30)
+        self.assertEqual(len(ranges), 0)
+
+    def test_first(self):
+        self.assertEqual(RangeSet().first(4), [])
+        ranges = RangeSet()
+        for seq in (1, 5, 9):
+            ranges.add(seq)
+        self.assertEqual(ranges.first(2), [(1, 2), (5, 6)])
+
+
+class DropFirst(ReliableUDP):
+    """Drops the first transmission of the given (stream, seq) DATA packets"""
+
+    def __init__(self, drop, **kwargs):
+        super().__init__(**kwargs)
+        self.drop = set(drop)
+
+    def unreliable_sendto(self, packet, addr, flush=True):
+        flags, stream, seq = struct.unpack_from(HEADER_FORMAT, packet, CHECKSUM_SIZE)[:3]
+        if flags & DATA and (stream, seq) in self.drop:
+            self.drop.discard((stream, seq))
+            return
+        super().unreliable_sendto(packet, addr, flush)
+
+
+class TestLossRecovery(unittest.TestCase):
+
+    def setUp(self):
+        random.seed(7)
+        self.log = io.StringIO()
+        self.receiver = ReliableUDP(timeout=0.5, loss_rate=0.0)
+        self.receiver.bind((HOST, 0))
+        self.sockets = [self.receiver]
+
+    def tearDown(self):
+        for sock in self.sockets:
+            sock.close()
+
+    def sender(self, sender):
+        sender.bind((HOST, 0))
+        self.sockets.append(sender)
+        return sender
+
+    def send(self, sender, *args):
+        """Run sender.send_streams in the background"""
+        thread = threading.Thread(target=sender.send_streams,
+                                  args=(self.receiver.server.getsockname(),) + args, daemon=True)
+        thread.start()
+        return thread
+
+    def receive(self, count):
+        received = []
+        deadline = time.monotonic() + 20
+        while len(received) < count and time.monotonic() < deadline:
+            try:
+                data, _, stream = self.receiver.reliable_recv_stream()
+            except socket.timeout:
+                continue
+            received.append((stream, data))
+        return received
+
+    def test_sack_driven_retransmission(self):
+        sender = self.sender(ReliableUDP(timeout=0.5, loss_rate=0.05))
+        data = os.urandom(300 * MSS)
+        with contextlib.redirect_stdout(self.log):
+            thread = self.send(sender, {0: [data]})
+            received = self.receive(1)
+            thread.join(20)
+        self.assertEqual(received, [(0, data)])
+        self.assertFalse(thread.is_alive())
+        # Holes found through SACKs, not only on the timer
+        self.assertIn("fast retransmit", self.log.getvalue())
+
+    def test_streams_are_delivered_past_another_streams_hole(self):
+        # Stream 1's only segment is lost; stream 2's message goes out
+        # after it but needn't wait for its retransmission
+        sender = self.sender(DropFirst({(1, 0)}, timeout=0.5, loss_rate=0.0))
+        with contextlib.redirect_stdout(self.log):
+            thread = self.send(sender, {1: [b"first"], 2: [b"second"]})
+            received = self.receive(2)
+            thread.join(20)
+        self.assertEqual(received, [(2, b"second"), (1, b"first")])
+
+    def test_read_waits_out_a_retransmission(self):
+        # The only packet is lost and resent after the sender's RTO, which
+        # is longer than the receiver's but within its read_timeout
+        self.receiver.close()
+        self.receiver = ReliableUDP(timeout=0.2, loss_rate=0.0, read_timeout=3)
+        self.receiver.bind((HOST, 0))
+        self.sockets = [self.receiver]
+        sender = self.sender(DropFirst({(0, 0)}, timeout=0.6, loss_rate=0.0))
+        with contextlib.redirect_stdout(self.log):
+            thread = self.send(sender, {0: [b"late"]})
+            self.assertEqual(self.receiver.reliable_recv(), (b"late", sender.server.getsockname()))
+            thread.join(20)
+
+    def test_fec_copies_are_bounded_per_peer(self):
+        sender = self.sender(ReliableUDP(timeout=0.5, loss_rate=0.03, fec_block=8, fec_ratio=0.125))
+        messages = {stream: [os.urandom(200 * MSS)] for stream in range(1, 5)}
+        with contextlib.redirect_stdout(self.log):
+            thread = self.send(sender, messages)
+            received = self.receive(len(messages))
+            thread.join(20)
+        self.assertEqual(sorted(received), sorted((stream, data[0]) for stream, data in messages.items()))
+        peer, = self.receiver.peers.values()
+        self.assertEqual(len(peer.fec_cache), FEC_HISTORY)
+        self.assertIn("[FEC] Recovered", self.log.getvalue())
+
+    def test_zero_window_probe(self):
+        self.receiver.close()
+        self.receiver = ReliableUDP(timeout=0.5, loss_rate=0.0, read_buffer=4 * MSS)
+        self.receiver.bind((HOST, 0))
+        self.sockets = [self.receiver]
+        sender = self.sender(ReliableUDP(timeout=0.5, loss_rate=0.0))
+        messages = [os.urandom(MSS) for _ in range(100)]  # more than a window
+        with contextlib.redirect_stdout(self.log):
+            thread = self.send(sender, {0: messages})
+            # Take packets in without reading messages until the window closes
+            deadline = time.monotonic() + 10
+            flow = None
+            while time.monotonic() < deadline and not (flow and flow.advertised == 0):
+                self.receiver._poll(time.monotonic() + 0.05)
+                peer = self.receiver.last_peer
+                flow = peer.streams[0].flow if peer and 0 in peer.streams else None
+            self.assertEqual(flow.advertised, 0)
+            # What was sent in the first window before the first ACK is
+            # taken; after that the sender only probes the closed window,
+            # and nothing more is taken in until it opens
+            held = []
+            for _ in range(2):
+                deadline = time.monotonic() + 1.5
+                while time.monotonic() < deadline:
+                    self.receiver._poll(deadline)
+                held.append(len(self.receiver.ready))
+            self.assertEqual(held[0], held[1])
+            self.assertLessEqual(held[0], WINDOW_SIZE)
+            received = self.receive(len(messages))
+            thread.join(20)
+        self.assertEqual([data for _, data in received], messages)
+        self.assertFalse(thread.is_alive())
+        self.assertIn("timeout, retransmitting", self.log.getvalue())
+
 if __name__ == '__main__':
     # Set a fixed seed for reproducible tests
     random.seed(42)
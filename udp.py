@@ -1,116 +1,984 @@
+import os
 import socket
 import time
 import threading
 import random
 import struct
+import bisect
+import itertools
+from collections import OrderedDict, deque
 
+from new_code.segment import segment, Reassembler, PreparedMessage, SEGMENT_HEADER_SIZE
+from new_code.rtt import RTTEstimator, MIN_RTO
+from new_code import congestion
+from new_code.pacing import TokenBucket, PACING_BURST
+from new_code.bulkio import BatchSocket
+from new_code.stream import MessageStream, read_chunks, STREAM_CHUNK
+from new_code import fec
+from new_code import checksum
+from new_code.flow import ReceiveWindow
 
 SYN = 0x01
 ACK = 0x02
 FIN = 0x04
 DATA = 0x08
+NACK = 0x10  # on an ACK: the receiver just found a gap at the cumulative ACK
+FEC = 0x20   # parity of earlier DATA packets (see new_code/fec.py)
 
-WINDOW_SIZE = 5
-MAX_SEQ = 256
+WINDOW_SIZE = 64      # default segments in flight, per stream
+MAX_WINDOW = 1 << 16  # far below half the sequence space, as serial arithmetic needs
+SEQ_BITS = 32
+MAX_SEQ = 1 << SEQ_BITS
+SEQ_MASK = MAX_SEQ - 1
+# flags, stream id, seq (numbered per stream), the sender's epoch for the
+# receiver and the receiver's as far as the sender knows (0 before it has
+# heard from it); see ReliableUDP._sync
+HEADER_FORMAT = '!B H I I I'
+MAX_STREAMS = 1 << 16
+# Streams one peer may open. Each has its own read_buffer, out-of-order
+# window and message in reassembly, so this is what bounds a peer's memory;
+# streams live as long as the peer's state (see ReliableUDP.forget)
+PEER_STREAMS = 64
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
 TIMEOUT = 2
+MAX_RTO = 60
+MAX_DATAGRAM = 1024
+# Every packet starts with the id of its checksum algorithm and the
+# checksum (see new_code/checksum.py)
+CHECKSUM_FORMAT = '!B I'
+CHECKSUM_SIZE = struct.calcsize(CHECKSUM_FORMAT)
+# checksum, header, segment header; parity packets carry a FEC header in
+# place of the segment header, so there is room for that too
+MSS = MAX_DATAGRAM - CHECKSUM_SIZE - HEADER_SIZE - SEGMENT_HEADER_SIZE - fec.FEC_HEADER_SIZE
+
+# ACK policy: one cumulative ACK per ACK_EVERY in-order segments, or after
+# ACK_DELAY seconds; out-of-order and duplicate segments are ACKed at once
+ACK_EVERY = 2
+ACK_DELAY = 0.04
+# A segment is taken as lost, and resent without waiting for its timer,
+# once this many segments sent after it have been SACKed: the SACK form of
+# three duplicate ACKs (RFC 6675)
+DUPACK_THRESHOLD = 3
+SACK_FORMAT = '!I I'  # [start, end) of a buffered out-of-order range
+SACK_SIZE = struct.calcsize(SACK_FORMAT)
+# Every ACK starts with the receiver's free buffer space, in segments past
+# the cumulative ACK (flow control); the SACK blocks follow
+WINDOW_FORMAT = '!I'
+WINDOW_FIELD_SIZE = struct.calcsize(WINDOW_FORMAT)
+# As many blocks as fit in one ACK: with thousands of segments in flight a
+# handful would leave most of the buffered data looking lost to the sender
+MAX_SACK_BLOCKS = (MAX_DATAGRAM - CHECKSUM_SIZE - HEADER_SIZE - WINDOW_FIELD_SIZE) // SACK_SIZE
+
+# Complete messages a stream holds for the application before it closes
+# its window; one message in reassembly and window_size out-of-order
+# segments come on top of this
+READ_BUFFER = 256 * 1024
+
+# Checksums a ReliableUDP sends with (the first) and accepts. Nothing is
+# negotiated, so it sends crc32, which every peer has and always accepts;
+# crc32c, from an optional package, only goes out when asked for
+CHECKSUMS = ("crc32",) + tuple(name for name in checksum.DEFAULT_CHECKSUMS if name != "crc32")
+
+# Seconds a peer with nothing in flight may stay silent before its state
+# is dropped. There is no connection to close, so this is what frees a
+# client that has gone; if it comes back, the epochs in the header tell
+# both ends to start again from seq 0. Well above MAX_RTO, so a peer still
+# retransmitting isn't dropped.
+IDLE_TIMEOUT = 300
+
+# Segments a receiver keeps per peer for rebuilding a lost one from
+# parity, across the peer's streams. A parity packet follows its block at
+# once, so for one stream older ones are never needed; when several
+# streams send parity at once their oldest groups may be dropped and fall
+# back on retransmission, which keeps a peer's copies bounded however many
+# streams it opens.
+FEC_HISTORY = 2 * fec.MAX_BLOCK
+
+
+# Sequence numbers are kept as unbounded ints internally and only reduced
+# to SEQ_BITS on the wire; incoming numbers are unwrapped against a nearby
+# reference with serial number arithmetic (RFC 1982).
+
+def seq_diff(a, b):
+    """Signed distance from wire seq b to wire seq a"""
+    return ((a - b + MAX_SEQ // 2) & SEQ_MASK) - MAX_SEQ // 2
+
+
+def unwrap(ref, wire_seq):
+    """Absolute seq for wire_seq, taking the one closest to absolute ref"""
+    return ref + seq_diff(wire_seq, ref & SEQ_MASK)
+
+
+class RangeSet:
+    """Sorted, disjoint [start, end) ranges of sequence numbers"""
+
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+
+    def __len__(self):
+        return len(self.starts)
+
+    def add(self, seq):
+        i = bisect.bisect_right(self.starts, seq)
+        if i and self.ends[i - 1] > seq:
+            return  # already covered
+        joins_left = i and self.ends[i - 1] == seq
+        joins_right = i < len(self.starts) and self.starts[i] == seq + 1
+        if joins_left and joins_right:
+            self.ends[i - 1] = self.ends[i]
+            del self.starts[i], self.ends[i]
+        elif joins_left:
+            self.ends[i - 1] = seq + 1
+        elif joins_right:
+            self.starts[i] = seq
+        else:
+            self.starts.insert(i, seq)
+            self.ends.insert(i, seq + 1)
+
+    def discard_below(self, seq):
+        """Forget everything before seq"""
+        i = bisect.bisect_right(self.ends, seq)
+        del self.starts[:i], self.ends[:i]
+        if self.starts and self.starts[0] < seq:
+            self.starts[0] = seq
+
+    def first(self, n):
+        return list(zip(self.starts[:n], self.ends[:n]))
+
+
+class Outstanding:
+    """A sent DATA packet that is neither cumulatively ACKed nor SACKed"""
+    __slots__ = ("pkt", "sent_at", "attempts", "order", "probe")
+
+    def __init__(self, pkt, sent_at, order, probe=False):
+        self.pkt = pkt
+        self.sent_at = sent_at
+        self.attempts = 1
+        self.order = order  # first transmission, numbered across the peer's streams
+        self.probe = probe  # sent past the peer's window (see Stream.window_open)
+
+
+class Stream:
+    """One ordered sequence of messages to or from a peer.
+
+    Each stream numbers its segments on its own and is ACKed on its own, so
+    a lost segment only holds back the stream it belongs to; messages on
+    other streams keep being delivered. window_size bounds the stream's
+    segments in flight (sending) and buffered out of order (receiving).
+
+    Each side also tells the other how much it may send: every ACK carries
+    the receiver's free space, which shrinks as complete messages wait for
+    the application and grows as it reads them (see new_code/flow.py).
+
+    With forward error correction the sender follows each block of new
+    segments with parity packets. The receiver starts keeping copies of
+    the segments it gets once the first one arrives, and rebuilds a lost
+    segment from the rest of its group instead of waiting for it to be
+    resent.
+    """
+
+    def __init__(self, window_size, read_buffer=READ_BUFFER):
+        self.window_size = window_size
+
+        # Sending; sequence numbers are absolute (see unwrap)
+        self.seq = 0            # next sequence number to send
+        self.snd_una = 0        # oldest segment not cumulatively ACKed
+        self.sack_seen = {}     # SACK block start -> end already applied
+        self.send_limit = None  # first seq past the peer's advertised window, None before its first ACK
+        self.high_sacked = 0    # end of the highest range SACKed
+        self.fast_checked = 0   # segments below this were considered for fast retransmit
+        self.fec_block = []     # payloads of the new segments since the last parity packets
+        self.fec_start = 0      # seq of the first of them
+
+        # Receiving
+        self.expected_seq = 0
+        self.buffer = {}  # Buffer for out-of-order packets
+        self.sacked = RangeSet()  # buffered ranges beyond expected_seq
+        self.reassembler = Reassembler()
+        self.ack_pending = 0      # in-order segments not ACKed yet
+        self.ack_deadline = None  # when the delayed ACK must go out
+        # Free space advertised in ACKs; the sender may fill window_size
+        # segments before the first one
+        self.flow = ReceiveWindow(window_size, read_buffer, MSS, edge=window_size)
+        self.nacked = None        # expected_seq when a gap was last reported
+        self.nack_pending = False  # the next ACK reports a new gap
+        self.fec = False          # the sender sends parity: keep segments (see Peer.fec_cache)
+
+    def window_open(self):
+        """The peer has room for the next new segment. When it has none and
+        nothing is outstanding, one segment goes out anyway as a probe, so
+        a lost window update can't stall the stream: the peer drops it but
+        answers with its current window."""
+        return self.send_limit is None or self.seq < self.send_limit or self.seq == self.snd_una
+
+    def sack_blocks(self):
+        """Buffered out-of-order ranges as [start, end) pairs, nearest first"""
+        return self.sacked.first(MAX_SACK_BLOCKS)
+
+
+class Peer:
+    """Per-peer connection state, so several peers can share one socket.
+
+    Sequencing and ACKs are per stream (see Stream); the RTT estimate,
+    congestion window and pacing are shared by all streams to the peer.
+    At most max_streams streams are kept; packets that would open more are
+    dropped.
+    """
+
+    def __init__(self, rtt, window_size=WINDOW_SIZE, cc=None, pacer=None, read_buffer=READ_BUFFER,
+                 max_streams=PEER_STREAMS):
+        if not 0 < window_size <= MAX_WINDOW:
+            raise ValueError(f"window_size must be between 1 and {MAX_WINDOW}")
+        self.window_size = window_size
+        self.read_buffer = read_buffer  # per stream
+        self.max_streams = max_streams
+        self.streams = {}  # stream id -> Stream
+
+        # Sending
+        self.in_flight = OrderedDict()  # (stream id, seq) -> Outstanding, oldest transmission first
+        self.sent = 0           # segments sent for the first time, the congestion controller's numbering
+        self.cc = cc if cc is not None else congestion.create()
+        self.pacer = pacer if pacer is not None else TokenBucket()
+
+        # Receiving
+        self.rtt = rtt
+        self.acks = {}  # stream id -> Stream with an ACK scheduled
+        # (stream id, seq) -> payload of the latest segments of streams with
+        # FEC, oldest first; at most FEC_HISTORY of them
+        self.fec_cache = OrderedDict()
+        self.last_active = time.monotonic()  # when a packet last came from the peer
+        self.senders = 0        # send calls using this state, which is kept while there are any
+
+        # Epochs: this end's, picked when the state is created, and the
+        # peer's, from its packets (see ReliableUDP._sync)
+        self.epoch = int.from_bytes(os.urandom(4), "big") or 1
+        self.peer_epoch = None
+
+    def stream(self, stream_id):
+        """State for one stream, created on first use; ValueError if the
+        peer already has max_streams"""
+        stream = self.streams.get(stream_id)
+        if stream is None:
+            if not 0 <= stream_id < MAX_STREAMS:
+                raise ValueError(f"stream id must be between 0 and {MAX_STREAMS - 1}")
+            if len(self.streams) >= self.max_streams:
+                raise ValueError(f"peer already has {self.max_streams} streams")
+            stream = self.streams[stream_id] = Stream(self.window_size, self.read_buffer)
+        return stream
+
+    @property
+    def srtt(self):
+        """Smoothed round-trip time in seconds (None before the first sample)"""
+        return self.rtt.srtt
+
+    @property
+    def rto(self):
+        """Current retransmission timeout in seconds"""
+        return self.rtt.rto
+
+    @property
+    def cwnd(self):
+        """Congestion window in segments"""
+        return self.cc.cwnd
+
+    @property
+    def ssthresh(self):
+        """Slow start threshold in segments"""
+        return self.cc.ssthresh
+
+    def can_send(self, stream, now):
+        """Room for a new segment of stream in its own window, the window
+        the peer advertised for it and the peer's congestion window"""
+        return (stream.seq - stream.snd_una < stream.window_size
+                and stream.window_open()
+                and len(self.in_flight) < self.cc.window
+                and self.pacer.delay(now) == 0)
+
+    def schedule_ack(self, stream_id, stream, deadline):
+        """ACK stream no later than deadline (0: at the end of this batch)"""
+        if stream.ack_deadline is None or deadline < stream.ack_deadline:
+            stream.ack_deadline = deadline
+        self.acks[stream_id] = stream
+
 
 class ReliableUDP:
-    def __init__(self, timeout=2.0, loss_rate=0.1):
-        self.server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.seq = 0
-        self.ack = 0
+    def __init__(self, timeout=TIMEOUT, loss_rate=0.1, min_rto=MIN_RTO, max_rto=MAX_RTO, window_size=WINDOW_SIZE,
+                 congestion_control="newreno", pacing_rate=None, pacing_burst=PACING_BURST, offload=False,
+                 read_buffer=READ_BUFFER, nack=False, fec_block=0, fec_ratio=fec.FEC_RATIO,
+                 checksums=CHECKSUMS, max_streams=PEER_STREAMS, idle_timeout=IDLE_TIMEOUT, read_timeout=None):
+        # Datagrams are received a batch per wakeup and sent a window at a
+        # time; offload=True hands segmentation to the kernel (UDP GSO/GRO)
+        # where it is supported
+        self.server = BatchSocket(socket.socket(socket.AF_INET, socket.SOCK_DGRAM), max_datagram=MAX_DATAGRAM,
+                                  offload=offload)
         self.timeout_val = timeout
+        # How long reads wait for the next message; timeout by default. A
+        # peer's retransmissions back off from its initial RTO (2, 4, 8s..),
+        # so a reader that must ride out a lost packet wants a few of those
+        self.read_timeout = read_timeout if read_timeout is not None else timeout
+        self.window_size = window_size  # default for new peers; tune per peer via peer(addr)
+        # A full window can land in the socket before we read it; size the
+        # kernel buffer for it (the OS may cap this at net.core.rmem_max)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, window_size * MAX_DATAGRAM * 2)
         self.loss_rate = loss_rate
-        self.expected_seq = 0
-        self.buffer = {}  # Buffer for out-of-order packets
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+        self.congestion_control = congestion_control  # name or factory, one controller per peer
+        # Fixed pacing rate in packets per second; None follows the
+        # congestion controller (which only paces if it asks to)
+        self.pacing_rate = pacing_rate
+        self.pacing_burst = pacing_burst
+        # Bytes of unread messages each stream holds before telling its
+        # sender to wait (see new_code/flow.py), and how many streams a
+        # peer may open
+        self.read_buffer = read_buffer
+        self.max_streams = max_streams
+        # Flag the ACK for the first segment past a gap as a NACK, so the
+        # sender resends the gap at once instead of after DUPACK_THRESHOLD
+        # more segments; reordered packets then cost a needless resend
+        self.nack = nack
+        # Forward error correction: after every fec_block new segments of a
+        # stream, send fec_ratio parity packets per segment, so the peer can
+        # rebuild lost segments without a retransmission; 0 turns it off.
+        # Receiving parity needs no setting.
+        self.fec_block = fec_block
+        self.fec_parity = fec.parity_count(fec_block, fec_ratio) if fec_block else 0
+        # Checksum algorithm names: packets go out with the first and are
+        # accepted with any of them. There is no handshake, so each packet
+        # names its algorithm and a receiver drops those it doesn't accept;
+        # "none" skips checking, for trusted paths. crc32 is accepted
+        # whatever the list, since a peer with the defaults ACKs with it.
+        algorithms = [checksum.get(name) for name in checksums]
+        if not algorithms:
+            raise ValueError("At least one checksum algorithm is needed")
+        self.checksum_algorithm = algorithms[0]
+        self.accepted_checksums = {algorithm.id: algorithm for algorithm in algorithms + [checksum.CRC32]}
+        self.peers = {}         # addr -> Peer
+        self.last_peer = None   # most recently active peer
+        # Peers idle this long are forgotten (see IDLE_TIMEOUT); None keeps
+        # them until forget()
+        self.idle_timeout = idle_timeout
+        self.expire_at = time.monotonic() + idle_timeout if idle_timeout is not None else None
+        self.ready = deque()    # (message, addr, stream id) reassembled but not yet returned
         self.server.settimeout(timeout)
 
+    def peer(self, addr):
+        """State for addr, created on first contact"""
+        peer = self.peers.get(addr)
+        if peer is None:
+            # timeout is the RTO used before the first RTT sample (and the default read_timeout)
+            rtt = RTTEstimator(initial_rto=self.timeout_val, min_rto=self.min_rto, max_rto=self.max_rto)
+            cc = congestion.create(self.congestion_control)
+            pacer = TokenBucket(self.pacing_rate, self.pacing_burst)
+            peer = self.peers[addr] = Peer(rtt, self.window_size, cc, pacer, self.read_buffer,
+                                                self.max_streams)
+        self.last_peer = peer
+        return peer
+
+    def forget(self, addr):
+        """Drop the state kept for addr"""
+        peer = self.peers.pop(addr, None)
+        if peer is self.last_peer:
+            self.last_peer = None
+
+    def _expire_idle(self, now):
+        """Forget the peers with nothing in flight that have sent nothing
+        for idle_timeout; checked a few times per idle_timeout"""
+        self.expire_at = now + self.idle_timeout / 4
+        for addr in [addr for addr, peer in self.peers.items()
+                     if not peer.in_flight and not peer.senders and now - peer.last_active >= self.idle_timeout]:
+            print(f"[IDLE] Forgetting {addr}")
+            self.forget(addr)
+
+    def _sync(self, adr, flags, stream_id, epoch, our_epoch):
+        """Peer state for a packet, or None to drop it.
+
+        Each end numbers its state for a peer with an epoch, and every
+        packet carries the sender's and the receiver's as the sender knows
+        it. A new epoch from the peer means it dropped its state for this
+        end (see idle_timeout) and started again from seq 0, so this end
+        starts again too, keeping its own epoch. A packet for an epoch of
+        this end that is gone comes from state the peer still has: it is
+        dropped and answered with an ACK, whose epoch makes the peer start
+        again in turn. Send calls pick up the new state and resend what it
+        hasn't acknowledged."""
+        peer = self.peers.get(adr)
+        if peer is None:
+            if not flags & (DATA | FEC):
+                return None  # an ACK for state this end doesn't have
+            peer = self.peer(adr)
+        if peer.peer_epoch is None:
+            peer.peer_epoch = epoch
+        elif epoch != peer.peer_epoch:
+            print(f"[SYNC] {adr} started again")
+            own = peer.epoch
+            self.forget(adr)
+            peer = self.peer(adr)
+            peer.epoch, peer.peer_epoch = own, epoch
+        if our_epoch and our_epoch != peer.epoch:
+            if flags & (DATA | FEC):
+                try:
+                    stream = peer.stream(stream_id)
+                except ValueError:
+                    return None
+                print(f"[SYNC] {adr} has state this end dropped")
+                self._send_ack(adr, peer, stream_id, stream)
+            return None
+        return peer
+
+    @property
+    def srtt(self):
+        """Smoothed RTT of the most recently active peer"""
+        return self.last_peer.srtt if self.last_peer else None
+
+    @property
+    def rto(self):
+        """Retransmission timeout of the most recently active peer"""
+        return self.last_peer.rto if self.last_peer else self.timeout_val
+
+    @property
+    def cwnd(self):
+        """Congestion window of the most recently active peer"""
+        return self.last_peer.cwnd if self.last_peer else None
+
+    @property
+    def ssthresh(self):
+        """Slow start threshold of the most recently active peer"""
+        return self.last_peer.ssthresh if self.last_peer else None
+
     def bind(self, address):
         self.server.bind(address)
 
-    def checksum(self, data):
-        cs = sum(data) % 256
-        return struct.pack('!B', cs)
-
-    def unreliable_sendto(self, packet, addr):
+    def unreliable_sendto(self, packet, addr, flush=True):
+        """Send with simulated loss and duplication; flush=False only queues
+        the packet until the next self.server.flush()"""
         rand = random.random()
         if rand < self.loss_rate:
             print("[DROP] Simulated packet loss")
             return
         if rand < self.loss_rate * 2:
             print("[DUP] Simulated packet duplication")
-            self.server.sendto(packet, addr)
-        self.server.sendto(packet, addr)
+            self.server.enqueue(packet, addr)
+        self.server.enqueue(packet, addr)
+        if flush:
+            self.server.flush()
 
-    def reliable_send(self, adr, payload):
-        pkt = self.make_packet(DATA, self.seq, payload)
-        while True:
-            self.unreliable_sendto(pkt, adr)
-            try:
-                self.server.settimeout(self.timeout_val)
-                response, _ = self.server.recvfrom(1024)
-                parsed_pkt = self.parse_packet(response)
-                if parsed_pkt:
-                    flags, ack_seq, _ = parsed_pkt
-                    if (flags & ACK) and ack_seq == self.seq:
-                        self.seq = (self.seq + 1) % MAX_SEQ
+    def reliable_send(self, adr, payload, stream=0):
+        """Send one message on a stream with up to window_size segments in
+        flight.
+
+        The receiver answers with cumulative ACKs plus SACK blocks; each
+        segment has its own retransmission timer and only segments that are
+        neither cumulatively ACKed nor SACKed are retransmitted. The peer's
+        congestion controller limits the segments in flight (and may pace
+        them); losses and timeouts shrink its window.
+
+        payload may also be a message from prepare(), which is sent as is.
+        """
+        return self.send_many(adr, [payload], stream)
+
+    def send_many(self, adr, messages, stream=0):
+        """Send several messages to adr on one stream through one window,
+        without waiting for each to be acknowledged before starting the next"""
+        return self.send_streams(adr, {stream: messages})
+
+    def send_streams(self, adr, streams):
+        """Send to adr on several streams at once: streams maps stream ids to
+        iterables of messages (bytes or prepare() results). The streams
+        share the congestion window, taking turns segment by segment, and
+        are ordered and ACKed independently, so the peer gets each stream's
+        messages as soon as they are complete, whatever is lost on the
+        others."""
+        return self._send_segments(adr, {
+            stream_id: (pair for message in messages for pair in self._segments(message))
+            for stream_id, messages in streams.items()})
+
+    def _segments(self, message):
+        """(payload, payload checksum or None) pairs of a message"""
+        if isinstance(message, PreparedMessage):
+            if message.framing != self.checksum_algorithm.name:
+                raise ValueError("Message was prepared with another checksum")
+            return message
+        return ((seg, None) for seg in segment(message, MSS))
+
+    def prepare(self, message):
+        """Segment and checksum a message once, for sending it any number of
+        times with reliable_send() or send_many()"""
+        compute = self.checksum_algorithm.compute
+        return PreparedMessage(((seg, compute(seg)) for seg in segment(message, MSS)),
+                               self.checksum_algorithm.name)
+
+    def sendfile(self, adr, source, chunk_size=STREAM_CHUNK, stream=0):
+        """Stream a binary file object or an iterable of bytes to adr as a
+        series of messages of at most chunk_size bytes. The window stays
+        full across chunks while only about one chunk is held in memory;
+        the peer reads them back in order, e.g. through makefile(addr).
+        Returns the number of bytes sent."""
+        sent = 0
+
+        def segments():
+            nonlocal sent
+            for chunk in read_chunks(source, chunk_size):
+                sent += len(chunk)
+                for seg in segment(chunk, MSS):
+                    yield seg, None
+
+        self._send_segments(adr, {stream: segments()})
+        return sent
+
+    def _send_segments(self, adr, segments):
+        """Send (segment, payload checksum or None) pairs as DATA packets;
+        segments maps stream ids to iterators of pairs"""
+        segments = dict(segments)
+        peer = self.peer(adr)
+        peer.senders += 1
+        streams = {stream_id: peer.stream(stream_id) for stream_id in segments}
+        # The next segment of each stream with more to send, served in turn
+        pending = OrderedDict()
+        for stream_id, pairs in segments.items():
+            pair = next(pairs, None)
+            if pair is not None:
+                pending[stream_id] = pair
+        # (seq, pair) of the segments sent and not cumulatively ACKed
+        unacked = {stream_id: deque() for stream_id in segments}
+        try:
+            while pending or any(stream.snd_una != stream.seq for stream in streams.values()):
+                for stream_id, stream in streams.items():
+                    sent = unacked[stream_id]
+                    while sent and sent[0][0] < stream.snd_una:
+                        sent.popleft()
+                if self.peers.get(adr) is not peer:
+                    # The peer started again, or this end did (see _sync):
+                    # what it hasn't acknowledged goes out again in the new
+                    # state, numbered from 0
+                    peer.senders -= 1
+                    peer = self.peer(adr)
+                    peer.senders += 1
+                    for stream_id in segments:
+                        resend = [pair for _, pair in unacked[stream_id]]
+                        if stream_id in pending:
+                            resend.append(pending.pop(stream_id))
+                        unacked[stream_id].clear()
+                        segments[stream_id] = itertools.chain(resend, segments[stream_id])
+                        pair = next(segments[stream_id], None)
+                        if pair is not None:
+                            pending[stream_id] = pair
+                    streams = {stream_id: peer.stream(stream_id) for stream_id in segments}
+                # Fill the window, one segment per stream at a time; a stream
+                # whose own window is full waits without blocking the others
+                now = time.monotonic()
+                blocked = set()
+                while len(blocked) < len(pending) and len(peer.in_flight) < peer.cc.window \
+                        and peer.pacer.delay(now) == 0:
+                    stream_id, pair = next(iter(pending.items()))
+                    pending.move_to_end(stream_id)
+                    stream = streams[stream_id]
+                    if not peer.can_send(stream, now):
+                        blocked.add(stream_id)
+                        continue
+                    pkt = self.make_packet(peer, DATA, stream_id, stream.seq & SEQ_MASK, *pair)
+                    self.unreliable_sendto(pkt, adr, flush=False)
+                    probe = stream.send_limit is not None and stream.seq >= stream.send_limit
+                    peer.in_flight[stream_id, stream.seq] = Outstanding(pkt, now, peer.sent, probe)
+                    unacked[stream_id].append((stream.seq, pair))
+                    stream.seq += 1
+                    peer.sent += 1
+                    self._paced(peer)
+                    if self.fec_block:
+                        stream.fec_block.append(pair[0])
+                    pair = next(segments[stream_id], None)
+                    if pair is None:
+                        del pending[stream_id]
+                    else:
+                        pending[stream_id] = pair
+                    if self.fec_block and (len(stream.fec_block) == self.fec_block or pair is None):
+                        # A full block, or the stream's last one
+                        self._send_parity(adr, peer, stream_id, stream)
+                    now = time.monotonic()
+
+                # Retransmit the holes whose timers expired; in_flight is
+                # ordered by transmission time so they are all at the front
+                now = time.monotonic()
+                expired = []
+                for key, out in peer.in_flight.items():
+                    if out.sent_at + peer.rtt.rto > now:
                         break
-            except socket.timeout:
-                print("timeout, waiting for retransmission")
+                    expired.append(key)
+                if expired:
+                    # Segments holding up their stream's window come first
+                    heads, rest = [], []
+                    for key in expired:
+                        (heads if key[1] == peer.streams[key[0]].snd_una else rest).append(key)
+                    expired = heads + rest
+                    # Window probes are dropped by the peer on purpose; they
+                    # are resent on the timer but say nothing about the path
+                    lost = [key for key in expired if not peer.in_flight[key].probe]
+                    if lost and lost[0][1] == peer.streams[lost[0][0]].snd_una:
+                        # Back off only when a segment holding up its window
+                        # times out, so that holes further along can't push
+                        # its retransmission back indefinitely
+                        peer.rtt.backoff()
+                        peer.cc.on_timeout(peer.in_flight[lost[0]].order, peer.sent)
+                    elif lost:
+                        peer.cc.on_loss(min(peer.in_flight[key].order for key in lost), peer.sent)
+                    # Expired segments have left the network; resend as many
+                    # as the congestion window allows, the rest as it opens
+                    room = max(peer.cc.window - (len(peer.in_flight) - len(expired)), 1)
+                    print(f"timeout, retransmitting {min(room, len(expired))} of {len(expired)} "
+                          f"segment(s) (rto={peer.rtt.rto:.3f}s, cwnd={peer.cc.cwnd:.1f})")
+                    for key in expired[:room]:
+                        out = peer.in_flight[key]
+                        stream = peer.streams[key[0]]
+                        out.probe = stream.send_limit is not None and key[1] >= stream.send_limit
+                        self.unreliable_sendto(out.pkt, adr, flush=False)
+                        peer.pacer.consume(now)
+                        out.sent_at = now
+                        out.attempts += 1
+                        peer.in_flight.move_to_end(key)
+
+                deadline = now + peer.rtt.rto  # everything SACKed, waiting for the cumulative ACK
+                if peer.in_flight:
+                    oldest = next(iter(peer.in_flight.values())).sent_at + peer.rtt.rto
+                    if oldest > now:  # else held back by cwnd, the next ACK wakes us
+                        deadline = oldest
+                wait = peer.pacer.delay(now)
+                if pending and wait > 0:
+                    deadline = min(deadline, now + wait)  # next paced segment
+                self.server.flush()
+                self._poll(deadline)
+        finally:
+            peer.senders -= 1
+            self.server.flush()
+        return True
+
+    def _send_parity(self, adr, peer, stream_id, stream):
+        """Parity packets for the segments sent since the last ones. They
+        are not tracked or resent: a lost one only means its group falls
+        back on retransmission."""
+        start = stream.seq - len(stream.fec_block)
+        for group, payload in enumerate(fec.encode(stream.fec_block, self.fec_parity)):
+            self.unreliable_sendto(self.make_packet(peer, FEC, stream_id, (start + group) & SEQ_MASK, payload), adr,
+                                   flush=False)
+            peer.pacer.consume()
+        stream.fec_block = []
+
+    def _paced(self, peer):
+        """Take a pacing token for a new segment that went out"""
+        if self.pacing_rate is None:
+            peer.pacer.rate = peer.cc.pacing_rate(peer.rtt.srtt)
+        peer.pacer.consume()
 
     def reliable_recv(self):
-        full_data = b''
-        sender_addr = None
+        """Return the next complete message from any peer as (message, addr)"""
+        return self._recv_matching(lambda addr, stream: True)[:2]
+
+    def reliable_recv_stream(self):
+        """Return the next complete message from any peer and stream as
+        (message, addr, stream id)"""
+        return self._recv_matching(lambda addr, stream: True)
+
+    def recv_from(self, addr, stream=None):
+        """Return the next complete message from addr (on one stream if
+        given), leaving other messages for reliable_recv()"""
+        if stream is None:
+            return self._recv_matching(lambda source, _: source == addr)[0]
+        return self._recv_matching(lambda source, source_stream: (source, source_stream) == (addr, stream))[0]
+
+    def makefile(self, addr, stream=None):
+        """Binary file object reading the messages from addr (on one stream
+        if given) as one byte stream. The protocol has no end of stream, so
+        reads past the data the peer sent raise socket.timeout after
+        read_timeout."""
+        return MessageStream(lambda: self.recv_from(addr, stream))
+
+    def _recv_matching(self, wanted):
+        deadline = time.monotonic() + self.read_timeout
         while True:
-            pkt, adr = self.server.recvfrom(1024)
+            for i, entry in enumerate(self.ready):
+                if wanted(entry[1], entry[2]):
+                    del self.ready[i]
+                    self._consumed(*entry)
+                    return entry
+            if time.monotonic() >= deadline:
+                raise socket.timeout("timed out")
+            if self._poll(deadline):
+                # read_timeout is an idle timeout, as with a plain recvfrom
+                deadline = time.monotonic() + self.read_timeout
+
+    def _consumed(self, message, addr, stream_id):
+        """The application read a message: free its buffer space, and tell
+        the sender once its window has opened by a good part"""
+        peer = self.peers.get(addr)
+        stream = peer.streams.get(stream_id) if peer is not None else None
+        if stream is None:
+            return
+        stream.flow.unread -= len(message)
+        if stream.flow.update_due():
+            self._send_ack(addr, peer, stream_id, stream)  # window update
+            self.server.flush()
+
+    def _poll(self, deadline):
+        """Handle the next batch of incoming packets, waiting no later than
+        deadline (or the earliest delayed ACK), then send the ACKs that are
+        due, at most one per stream. Returns True if a packet arrived."""
+        wake = deadline
+        for peer in self.peers.values():
+            for stream in peer.acks.values():
+                if stream.ack_deadline < wake:
+                    wake = stream.ack_deadline
+        batch = self.server.recv_batch(max(wake - time.monotonic(), 0))
+        for pkt, adr in batch:
             parsed_pkt = self.parse_packet(pkt)
-            if not parsed_pkt:
-                continue
-            flags, seq, payload = parsed_pkt
-
-            if flags & DATA:
-                if sender_addr is None:
-                    sender_addr = adr
-
-                # Within window
-                window_end = (self.expected_seq + WINDOW_SIZE) % MAX_SEQ
-                in_window = (self.expected_seq <= seq < window_end) if self.expected_seq < window_end else (seq >= self.expected_seq or seq < window_end)
-
-                if in_window:
-                    if seq not in self.buffer:
-                        print(f"[RECV] Received seq={seq}")
-                        self.buffer[seq] = payload
-
-                    # Always ACK what we received
-                    ack_pkt = self.make_packet(ACK, seq)
-                    self.server.sendto(ack_pkt, adr)
-
-                    # Slide window and return data in order
-                    while self.expected_seq in self.buffer:
-                        full_data += self.buffer.pop(self.expected_seq)
-                        self.expected_seq = (self.expected_seq + 1) % MAX_SEQ
-
-                    if full_data:
-                        return full_data, sender_addr
-
-                else:
-                    # Packet outside window: send ACK anyway
-                    print(f"[OUT-OF-WINDOW] seq={seq}")
-                    ack_pkt = self.make_packet(ACK, seq)
-                    self.server.sendto(ack_pkt, adr)
-
-    def make_packet(self, flags, seq, payload=b''):
-        header = struct.pack('!B H', flags, seq)
-        body = header + payload
-        cs = self.checksum(body)
-        return cs + body
+            if parsed_pkt:
+                flags, stream_id, seq, epoch, our_epoch, payload = parsed_pkt
+                peer = self._sync(adr, flags, stream_id, epoch, our_epoch)
+                if peer is None:
+                    continue
+                if flags & DATA:
+                    self._on_data(adr, stream_id, seq, payload)
+                elif flags & FEC:
+                    self._on_parity(adr, stream_id, seq, payload)
+                elif flags & ACK:
+                    self._on_ack(adr, stream_id, seq, payload, flags & NACK)
+                peer.last_active = time.monotonic()
+
+        now = time.monotonic()
+        for adr, peer in self.peers.items():
+            for stream_id, stream in list(peer.acks.items()):
+                if stream.ack_deadline <= now:
+                    self._send_ack(adr, peer, stream_id, stream)
+        self.server.flush()
+        if self.expire_at is not None and now >= self.expire_at:
+            self._expire_idle(now)
+        return bool(batch)
+
+    def _on_ack(self, adr, stream_id, ack_seq, payload, nack=False):
+        peer = self.peers.get(adr)
+        stream = peer.streams.get(stream_id) if peer is not None else None
+        if stream is None:
+            return
+
+        if len(payload) < WINDOW_FIELD_SIZE:
+            return
+        window, = struct.unpack_from(WINDOW_FORMAT, payload)
+        acked = []  # Outstanding entries this ACK covers for the first time
+
+        # Cumulative part: everything before ack_seq has arrived
+        ack = unwrap(stream.snd_una, ack_seq)
+        if stream.snd_una <= ack <= stream.seq:
+            # Not an old ACK overtaken by later ones: its window is current
+            stream.send_limit = ack + window
+        if stream.snd_una < ack <= stream.seq:
+            for seq in range(stream.snd_una, ack):
+                out = peer.in_flight.pop((stream_id, seq), None)
+                if out is not None:
+                    acked.append(out)
+            stream.snd_una = ack
+            for start in [start for start in stream.sack_seen if start < ack]:
+                del stream.sack_seen[start]
+        probe = peer.in_flight.get((stream_id, stream.snd_una))
+        if probe is not None and probe.probe and stream.snd_una < stream.send_limit:
+            # The window has opened over a probe the peer dropped: resend it
+            # now rather than when its timer runs out
+            probe.sent_at = 0
+            peer.in_flight.move_to_end((stream_id, stream.snd_una), last=False)
+
+        # Selective part: ranges buffered beyond the hole(s)
+        first_start = None  # the nearest range, where the first hole ends
+        for offset in range(WINDOW_FIELD_SIZE, len(payload) - SACK_SIZE + 1, SACK_SIZE):
+            start, end = struct.unpack_from(SACK_FORMAT, payload, offset)
+            start = unwrap(stream.snd_una, start)
+            end = start + ((end - start) & SEQ_MASK)
+            if first_start is None or start < first_start:
+                first_start = start
+            stream.high_sacked = max(stream.high_sacked, min(end, stream.seq))
+            # Only walk the part of the block not applied by an earlier ACK
+            first = max(start, stream.snd_una, stream.sack_seen.get(start, start))
+            for seq in range(first, min(end, stream.seq)):
+                out = peer.in_flight.pop((stream_id, seq), None)
+                if out is not None:
+                    acked.append(out)
+            if end > stream.sack_seen.get(start, start):
+                stream.sack_seen[start] = end
+
+        if acked:
+            peer.cc.on_ack(len(acked))
+            # The most recently sent segment is the one that triggered this
+            # ACK; Karn's rule: only sample it if it was sent once
+            newest = max(acked, key=lambda out: out.sent_at)
+            if newest.attempts == 1:
+                peer.rtt.sample(time.monotonic() - newest.sent_at)
+            else:
+                peer.rtt.restore()
+
+        self._fast_retransmit(adr, peer, stream_id, stream, first_start if nack else None)
+
+    def _fast_retransmit(self, adr, peer, stream_id, stream, nack_end=None):
+        """Resend at once the segments the SACKs show lost: those with
+        DUPACK_THRESHOLD later segments SACKed, and with a NACK the ones
+        up to nack_end. Each is resent this way once; if that is lost too,
+        its timer catches it."""
+        limit = stream.high_sacked - DUPACK_THRESHOLD
+        if nack_end is not None:
+            limit = max(limit, nack_end)
+        limit = min(limit, stream.seq)
+        first = max(stream.snd_una, stream.fast_checked)
+        if limit <= first:
+            return
+        stream.fast_checked = limit
+        lost = []
+        for seq in range(first, limit):
+            out = peer.in_flight.get((stream_id, seq))
+            if out is not None and out.attempts == 1 and not out.probe:
+                lost.append((stream_id, seq))
+        if not lost:
+            return
+
+        peer.cc.on_loss(min(peer.in_flight[key].order for key in lost), peer.sent)
+        print(f"fast retransmit of {len(lost)} segment(s) on stream {stream_id} "
+              f"(cwnd={peer.cc.cwnd:.1f})")
+        now = time.monotonic()
+        for key in lost:
+            out = peer.in_flight[key]
+            self.unreliable_sendto(out.pkt, adr, flush=False)
+            peer.pacer.consume(now)
+            out.sent_at = now
+            out.attempts += 1
+            peer.in_flight.move_to_end(key)
+
+    def _on_data(self, adr, stream_id, seq, payload):
+        peer = self.peer(adr)
+        try:
+            stream = peer.stream(stream_id)
+        except ValueError as e:  # one stream too many
+            print(f"[RECV] Dropped packet for stream {stream_id} from {adr}: {e}")
+            return
+        seq = unwrap(stream.expected_seq, seq)
+
+        # Within window; past the window this end advertised there is no
+        # room, though the segment is still ACKed with the current window
+        if stream.flow.has_room(seq, stream.expected_seq):
+            in_order = seq == stream.expected_seq
+            if seq not in stream.buffer:
+                print(f"[RECV] Received stream={stream_id} seq={seq & SEQ_MASK}")
+                # payload points into the socket's batch buffers; keep a copy
+                # unless it is reassembled right away and not kept for FEC
+                if not in_order or stream.fec:
+                    payload = bytes(payload)
+                stream.buffer[seq] = payload
+                if stream.fec:
+                    self._fec_keep(peer, stream_id, seq, payload)
+                if not in_order:
+                    stream.sacked.add(seq)
+                    if self.nack and stream.nacked != stream.expected_seq:
+                        stream.nack_pending = True  # a new gap
+                        stream.nacked = stream.expected_seq
+
+            # Slide window and reassemble segments in order
+            completed = False
+            while stream.expected_seq in stream.buffer:
+                stream.expected_seq += 1
+                stream.ack_pending += 1
+                try:
+                    message = stream.reassembler.feed(stream.buffer.pop(stream.expected_seq - 1))
+                except ValueError as e:
+                    print(f"[RECV] Dropped bad segment stream={stream_id}: {e}")
+                    continue
+                if message is not None:
+                    self.ready.append((message, adr, stream_id))
+                    stream.flow.unread += len(message)
+                    completed = True
+            stream.sacked.discard_below(stream.expected_seq)
+
+            # Delay the ACK only for in-order data with nothing missing; the
+            # end of a message is ACKed at once since the sender waits on it.
+            # "At once" is at the end of the current batch, where _poll sends
+            # one ACK covering everything the batch brought
+            if not in_order or completed or stream.buffer or stream.ack_pending >= ACK_EVERY:
+                peer.schedule_ack(stream_id, stream, 0)
+            else:
+                peer.schedule_ack(stream_id, stream, time.monotonic() + ACK_DELAY)
+
+        else:
+            # Packet outside window (a duplicate, or no room for it): send ACK anyway
+            print(f"[OUT-OF-WINDOW] stream={stream_id} seq={seq & SEQ_MASK}")
+            peer.schedule_ack(stream_id, stream, 0)
+
+    @staticmethod
+    def _fec_keep(peer, stream_id, seq, payload):
+        """Keep a new segment for rebuilding others of its group"""
+        peer.fec_cache[stream_id, seq] = payload
+        if len(peer.fec_cache) > FEC_HISTORY:
+            peer.fec_cache.popitem(last=False)
+
+    def _on_parity(self, adr, stream_id, first, payload):
+        """A parity packet: rebuild the segment of its group that is
+        missing if it is the only one, and take it as if it had arrived"""
+        peer = self.peer(adr)
+        try:
+            stream = peer.stream(stream_id)
+        except ValueError as e:  # one stream too many
+            print(f"[RECV] Dropped packet for stream {stream_id} from {adr}: {e}")
+            return
+        if not stream.fec:
+            stream.fec = True  # the sender uses FEC: keep segments from now on
+            return
+        try:
+            stride, count = fec.parse(payload)
+        except ValueError:
+            return
+        first = unwrap(stream.expected_seq, first)
+        group = range(first, first + stride * count, stride)
+        missing = [seq for seq in group if seq >= stream.expected_seq and seq not in stream.buffer]
+        if len(missing) != 1:
+            return  # nothing lost, or more than parity can rebuild
+        others = [peer.fec_cache.get((stream_id, seq)) for seq in group if seq != missing[0]]
+        if None in others:
+            return  # some of the group arrived before the cache was started
+        try:
+            rebuilt = fec.recover(payload, others)
+        except ValueError:
+            return
+        print(f"[FEC] Recovered stream={stream_id} seq={missing[0] & SEQ_MASK}")
+        self._on_data(adr, stream_id, missing[0] & SEQ_MASK, rebuilt)
+
+    def _send_ack(self, adr, peer, stream_id, stream):
+        """Cumulative ACK of the stream's expected_seq with the free buffer
+        space and SACK blocks for its buffered ranges"""
+        payload = struct.pack(WINDOW_FORMAT, stream.flow.advertise(stream.expected_seq)) + b''.join(
+            struct.pack(SACK_FORMAT, start & SEQ_MASK, end & SEQ_MASK) for start, end in stream.sack_blocks())
+        flags = ACK | NACK if stream.nack_pending else ACK
+        self.server.enqueue(self.make_packet(peer, flags, stream_id, stream.expected_seq & SEQ_MASK, payload), adr)
+        stream.nack_pending = False
+        stream.ack_pending = 0
+        stream.ack_deadline = None
+        peer.acks.pop(stream_id, None)
+
+    def make_packet(self, peer, flags, stream, seq, payload=b'', payload_checksum=None):
+        """A packet to peer. payload_checksum is the checksum of payload
+        alone if already known; the checksum runs over the payload first, so
+        only the header needs adding to it"""
+        algorithm = self.checksum_algorithm
+        header = struct.pack(HEADER_FORMAT, flags, stream, seq, peer.epoch, peer.peer_epoch or 0)
+        if payload_checksum is None:
+            payload_checksum = algorithm.compute(payload)
+        return struct.pack(CHECKSUM_FORMAT, algorithm.id, algorithm.compute(header, payload_checksum)) \
+            + header + payload
 
     def parse_packet(self, packet):
-        if len(packet) < 4:
+        if len(packet) < CHECKSUM_SIZE + HEADER_SIZE:
+            return None
+        algorithm_id, cs_recv = struct.unpack_from(CHECKSUM_FORMAT, packet)
+        algorithm = self.accepted_checksums.get(algorithm_id)
+        if algorithm is None:
             return None
-        cs_recv, rest = packet[:1], packet[1:]
-        if self.checksum(rest) != cs_recv:
+        header = packet[CHECKSUM_SIZE:CHECKSUM_SIZE + HEADER_SIZE]
+        payload = packet[CHECKSUM_SIZE + HEADER_SIZE:]
+        if algorithm.compute(header, algorithm.compute(payload)) != cs_recv:
             return None
-        flags, seq = struct.unpack('!B H', rest[:3])
-        payload = rest[3:]
-        return flags, seq, payload
+        flags, stream, seq, epoch, our_epoch = struct.unpack(HEADER_FORMAT, header)
+        return flags, stream, seq, epoch, our_epoch, payload
+
+    def close(self):
+        self.server.close()